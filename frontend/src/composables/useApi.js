@@ -2,8 +2,9 @@
 import axios from "axios";
 import { API_BASE, API_HOST } from "@/const/uri";
 
-export async function fetchCities() {
-  const { data } = await axios.get(API_BASE.city);
+export async function fetchCities(params = {}) {
+  const { zoom, tolerance } = params;
+  const { data } = await axios.get(API_BASE.city, { params: { zoom, tolerance } });
   return data; // [{id,name,slug,feature}]
 }
 
@@ -34,13 +35,23 @@ export async function fetchSurveysByWaveCode(waveCode) {
   return await res.json();
 }
 
-export async function searchQuestions({ surveyId, q }) {
-  const url = new URL(`${API_HOST}/questions/`);
+export async function searchQuestions({ surveyId, waveCode, q, limit = 100, offset = 0 }) {
+  const url = new URL(`${API_HOST}/questions/search/`);
   if (surveyId) url.searchParams.set("survey_id", surveyId);
-  if (q) url.searchParams.set("q", q);
+  if (waveCode) url.searchParams.set("wave_code", waveCode);
+  url.searchParams.set("q", q || "");
+  url.searchParams.set("limit", limit);
+  url.searchParams.set("offset", offset);
   const res = await fetch(url.toString());
   if (!res.ok) throw new Error(`questions HTTP ${res.status}`);
-  return await res.json();
+  return await res.json(); // {query, mode, count, limit, offset, results: [{id, code, text, rank, highlight}]}
+}
+
+export async function fetchDashboard(params = {}) {
+  // one round trip for the main page: cities, surveys, metrics and grouped questions
+  const { wave, survey_id, city, zoom } = params;
+  const { data } = await axios.get(API_BASE.dashboard, { params: { wave, survey_id, city, zoom } });
+  return data; // {wave, survey_id, city, cities, surveys, metrics, questions}
 }
 
 export async function fetchGroupedQuestions(params = {}) {
@@ -50,3 +61,9 @@ export async function fetchGroupedQuestions(params = {}) {
   return res.data;
 }
 
+
+export async function fetchTimeseries(params = {}) {
+  // {metric} or {question, option}; optional level, city, waves, cadence
+  const { data } = await axios.get(API_BASE.timeseries, { params });
+  return data; // {waves: [...], series: [{slug, metric, question, option, points: [{wave, value, delta, rolling}]}]}
+}
@@ -9,4 +9,6 @@ export const API_BASE = {
   metric: `${API_HOST}/metrics/`,
   datapoint: `${API_HOST}/datapoints/`,
   choropleth: `${API_HOST}/choropleth/`,
+  timeseries: `${API_HOST}/timeseries`,
+  dashboard: `${API_HOST}/dashboard`,
 };
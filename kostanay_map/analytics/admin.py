@@ -1,11 +1,41 @@
-from django.contrib import admin
+from decimal import Decimal
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from django.db.models import F, Value
+
+from . import jobs, snapshots, tiles, timeseries
+from .cache import bump_models, mark_waves
+from .changelist import AutocompleteFilter, HighVolumeAdminMixin
+from .cube import refresh_cube
 from .models import (
-    Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, SavedView
+    Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, Job, SavedView
 )
 
 
+class GeometryOwnerForm(forms.ModelForm):
+    """Edits the outline as GeoJSON; saving a changed one stores a new Geometry row."""
+    feature = forms.JSONField(required=False, widget=forms.Textarea(attrs={"rows": 8}))
+
+    class Meta:
+        exclude = ("geometry",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial["feature"] = self.instance.feature
+
+    def save(self, commit=True):
+        if "feature" in self.changed_data:
+            self.instance.feature = self.cleaned_data["feature"]
+        return super().save(commit)
+
+
 @admin.register(Region)
 class RegionAdmin(admin.ModelAdmin):
+    form = GeometryOwnerForm
     list_display = ("name", "slug", "sort_order")
     search_fields = ("name", "slug")
     list_editable = ("sort_order",)
@@ -13,6 +43,7 @@ class RegionAdmin(admin.ModelAdmin):
 
 @admin.register(City)
 class CityAdmin(admin.ModelAdmin):
+    form = GeometryOwnerForm
     list_display = ("name", "slug", "region", "is_oblast", "sort_order")
     list_filter = ("region", "is_oblast")
     search_fields = ("name", "slug")
@@ -56,10 +87,18 @@ class SurveyWaveAdmin(admin.ModelAdmin):
     @admin.action(description="Lock selected waves")
     def lock_waves(self, request, qs):
         qs.update(is_locked=True)
+        mark_waves(qs, is_locked=True)
+        timeseries.refresh_waves(qs)
+        codes = sorted(qs.values_list("code", flat=True))
+        job = jobs.enqueue("build_snapshots", {"waves": codes}, user=request.user)
+        self.message_user(request, f"Snapshots of {', '.join(codes)} queued as job #{job.pk}")
 
     @admin.action(description="Unlock selected waves")
     def unlock_waves(self, request, qs):
         qs.update(is_locked=False)
+        mark_waves(qs, is_locked=False)
+        timeseries.refresh_waves(qs)
+        snapshots.remove(qs.values_list("code", flat=True))
 
 
 @admin.register(Metric)
@@ -69,19 +108,126 @@ class MetricAdmin(admin.ModelAdmin):
     search_fields = ("code", "name")
 
 
+VALUE_OPERATIONS = {
+    "set": lambda amount: Value(amount),
+    "add": lambda amount: F("value") + amount,
+    "multiply": lambda amount: F("value") * amount,
+}
+
+
+def edit_values(queryset, operation, amount):
+    """
+    Apply `operation` ("set", "add" or "multiply") with `amount` to every datapoint of the
+    queryset in one UPDATE, then rebuild the cube of the touched waves once.
+    Returns {(wave_code, metric_code): rows} of what was changed.
+    """
+    slices = {}
+    for wave_code, metric_code in queryset.order_by().values_list("wave__code", "metric__code"):
+        slices[wave_code, metric_code] = slices.get((wave_code, metric_code), 0) + 1
+    if not slices:
+        return slices
+    waves = list(SurveyWave.objects.filter(code__in={wave for wave, _ in slices}))
+    with transaction.atomic():
+        DataPoint.objects.filter(pk__in=queryset.order_by().values("pk")).update(value=VALUE_OPERATIONS[operation](amount))
+        refresh_cube(waves)
+        bump_models(DataPoint, waves=[w.code for w in waves])
+        for wave in waves:
+            tiles.invalidate_values(wave.code)
+        locked = [w for w in waves if w.is_locked]
+        if locked:
+            timeseries.refresh_waves(locked)
+    return slices
+
+
+class ValueEditForm(ActionForm):
+    operation = forms.ChoiceField(choices=[(op, op) for op in VALUE_OPERATIONS], required=False)
+    amount = forms.DecimalField(required=False, max_digits=10, decimal_places=2)
+
+
 @admin.register(DataPoint)
-class DataPointAdmin(admin.ModelAdmin):
-    list_display = ("wave", "who", "metric", "value", "question", "option")
-    list_filter = ("wave", "metric", "question", "city__region")
+class DataPointAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
+    list_display = ("id", "wave", "who", "metric", "value", "question", "option")
+    list_select_related = ("wave", "metric", "city", "region", "question", "option")
+    list_filter = (
+        ("wave", AutocompleteFilter), ("metric", AutocompleteFilter), ("question", AutocompleteFilter),
+        ("city", AutocompleteFilter), ("city__region", AutocompleteFilter),
+    )
     search_fields = ("city__name", "region__name", "metric__name", "question__text")
-    list_editable = ("value",)
     autocomplete_fields = ("city", "region", "question", "option", "metric", "wave")
+    ordering = ("-id",)
+    action_form = ValueEditForm
+    actions = ["edit_values"]
 
+    @admin.display(description="Where")
     def who(self, obj):
         return obj.city or obj.region
 
+    @admin.action(description="Edit values (operation and amount above) in one update")
+    def edit_values(self, request, queryset):
+        operation = request.POST.get("operation")
+        try:
+            amount = Decimal(request.POST.get("amount") or "")
+        except ArithmeticError:
+            amount = None
+        if operation not in VALUE_OPERATIONS or amount is None:
+            self.message_user(request, "Choose an operation and an amount", messages.ERROR)
+            return
+        slices = edit_values(queryset, operation, amount)
+        self.message_user(request, "Updated " + ", ".join(
+            f"{rows} values in {wave}/{metric}" for (wave, metric), rows in sorted(slices.items())
+        ) if slices else "Nothing to update")
+
 
 @admin.register(SavedView)
 class SavedViewAdmin(admin.ModelAdmin):
     list_display = ("name", "user", "created_at")
     search_fields = ("name", "user__email")
+
+
+class JobForm(forms.ModelForm):
+    kind = forms.ChoiceField(choices=())
+
+    class Meta:
+        model = Job
+        fields = ("kind", "params", "priority", "max_attempts")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["kind"].choices = [(kind, kind) for kind in sorted(jobs.TASKS)]
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    form = JobForm
+    list_display = ("id", "kind", "status", "progress", "eta", "attempts", "worker", "created_at", "finished_at")
+    list_filter = ("status", "kind")
+    readonly_fields = (
+        "status", "done", "total", "message", "result", "error", "attempts", "cancel_requested", "worker",
+        "created_by", "created_at", "run_after", "started_at", "heartbeat_at", "finished_at",
+    )
+    actions = ["cancel_jobs", "retry_jobs"]
+
+    @admin.display(description="Progress")
+    def progress(self, obj):
+        if obj.fraction is None:
+            return obj.done or "-"
+        return f"{obj.done}/{obj.total or obj.done} ({obj.fraction:.0%})"
+
+    @admin.display(description="ETA, s")
+    def eta(self, obj):
+        return obj.eta_seconds if obj.eta_seconds is not None else "-"
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description="Cancel selected jobs")
+    def cancel_jobs(self, request, qs):
+        cancelled = sum(jobs.cancel(job) for job in qs)
+        self.message_user(request, f"Cancelled or asked to stop: {cancelled}")
+
+    @admin.action(description="Retry selected failed or cancelled jobs")
+    def retry_jobs(self, request, qs):
+        queued = sum(jobs.retry(job) for job in qs)
+        self.message_user(request, f"Queued again: {queued}")
@@ -0,0 +1,92 @@
+from .cube import choropleth
+from .models import Question, DataPoint
+
+
+def question_queryset(wave_code=None, survey_id=None):
+    qs = Question.objects.all()
+    if survey_id:
+        qs = qs.filter(survey_id=survey_id)
+    if wave_code:
+        qs = qs.filter(survey__wave__code=wave_code)
+    return qs
+
+
+def pivot_datapoints(rows):
+    """
+    rows: (question_id, city_name, option_label, metric_name, metric_unit, value)
+    Returns {question_id: {"metric": (name, unit), "cities": {city: {label: value}}}}
+    """
+    matrices = {}
+    for question_id, city, label, metric_name, metric_unit, value in rows:
+        matrix = matrices.get(question_id)
+        if matrix is None:
+            matrix = matrices[question_id] = {"metric": (metric_name, metric_unit), "cities": {}}
+        cells = matrix["cities"].setdefault(city or "—", {})
+        if label is not None:
+            cells[label] = float(value)
+    return matrices
+
+
+def _grouped_querysets(wave_code=None, survey_id=None, city_slug=None, cities=None):
+    """
+    `cities` ([{"id", "slug", "name"}], e.g. an already built city list) replaces
+    the DataPoint -> City join: rows carry city_id and are named from the list.
+    """
+    questions = question_queryset(wave_code, survey_id)
+    datapoints = DataPoint.objects.filter(question__in=questions.values("id"))
+    if wave_code:
+        datapoints = datapoints.filter(wave__code=wave_code)
+    if city_slug and cities is not None:
+        datapoints = datapoints.filter(city_id__in=[c["id"] for c in cities if c["slug"] == city_slug])
+    elif city_slug:
+        datapoints = datapoints.filter(city__slug=city_slug)
+    rows = datapoints.order_by("id").values_list(
+        "question_id", "city__name" if cities is None else "city_id", "option__label", "metric__name", "metric__unit", "value",
+    )
+    return questions.values("id", "text", "category"), rows
+
+
+def _named(rows, cities):
+    if cities is None:
+        return rows
+    names = {c["id"]: c["name"] for c in cities}
+    return ((question_id, names.get(city_id), *rest) for question_id, city_id, *rest in rows)
+
+
+def _grouped_result(questions, matrices):
+    result = []
+    for q in questions:
+        matrix = matrices.get(q["id"])
+        metric_name, metric_unit = matrix["metric"] if matrix else ("", "")
+        cities = matrix["cities"] if matrix else {}
+        result.append({
+            "id": q["id"],
+            "question": q["text"],
+            "category": q["category"],
+            "metric_name": metric_name or "",
+            "metric_unit": metric_unit or "",
+            "city_values": [{"city": city, **values} for city, values in cities.items()],
+        })
+    return result
+
+
+def grouped_questions(wave_code=None, survey_id=None, city_slug=None):
+    """
+    Questions with per-city option values, two queries regardless of question count:
+    one for the questions, one for every matching DataPoint.
+    """
+    questions, rows = _grouped_querysets(wave_code, survey_id, city_slug)
+    matrices = pivot_datapoints(rows.iterator())
+    return _grouped_result(questions, matrices)
+
+
+async def agrouped_questions(wave_code=None, survey_id=None, city_slug=None, cities=None):
+    """grouped_questions through the async ORM; see _grouped_querysets for `cities`."""
+    questions, rows = _grouped_querysets(wave_code, survey_id, city_slug, cities)
+    matrices = pivot_datapoints(_named([row async for row in rows], cities))
+    return _grouped_result([q async for q in questions], matrices)
+
+
+def choropleth_values(metric_code, wave_code, level="city"):
+    """[(slug, value), ...]: average DataPoint value per city (or region) for one metric and wave."""
+    return [(slug, average) for slug, average, *_ in choropleth([metric_code], wave_code, level)[metric_code]]
@@ -0,0 +1,99 @@
+"""
+Async read endpoints for ASGI deployments (core.asgi).
+
+Plain Django async views over the async ORM: a slow aggregation awaits its
+queries instead of holding a worker thread, and the `async_cached` decorator
+applies the same ETag / body cache as CachedResponseMixin. Bodies are the same
+JSON the sync endpoints render. Django still runs each request's queries on one
+database thread, so `dashboard` overlaps its parts with each other and with
+other requests rather than running them on parallel connections.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse
+
+from .. import rollup
+
+from ..aggregation import agrouped_questions
+from ..cache import async_cached
+from ..cube import achoropleth
+from ..dashboard import DASHBOARD_MODELS, DEFAULT_ZOOM, build as build_dashboard
+from ..models import Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, ChoroplethCell
+from ..profiling import timed
+from .fast import FastList, dumps
+from .serializers import CitySerializer
+from .views import choropleth_data, choropleth_params, rollup_data, rollup_params
+
+CITY_MODELS = (City, Region)
+GROUPED_MODELS = (Question, Survey, SurveyWave, DataPoint, AnswerOption, Metric, City)
+
+
+def json_response(data, status=200):
+    with timed():
+        content = dumps(data)
+    return HttpResponse(content, content_type="application/json", status=status)
+
+
+def _bad_request(detail):
+    return JsonResponse({"detail": detail}, status=400)
+
+
+async def _cities(region_slug=None):
+    qs = City.objects.select_related("region").order_by("region__sort_order", "sort_order")
+    if region_slug:
+        qs = qs.filter(region__slug=region_slug)
+    return await FastList(CitySerializer).adata(qs)
+
+
+@async_cached(models=(ChoroplethCell, DataPoint), wave_param="wave")
+async def choropleth_view(request):
+    """GET /api/async/choropleth: ChoroplethView (JSON only) on the async ORM; weighted=1 runs the rollup in a thread."""
+    metrics, wave, level, with_stats = choropleth_params(request.GET)
+    if not metrics or not wave:
+        return _bad_request("metric and wave are required")
+    try:
+        weighted = rollup_params(request.GET)
+    except ValueError as e:
+        return _bad_request(str(e))
+    if weighted is not None:
+        rows = await sync_to_async(rollup.shares)(wave, metrics, level, **weighted)
+        return json_response(rollup_data(rollup.by_owner(rows), metrics))
+    return json_response(choropleth_data(await achoropleth(metrics, wave, level), metrics, with_stats))
+
+
+@async_cached(models=GROUPED_MODELS, wave_param="wave")
+async def grouped_questions_view(request):
+    """GET /api/async/questions/grouped/?wave=&survey_id=&city="""
+    return json_response(await agrouped_questions(
+        wave_code=request.GET.get("wave"),
+        survey_id=request.GET.get("survey_id"),
+        city_slug=request.GET.get("city"),
+    ))
+
+
+@async_cached(models=CITY_MODELS)
+async def cities_view(request):
+    """GET /api/async/cities/?region=; full-resolution features (no zoom/tolerance)."""
+    return json_response(await _cities(request.GET.get("region")))
+
+
+@async_cached(models=DASHBOARD_MODELS, wave_param="wave")
+async def dashboard(request):
+    """
+    GET /api/dashboard?wave=2025Q3[&survey_id=][&city=][&zoom=9]
+    Main page bootstrap: {"wave", "survey_id", "city", "cities", "surveys", "metrics", "questions"}
+    with simplified city geometry for `zoom`; see analytics.dashboard.
+    X-Dashboard-Cache lists the component cache hits, e.g. "cities=HIT, questions=MISS".
+    """
+    params = request.GET
+    try:
+        survey_id = int(params["survey_id"]) if params.get("survey_id") else None
+        zoom = int(params.get("zoom", DEFAULT_ZOOM))
+    except ValueError:
+        return _bad_request("survey_id and zoom must be integers")
+    data, status = await build_dashboard(
+        wave_code=params.get("wave"), survey_id=survey_id, city_slug=params.get("city"), zoom=zoom,
+        versions=getattr(request, "data_versions", None),
+    )
+    response = json_response(data)
+    response["X-Dashboard-Cache"] = ", ".join(f"{name}={hit}" for name, hit in status.items())
+    return response
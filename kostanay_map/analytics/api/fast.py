@@ -0,0 +1,190 @@
+"""
+Fast path for the hot list endpoints.
+
+`FastList` reads a ModelSerializer's fields once, turns them into a plan of
+`.values_list()` paths with a converter per field, and builds the same dicts the
+serializer would from plain tuples: no model instances, no per-field DRF calls.
+`dumps` encodes with orjson when it is installed, compact with unescaped
+unicode and U+2028/U+2029 escaped like JSONRenderer. orjson spells floats
+outside 1e-4..1e16 differently (0.00001 and 1e16, not 1e-05 and 1e+16; both
+parse to the same number) and writes NaN as null. Data orjson refuses, such as
+ints beyond 64 bits in DataPoint.extra, is encoded by json.dumps instead.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
+
+from ..geometry import parse_feature
+from ..models import FeatureLevel
+from ..profiling import timed
+from .serializers import SimplifiedFeatureMixin
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_encoder = JSONEncoder()
+_plans = {}
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+def dumps(data):
+    out = None
+    if orjson is not None:
+        try:
+            out = orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:  # orjson.JSONEncodeError: ints beyond 64 bits, circular data
+            pass
+    if out is None:
+        out = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if b"\xe2\x80" in out:
+        out = out.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+    return out
+
+
+def _decimal(field):
+    exponent = None if field.decimal_places is None else -field.decimal_places
+    plain = getattr(field, "coerce_to_string", True) and not field.localize and not field.normalize_output
+
+    def convert(value):
+        if value is None:
+            return None
+        # database values already carry the field's scale, so quantize() would be a no-op
+        if plain and value.as_tuple().exponent == exponent:
+            return f"{value:f}"
+        return field.to_representation(value)
+    return convert
+
+
+def _date(value):
+    return value.isoformat() if value else None
+
+
+def _converter(field):
+    """Per-field converter, or None when the database value is already the representation."""
+    if isinstance(field, serializers.DecimalField):
+        return _decimal(field)
+    if isinstance(field, serializers.DateTimeField):
+        return lambda value: None if value is None else field.to_representation(value)
+    if isinstance(field, serializers.DateField):
+        return _date
+    if isinstance(field, (
+        serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+        serializers.JSONField, serializers.PrimaryKeyRelatedField, serializers.ReadOnlyField,
+    )):
+        return None
+    return lambda value: None if value is None else field.to_representation(value)
+
+
+def _plan(serializer_class, prefix, paths):
+    """
+    [(name, kind, index, extra)] where index is a column in `paths` and kind is
+    "value" (extra: converter), "nested" (index: FK column, extra: (class, sub-plan))
+    or "feature" (index: owner id column, extra: (model, prefix, feature column)).
+    """
+    serializer = serializer_class()
+    model = serializer.Meta.model
+    entries = []
+
+    def column(path):
+        if path not in paths:
+            paths.append(path)
+        return paths.index(path)
+
+    for name, field in serializer.fields.items():
+        source = field.source.replace(".", "__") if field.source != "*" else name
+        if isinstance(field, serializers.BaseSerializer):
+            entries.append((name, "nested", column(prefix + source), (type(field), _plan(type(field), f"{prefix}{source}__", paths))))
+        elif isinstance(serializer, SimplifiedFeatureMixin) and name == "feature":
+            entries.append((name, "feature", column(prefix + "id"), (model, prefix, column(prefix + "geometry__feature"))))
+        else:
+            entries.append((name, "value", column(prefix + source), _converter(field)))
+    return entries
+
+
+def get_plan(serializer_class):
+    if serializer_class not in _plans:
+        paths = []
+        _plans[serializer_class] = (_plan(serializer_class, "", paths), paths)
+    return _plans[serializer_class]
+
+
+def _walk(plan, kind):
+    for entry in plan:
+        if entry[1] == kind:
+            yield entry
+        if entry[1] == "nested":
+            yield from _walk(entry[3][1], kind)
+
+
+class FastList:
+    """
+    FastList(CitySerializer, context).data(queryset) == CitySerializer(queryset, many=True, context=context).data
+    """
+
+    def __init__(self, serializer_class, context=None):
+        self.serializer_class = serializer_class
+        self.context = context or {}
+        self.plan, self.paths = get_plan(serializer_class)
+
+    def _rows(self, queryset, level):
+        paths = list(self.paths)
+        if level:
+            # geometry comes from FeatureLevel, so the full Geometry rows are not joined
+            for _, _, id_column, (model, prefix, feature_column) in _walk(self.plan, "feature"):
+                paths[feature_column] = prefix + "id"
+        return queryset.prefetch_related(None).values_list(*paths)
+
+    def data(self, queryset):
+        level = self.context.get("feature_level")
+        rows = list(self._rows(queryset, level))
+        features = self._features(rows, level) if level else {}
+        with timed():
+            return [self._build(self.plan, row, level, features) for row in rows]
+
+    async def adata(self, queryset):
+        """data() through the async ORM."""
+        level = self.context.get("feature_level")
+        rows = [row async for row in self._rows(queryset, level)]
+        features = await sync_to_async(self._features)(rows, level) if level else {}
+        with timed():
+            return [self._build(self.plan, row, level, features) for row in rows]
+
+    def _features(self, rows, level):
+        """{prefix: {owner_id: feature}}: one FeatureLevel query per feature field, plus the raw geometry of owners without that level."""
+        features = {}
+        for _, _, id_column, (model, prefix, _) in _walk(self.plan, "feature"):
+            ids = {row[id_column] for row in rows if row[id_column] is not None}
+            owner_field = model._meta.model_name
+            found = dict(
+                FeatureLevel.objects.filter(**{f"{owner_field}_id__in": ids, "tolerance": level})
+                .values_list(f"{owner_field}_id", "feature")
+            )
+            missing = ids - found.keys()
+            if missing:
+                for pk, raw in model.objects.filter(pk__in=missing).values_list("pk", "geometry__feature"):
+                    found[pk] = parse_feature(raw)
+            features[prefix] = found
+        return features
+
+    def _build(self, plan, row, level, features):
+        out = {}
+        for name, kind, index, extra in plan:
+            if kind == "value":
+                value = row[index]
+                out[name] = extra(value) if extra is not None else value
+            elif kind == "nested":
+                out[name] = None if row[index] is None else self._build(extra[1], row, level, features)
+            elif level is None:
+                out[name] = row[extra[2]]
+            elif level:
+                out[name] = features[extra[1]].get(row[index])
+            else:
+                out[name] = parse_feature(row[extra[2]])
+        return out
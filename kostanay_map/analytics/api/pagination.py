@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DataPointCursorPagination(CursorPagination):
+    """
+    Keyset pagination on id, opt-in with ?page_size= (then follow `next`).
+    Without it the list keeps its original unpaginated shape.
+    """
+    ordering = "id"
+    page_size = 1000
+    page_size_query_param = "page_size"
+    max_page_size = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class JobCursorPagination(CursorPagination):
+    """Newest jobs first, 50 per page (follow `next`)."""
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
@@ -0,0 +1,86 @@
+import importlib.util
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from ..columnar import to_arrow
+from .fast import dumps
+from ..tiles import CONTENT_TYPE as MVT_CONTENT_TYPE
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer with the same bytes, encoded by orjson when it is available (see api.fast)."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None \
+                or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class MVTRenderer(BaseRenderer):
+    """Passes already encoded Mapbox Vector Tile bytes through."""
+    media_type = MVT_CONTENT_TYPE
+    format = "mvt"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Negotiation only: the export view streams newline-delimited JSON itself."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class CSVRenderer(BaseRenderer):
+    """Negotiation only: the export view streams CSV itself."""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    """Packed column arrays (see analytics.columnar), compact separators."""
+    media_type = "application/vnd.kostanay.columns+json"
+    format = "columns"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    """Arrow IPC stream of a columnar table; error bodies fall back to JSON."""
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict) or "columns" not in data:
+            return json.dumps(data, ensure_ascii=False).encode("utf-8")
+        import pyarrow as pa
+
+        batch = to_arrow(data)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+
+
+# opt-in via Accept or ?format=columns|arrow; Arrow only when pyarrow is installed
+COLUMNAR_RENDERERS = [ColumnarJSONRenderer]
+if importlib.util.find_spec("pyarrow") is not None:
+    COLUMNAR_RENDERERS.append(ArrowStreamRenderer)
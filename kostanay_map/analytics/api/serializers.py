@@ -1,19 +1,54 @@
+from django.urls import reverse
 from rest_framework import serializers
-from ..models import Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint
+from .. import jobs
+from ..geometry import parse_feature
+from ..models import Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, Job
 
 
-class RegionSerializer(serializers.ModelSerializer):
+class SimplifiedFeatureMixin(serializers.Serializer):
+    """
+    `feature_level` in the context switches `feature` to a parsed GeoJSON object:
+    the prefetched FeatureLevel for that tolerance, or the full geometry for 0.
+    Without it the stored value is returned as is.
+    """
+    feature = serializers.SerializerMethodField()
+
+    def get_feature(self, obj):
+        level = self.context.get("feature_level")
+        if level is None:
+            return obj.feature
+        if level:
+            for simplified in obj.feature_levels.all():
+                if simplified.tolerance == level:
+                    return simplified.feature
+        return parse_feature(obj.feature)
+
+
+class GeometryURLField(serializers.Field):
+    """Content-hashed URL of the owner's full geometry (GeometryView), or null."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source="geometry.hash", read_only=True, allow_null=True, **kwargs)
+
+    def to_representation(self, value):
+        return reverse("geometry", kwargs={"hash": value})
+
+
+class RegionSerializer(SimplifiedFeatureMixin, serializers.ModelSerializer):
+    geometry = GeometryURLField()
+
     class Meta:
         model = Region
-        fields = ("id", "name", "slug", "feature", "sort_order")
+        fields = ("id", "name", "slug", "feature", "geometry", "sort_order")
 
 
-class CitySerializer(serializers.ModelSerializer):
+class CitySerializer(SimplifiedFeatureMixin, serializers.ModelSerializer):
+    geometry = GeometryURLField()
     region = RegionSerializer(read_only=True)
 
     class Meta:
         model = City
-        fields = ("id", "name", "slug", "feature", "sort_order", "is_oblast", "region")
+        fields = ("id", "name", "slug", "feature", "geometry", "sort_order", "is_oblast", "region")
 
 
 class SurveyWaveSerializer(serializers.ModelSerializer):
@@ -48,12 +83,58 @@ class MetricSerializer(serializers.ModelSerializer):
         fields = ("id", "code", "name", "unit")
 
 
+class RegionRefSerializer(serializers.ModelSerializer):
+    """Region without its outline, for rows that only reference it (the outline is at `geometry`)."""
+    geometry = GeometryURLField()
+
+    class Meta:
+        model = Region
+        fields = ("id", "name", "slug", "geometry", "sort_order")
+
+
+class CityRefSerializer(serializers.ModelSerializer):
+    geometry = GeometryURLField()
+    region = RegionRefSerializer(read_only=True)
+
+    class Meta:
+        model = City
+        fields = ("id", "name", "slug", "geometry", "sort_order", "is_oblast", "region")
+
+
 class DataPointSerializer(serializers.ModelSerializer):
-    city = CitySerializer(read_only=True)
-    region = RegionSerializer(read_only=True)
+    city = CityRefSerializer(read_only=True)
+    region = RegionRefSerializer(read_only=True)
     metric = MetricSerializer(read_only=True)
     wave = SurveyWaveSerializer(read_only=True)
 
     class Meta:
         model = DataPoint
         fields = ("id", "wave", "region", "city", "question", "option", "metric", "value", "extra")
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """A background job; POST takes kind, params, priority and max_attempts (see analytics.jobs)."""
+    fraction = serializers.FloatField(read_only=True)
+    eta_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = (
+            "id", "kind", "params", "status", "priority", "done", "total", "fraction", "eta_seconds", "message",
+            "result", "error", "attempts", "max_attempts", "cancel_requested", "worker", "created_at",
+            "started_at", "heartbeat_at", "finished_at",
+        )
+        read_only_fields = tuple(f for f in fields if f not in ("kind", "params", "priority", "max_attempts"))
+
+    def validate_kind(self, value):
+        if value not in jobs.TASKS:
+            raise serializers.ValidationError(f"expected one of {', '.join(sorted(jobs.TASKS))}")
+        return value
+
+    def validate_params(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("expected an object of task arguments")
+        return value
+
+    def create(self, validated_data):
+        return jobs.enqueue(user=self.context["request"].user, **validated_data)
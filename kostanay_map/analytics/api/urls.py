@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     RegionViewSet, CityViewSet, SurveyWaveViewSet, SurveyViewSet,
     QuestionViewSet, MetricViewSet, DataPointViewSet, ChoroplethView,
-    QuestionGroupedViewSet,
+    QuestionGroupedViewSet, JobViewSet, GeometryView, TileView, TimeSeriesView, LocateView, CrosstabView,
 )
 
 router = DefaultRouter()
@@ -15,9 +16,19 @@ router.register(r"questions", QuestionViewSet, basename="question")
 router.register(r"metrics", MetricViewSet, basename="metric")
 router.register(r"datapoints", DataPointViewSet, basename="datapoint")
 router.register(r"questions/grouped", QuestionGroupedViewSet, basename="question-grouped")
+router.register(r"jobs", JobViewSet, basename="job")
 
 
 urlpatterns = [
     path("", include(router.urls)),
     path("choropleth", ChoroplethView.as_view(), name="choropleth"),
+    path("dashboard", async_views.dashboard, name="dashboard"),
+    path("async/choropleth", async_views.choropleth_view, name="async-choropleth"),
+    path("async/cities/", async_views.cities_view, name="async-cities"),
+    path("async/questions/grouped/", async_views.grouped_questions_view, name="async-question-grouped"),
+    path("crosstab", CrosstabView.as_view(), name="crosstab"),
+    path("locate", LocateView.as_view(), name="locate"),
+    path("timeseries", TimeSeriesView.as_view(), name="timeseries"),
+    path("geometry/<slug:hash>.geojson", GeometryView.as_view(), name="geometry"),
+    path("tiles/<int:z>/<int:x>/<int:y>.mvt", TileView.as_view(), name="tile"),
 ]
@@ -1,48 +1,127 @@
-from django.db.models import Avg, Sum
+from django.db.models import Case, IntegerField, Prefetch, When
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from .. import jobs, microdata, rollup, search, spatial, tiles, timeseries
+from ..aggregation import grouped_questions
+from ..cache import CachedResponseMixin, cache_headers, not_modified
+from ..columnar import choropleth_table, datapoint_table, rollup_table
+from ..cube import choropleth
+from ..export import flat_row, flat_values, iter_csv, iter_ndjson
+from ..geometry import pick_level, tolerance_for_zoom
 from ..models import (
-    Region, City, SurveyWave, Survey, Question, Metric, DataPoint
+    Region, City, Geometry, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, ChoroplethCell,
+    SeriesPoint, Job,
 )
+from ..profiling import timed
+from .fast import FastList, dumps
+from .pagination import DataPointCursorPagination, JobCursorPagination
+from .renderers import COLUMNAR_RENDERERS, CSVRenderer, MVTRenderer, NDJSONRenderer
 from .serializers import (
     RegionSerializer, CitySerializer, SurveyWaveSerializer, SurveySerializer,
-    QuestionSerializer, MetricSerializer, DataPointSerializer
+    QuestionSerializer, MetricSerializer, DataPointSerializer, JobSerializer
 )
 
 
-class RegionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class ColumnarMixin:
+    """Adds the packed-array JSON and Arrow renderers next to the default ones."""
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *COLUMNAR_RENDERERS]
+
+    def wants_columns(self):
+        return isinstance(self.request.accepted_renderer, tuple(COLUMNAR_RENDERERS))
+
+
+class FeatureLevelMixin:
+    """
+    ?zoom=<int> or ?tolerance=<degrees> serve the coarsest pre-simplified geometry
+    that still fits, as a parsed GeoJSON object (see FeatureLevel).
+    """
+    feature_prefixes = ("",)
+
+    def get_feature_level(self):
+        if not hasattr(self, "_feature_level"):
+            params = self.request.query_params
+            try:
+                if params.get("tolerance"):
+                    tolerance = float(params["tolerance"])
+                elif params.get("zoom"):
+                    tolerance = tolerance_for_zoom(int(params["zoom"]))
+                else:
+                    tolerance = None
+            except ValueError:
+                raise ValidationError({"detail": "zoom must be an integer and tolerance a number"})
+            # 0 means "parsed, full resolution"
+            self._feature_level = None if tolerance is None else (pick_level(tolerance) or 0)
+        return self._feature_level
+
+    def with_feature_level(self, qs):
+        level = self.get_feature_level()
+        if not level:
+            return qs
+        levels = FeatureLevel.objects.filter(tolerance=level)
+        return qs.prefetch_related(*[
+            Prefetch(f"{prefix}feature_levels", queryset=levels) for prefix in self.feature_prefixes
+        ])
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["feature_level"] = self.get_feature_level()
+        return context
+
+
+class FastListMixin:
+    """list() built from .values() rows by FastList; same JSON as the serializer."""
+
+    def list(self, request, *args, **kwargs):
+        qs = self.filter_queryset(self.get_queryset())
+        return Response(FastList(self.get_serializer_class(), self.get_serializer_context()).data(qs))
+
+
+class RegionViewSet(FastListMixin, FeatureLevelMixin, CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = Region.objects.all().order_by("sort_order", "name")
     serializer_class = RegionSerializer
+    cache_models = (Region, FeatureLevel)
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        return self.with_feature_level(super().get_queryset())
+
 
-class CityViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class CityViewSet(FastListMixin, FeatureLevelMixin, CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = City.objects.select_related("region").all().order_by("region__sort_order", "sort_order")
     serializer_class = CitySerializer
+    cache_models = (City, Region, FeatureLevel)
     permission_classes = [AllowAny]
+    feature_prefixes = ("", "region__")
 
     def get_queryset(self):
         qs = super().get_queryset()
         region_slug = self.request.query_params.get("region")
         if region_slug:
             qs = qs.filter(region__slug=region_slug)
-        return qs
+        return self.with_feature_level(qs)
 
 
-class SurveyWaveViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class SurveyWaveViewSet(CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = SurveyWave.objects.all().order_by("-starts_at", "-id")
     serializer_class = SurveyWaveSerializer
+    cache_models = (SurveyWave,)
     permission_classes = [AllowAny]
 
 
-class SurveyViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class SurveyViewSet(CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = Survey.objects.select_related("wave").all().order_by("id")
     serializer_class = SurveySerializer
+    cache_models = (Survey, SurveyWave)
+    cache_wave_param = "wave_code"
     permission_classes = [AllowAny]
 
     def get_queryset(self):
@@ -57,9 +136,10 @@ class SurveyViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         """Вернёт все Survey (фронт сам фильтрует по wave_code при желании)"""
         return Response(self.get_serializer(self.get_queryset(), many=True).data)
 
-class QuestionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
-    queryset = Question.objects.select_related("survey", "survey__wave").all()
+class QuestionViewSet(CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    queryset = Question.objects.select_related("survey", "survey__wave").prefetch_related("options")
     serializer_class = QuestionSerializer
+    cache_models = (Question, AnswerOption, Survey, SurveyWave)
     permission_classes = [AllowAny]
 
     def get_queryset(self):
@@ -69,78 +149,56 @@ class QuestionViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             qs = qs.filter(survey_id=survey_id)
         q = self.request.query_params.get("q")
         if q:
-            qs = qs.filter(models.Q(text__icontains=q) | models.Q(code__icontains=q))
+            # every match, in search rank order
+            ids = search.ranked_ids(q, survey_id=survey_id)
+            rank = Case(*[When(pk=pk, then=i) for i, pk in enumerate(ids)], output_field=IntegerField())
+            return qs.filter(pk__in=ids).order_by(rank) if ids else qs.none()
         return qs.order_by("sort_order", "id")
 
-class QuestionGroupedViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    @action(detail=False, methods=["get"], permission_classes=[AllowAny])
+    def search(self, request):
+        """
+        GET /api/questions/search/?q=интернет&survey_id=&wave_code=&limit=20&offset=0
+        Ranked matches with <mark>-highlighted text; see analytics.search.
+        """
+        params = request.query_params
+        try:
+            limit = int(params.get("limit", search.DEFAULT_LIMIT))
+            offset = int(params.get("offset", 0))
+        except ValueError:
+            raise ValidationError({"detail": "limit and offset must be integers"})
+        return Response(search.search_questions(
+            params.get("q"), survey_id=params.get("survey_id"), wave_code=params.get("wave_code"),
+            limit=limit, offset=offset,
+        ))
+
+class QuestionGroupedViewSet(CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = Question.objects.select_related("survey", "survey__wave").all()
+    cache_models = (Question, Survey, SurveyWave, DataPoint, AnswerOption, Metric, City)
+    cache_wave_param = "wave"
     permission_classes = [AllowAny]
 
     def list(self, request, *args, **kwargs):
-        wave_code = request.query_params.get("wave")
-        survey_id = request.query_params.get("survey_id")
-        city_slug = request.query_params.get("city")
+        return Response(grouped_questions(
+            wave_code=request.query_params.get("wave"),
+            survey_id=request.query_params.get("survey_id"),
+            city_slug=request.query_params.get("city"),
+        ))
 
-        qs = Question.objects.select_related("survey", "survey__wave")
-        if survey_id:
-            qs = qs.filter(survey_id=survey_id)
-        if wave_code:
-            qs = qs.filter(survey__wave__code=wave_code)
-
-        result = []
-
-        for q in qs:
-            datapoints = (
-                DataPoint.objects
-                .select_related("city", "option", "metric")
-                .filter(question=q)
-            )
-            if wave_code:
-                datapoints = datapoints.filter(wave__code=wave_code)
-            if city_slug:
-                datapoints = datapoints.filter(city__slug=city_slug)
-
-            city_data = {}
-            metric_name = None
-            metric_unit = None
-
-            for dp in datapoints:
-                city = dp.city.name if dp.city else "—"
-                if city not in city_data:
-                    city_data[city] = {}
-                if dp.option:
-                    city_data[city][dp.option.label] = float(dp.value)
-                if not metric_name:
-                    metric_name = dp.metric.name
-                    metric_unit = dp.metric.unit
-
-            city_values = []
-            for city, values in city_data.items():
-                row = {"city": city}
-                row.update(values)
-                city_values.append(row)
-
-            result.append({
-                "id": q.id,
-                "question": q.text,
-                "category": q.category,
-                "metric_name": metric_name or "",
-                "metric_unit": metric_unit or "",
-                "city_values": city_values,
-            })
-
-        return Response(result)
-
-class MetricViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class MetricViewSet(CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = Metric.objects.all().order_by("code")
     serializer_class = MetricSerializer
+    cache_models = (Metric,)
     permission_classes = [AllowAny]
 
 
-class DataPointViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+class DataPointViewSet(ColumnarMixin, CachedResponseMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = DataPoint.objects.select_related("city", "region", "metric", "wave").all()
     serializer_class = DataPointSerializer
+    cache_models = (DataPoint, City, Region, Metric, SurveyWave, AnswerOption)
+    cache_wave_param = "wave_code"
     permission_classes = [AllowAny]
+    pagination_class = DataPointCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ("wave", "metric", "city", "region", "question")
 
@@ -160,29 +218,270 @@ class DataPointViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             qs = qs.filter(city__slug=city_slug)
         return qs
 
+    def list(self, request, *args, **kwargs):
+        qs = self.filter_queryset(self.get_queryset())
+        if self.wants_columns():
+            # columnar tables are not paginated: they are meant for whole-wave bulk reads
+            return Response(datapoint_table(qs))
+        page = self.paginate_queryset(flat_values(qs))
+        if page is None:
+            return Response(FastList(self.get_serializer_class(), self.get_serializer_context()).data(qs))
+        return self.get_paginated_response([flat_row(row) for row in page])
+
+    @action(detail=False, methods=["get"], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        GET /api/datapoints/export/?wave_code=2025Q3[&format=csv]
+        Streams every matching row as NDJSON (default) or CSV with flat codes/slugs.
+        """
+        qs = self.filter_queryset(self.get_queryset())
+        if request.accepted_renderer.format == "csv":
+            response = StreamingHttpResponse(iter_csv(qs), content_type="text/csv; charset=utf-8")
+            response["Content-Disposition"] = 'attachment; filename="datapoints.csv"'
+        else:
+            response = StreamingHttpResponse(iter_ndjson(qs), content_type="application/x-ndjson; charset=utf-8")
+        return response
+
+
+class JobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
+    """
+    Background jobs, staff only (see analytics.jobs and the run_workers command).
+    GET /api/jobs/[?status=running&kind=load_wave], GET /api/jobs/<id>/ for progress and ETA,
+    POST /api/jobs/ {"kind": "load_wave", "params": {"path": "data.json", "wave": "2025Q3"}} to enqueue,
+    POST /api/jobs/<id>/cancel/ and /api/jobs/<id>/retry/.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    pagination_class = JobCursorPagination
+    permission_classes = [IsAdminUser]
+    filterset_fields = ("status", "kind")
+
+    def change(self, request, operation):
+        job = self.get_object()
+        if not operation(job):
+            return Response({"detail": f"job is {job.status}"}, status=409)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
 
-class ChoroplethView(APIView):
+    @action(detail=True, methods=["post"])
+    def cancel(self, request, pk=None):
+        return self.change(request, jobs.cancel)
+
+    @action(detail=True, methods=["post"])
+    def retry(self, request, pk=None):
+        return self.change(request, jobs.retry)
+
+
+class ChoroplethView(ColumnarMixin, CachedResponseMixin, APIView):
     """
     GET /api/choropleth?metric=media_internet&wave=2025Q3&level=city|region
     Returns: [{"slug": "rudny", "value": 55.2}, ...]
+
+    Several metrics (metric=a,b or repeated metric=) return {"a": [...], "b": [...]}.
+    stats=1 adds count/sum/min/max to every row. Reads the materialized cube.
+    Accept: application/vnd.apache.arrow.stream (or ?format=columns) returns one
+    columnar table with metric, slug, value and the stats columns.
+
+    weighted=1[&question=Q1][&option=Да][&confidence=0.95] reads the datapoints
+    instead and returns sample-size weighted values with n, margin of error and
+    confidence interval: [{"slug", "value", "n", "moe", "low", "high"}]; see analytics.rollup.
     """
+    cache_models = (ChoroplethCell, DataPoint)
+    cache_wave_param = "wave"
     permission_classes = [AllowAny]
 
     def get(self, request):
-        metric = request.query_params.get("metric")
-        wave = request.query_params.get("wave")
-        level = request.query_params.get("level", "city")
-
-        if not metric or not wave:
+        metrics, wave, level, with_stats = choropleth_params(request.query_params)
+        if not metrics or not wave:
             return Response({"detail": "metric and wave are required"}, status=400)
+        try:
+            weighted = rollup_params(request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        if weighted is not None:
+            cells_by_metric = rollup.by_owner(rollup.shares(wave, metrics, level, **weighted))
+            if self.wants_columns():
+                return Response(rollup_table(cells_by_metric))
+            return Response(rollup_data(cells_by_metric, metrics))
+
+        cells_by_metric = choropleth(metrics, wave, level)
+        if self.wants_columns():
+            return Response(choropleth_table(cells_by_metric))
+        return Response(choropleth_data(cells_by_metric, metrics, with_stats))
+
+
+def choropleth_params(params):
+    """(metrics, wave, level, with_stats) from the ChoroplethView query string."""
+    metrics = [m for value in params.getlist("metric") for m in value.split(",") if m]
+    level = "region" if params.get("level", "city") == "region" else "city"
+    return metrics, params.get("wave"), level, params.get("stats") in ("1", "true")
+
+
+def rollup_params(params):
+    """Keyword arguments for rollup.shares when weighted=1 is set, else None; ValueError on a bad confidence."""
+    if params.get("weighted") not in ("1", "true"):
+        return None
+    try:
+        confidence = float(params.get("confidence", rollup.DEFAULT_CONFIDENCE))
+    except ValueError:
+        raise ValueError("confidence must be a number") from None
+    rollup.z_score(confidence)
+    return {"confidence": confidence, "question": params.get("question"), "option": params.get("option")}
+
+
+def rollup_data(cells_by_metric, metrics):
+    data = {metric: [] for metric in metrics}
+    for metric, cells in cells_by_metric.items():
+        data[metric] = [
+            {"slug": slug, "value": value, "n": n, "moe": moe, "low": low, "high": high}
+            for slug, value, n, moe, low, high in cells
+        ]
+    return data[metrics[0]] if len(metrics) == 1 else data
+
+
+def choropleth_data(cells_by_metric, metrics, with_stats=False):
+    data = {}
+    for metric, cells in cells_by_metric.items():
+        rows = []
+        for slug, average, count, total, minimum, maximum in cells:
+            row = {"slug": slug, "value": average}
+            if with_stats:
+                row.update(count=count, sum=total, min=minimum, max=maximum)
+            rows.append(row)
+        data[metric] = rows
+    return data[metrics[0]] if len(metrics) == 1 else data
+
+
+class TimeSeriesView(CachedResponseMixin, APIView):
+    """
+    GET /api/timeseries?metric=share&level=city|region[&city=rudny,arkalyk]
+        [&question=Q1[&option=Да]][&waves=2025Q3,2025Q4][&cadence=quarter|month]
+    Per-city (or region) series over the locked waves, with precomputed
+    wave-over-wave delta and rolling average: {"waves": [...], "series": [...]}.
+    """
+    cache_models = (SeriesPoint,)
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        params = request.query_params
 
-        qs = DataPoint.objects.filter(metric__code=metric, wave__code=wave)
+        def split(name):
+            return [v for value in params.getlist(name) for v in value.split(",") if v]
 
-        if level == "region":
-            agg = qs.values("region__slug").exclude(region__isnull=True).annotate(value=Avg("value"))
-            data = [{"slug": r["region__slug"], "value": float(r["value"] or 0)} for r in agg]
-        else:
-            agg = qs.values("city__slug").exclude(city__isnull=True).annotate(value=Avg("value"))
-            data = [{"slug": r["city__slug"], "value": float(r["value"] or 0)} for r in agg]
+        metric, question = params.get("metric"), params.get("question")
+        if not metric and not question:
+            return Response({"detail": "metric or question is required"}, status=400)
+        return Response(timeseries.series(
+            metric=metric, question=question, option=params.get("option"),
+            level="region" if params.get("level") == "region" else "city",
+            slugs=split("city") or split("region"), waves=split("waves"), cadence=params.get("cadence"),
+        ))
+
+
+class CrosstabView(CachedResponseMixin, APIView):
+    """
+    GET /api/crosstab?wave=2025Q3&question=Q1[&by=city][&weighted=0][&gender=Ж][&is_frontier=1]
+    Weighted percentages from the respondent microdata; every other param filters
+    on a microdata column (comma-separated values are OR-ed).
+    """
+    cache_wave_param = "wave"
+    permission_classes = [AllowAny]
+    reserved_params = ("wave", "question", "by", "weighted", "format")
+
+    def get(self, request):
+        params = request.query_params
+        wave, question = params.get("wave"), params.get("question")
+        if not wave or not question:
+            return Response({"detail": "wave and question are required"}, status=400)
+        filters = {
+            key: [v for value in params.getlist(key) for v in value.split(",")]
+            for key in params if key not in self.reserved_params
+        }
+        try:
+            store = microdata.MicrodataStore(wave)
+            return Response(store.crosstab(
+                question, by=params.get("by", "city") or None, filters=filters,
+                weighted=params.get("weighted") not in ("0", "false"),
+            ))
+        except LookupError as e:
+            return Response({"detail": str(e)}, status=404)
+
+
+class LocateView(APIView):
+    """
+    POST /api/locate {"points": [[lon, lat], ...]}  (or GET ?lon=&lat= for one point)
+    Returns {"results": [{"city": slug|null, "region": slug|null}, ...]} in input order.
+    """
+    permission_classes = [AllowAny]
+    max_points = 50000
 
-        return Response(data)
+    def get(self, request):
+        return self.locate([(request.query_params.get("lon"), request.query_params.get("lat"))])
+
+    def post(self, request):
+        points = request.data.get("points") if isinstance(request.data, dict) else None
+        if not isinstance(points, list):
+            return Response({"detail": "points must be a list of [lon, lat] pairs"}, status=400)
+        if len(points) > self.max_points:
+            return Response({"detail": f"at most {self.max_points} points per request"}, status=400)
+        return self.locate(points)
+
+    def locate(self, points):
+        try:
+            points = [(float(p[0]), float(p[1])) for p in points]
+        except (TypeError, ValueError, IndexError, KeyError):
+            return Response({"detail": "points must be [lon, lat] number pairs"}, status=400)
+        return Response({"results": spatial.locate(points)})
+
+
+class GeometryView(FeatureLevelMixin, APIView):
+    """
+    GET /api/geometry/{hash}.geojson[?zoom=9|tolerance=0.001]
+    One stored outline by content hash (the `geometry` URL of regions and cities),
+    optionally at a pre-simplified level. A new outline gets a new URL, so
+    responses are immutable for browsers and CDNs.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, hash):
+        level = self.get_feature_level()
+        etag = f'"{hash}-{level or 0}"'
+        if not_modified(request, etag, None):
+            return cache_headers(HttpResponse(status=304), etag, None, locked=True)
+        feature = None
+        if level:
+            feature = FeatureLevel.objects.filter(source_hash=hash, tolerance=level).values_list("feature", flat=True).first()
+        if feature is None:
+            feature = Geometry.objects.filter(hash=hash).values_list("feature", flat=True).first()
+        if feature is None:
+            return HttpResponse(status=404)
+        with timed():
+            body = dumps(feature)
+        return cache_headers(HttpResponse(body, content_type="application/geo+json"), etag, None, locked=True)
+
+
+class TileView(CachedResponseMixin, APIView):
+    """
+    GET /api/tiles/{z}/{x}/{y}.mvt?metric=media_internet&wave=2025Q3
+    Mapbox Vector Tile with `cities` and `regions` layers (slug, name, value).
+    """
+    cache_models = (City, Region, FeatureLevel, ChoroplethCell)
+    cache_wave_param = "wave"
+    permission_classes = [AllowAny]
+    renderer_classes = [MVTRenderer, JSONRenderer]
+
+    def get(self, request, z, x, y):
+        if not 0 <= z <= 22 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            return HttpResponse(status=404)
+        metric = request.query_params.get("metric")
+        wave = request.query_params.get("wave")
+        # both name cache directories: unknown codes would add one per request
+        if metric and not Metric.objects.filter(code=metric).exists():
+            return HttpResponse(status=404)
+        if wave and not SurveyWave.objects.filter(code=wave).exists():
+            return HttpResponse(status=404)
+        tile = tiles.get_tile(z, x, y, metric, wave)
+        response = HttpResponse(tile, content_type=tiles.CONTENT_TYPE)
+        response["Cache-Control"] = "public, max-age=3600"
+        return response
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import profiling, signals  # noqa: F401
+
+        connection_created.connect(profiling.instrument, dispatch_uid="analytics.profiling")
+        profiling.instrument_open_connections()
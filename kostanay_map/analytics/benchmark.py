@@ -0,0 +1,258 @@
+"""
+Benchmark harness for the API and the import commands (see the `bench` command).
+
+Every route in analytics.api.urls becomes a case with sample parameters taken
+from the data already in the database (the latest wave with data, one of its
+metrics, surveys, cities...), so the suite follows new endpoints without
+edits: routes without a sample are still timed with no parameters. Each case
+is timed `repeat` times through the Django test client, cold (API cache
+cleared before every request) and warm, for p50/p95 latency; query count and
+response size come from the request profile (analytics.profiling), peak
+Python memory from one extra tracemalloc run.
+
+Import cases time load_wave and import_geojson on synthetic input inside a
+rolled-back transaction. Results are plain dicts, saved and compared as JSON.
+"""
+import io
+import json
+import math
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+
+from . import microdata, synthetic
+from .api import urls as api_urls
+from .cache import get_store
+from .models import City, ChoroplethCell, DataPoint, Question, SurveyWave
+
+REGRESSION_TOLERANCE = 0.2
+NOISE_MS = 2.0  # p95 differences below this are never regressions
+
+
+def sample():
+    """Parameter values for the endpoint cases, read from the current data."""
+    waves = SurveyWave.objects.order_by(F("starts_at").desc(nulls_last=True), "-code")
+    wave = waves.filter(Exists(DataPoint.objects.filter(wave=OuterRef("pk")))).first() or waves.first()
+    wave_code = wave.code if wave else None
+    cell = ChoroplethCell.objects.filter(wave_code=wave_code).values("metric_code").first() if wave else None
+    point = DataPoint.objects.filter(wave=wave, city__isnull=False).values("question__survey_id", "city__slug").first() if wave else None
+    question = Question.objects.filter(survey__wave=wave).exclude(code=None).values("code", "text").first() if wave else None
+    city = City.objects.filter(is_oblast=False).exclude(geometry=None).select_related("geometry").first()
+    box = city.geometry.bbox if city is not None else None
+    has_microdata = microdata.has_wave(wave_code)
+    return {
+        "wave": wave_code,
+        "metric": cell["metric_code"] if cell else None,
+        "survey_id": point["question__survey_id"] if point else None,
+        "city": point["city__slug"] if point else None,
+        "question_code": question["code"] if question else None,
+        "word": question["text"].split()[0] if question else "опрос",
+        "center": ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2) if box else None,
+        "geometry": city.geometry.hash if city is not None else None,
+        "microdata": has_microdata,
+    }
+
+
+def _tile(lon, lat, zoom=8):
+    x = int((lon + 180) / 360 * 2 ** zoom)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** zoom)
+    return {"z": zoom, "x": x, "y": y}
+
+
+# url name -> case builder: s (sample) -> [(label, method, kwargs, params)]
+CASES = {
+    "region-list": lambda s: [("", "get", {}, {}), ("zoom=9", "get", {}, {"zoom": 9})],
+    "city-list": lambda s: [("", "get", {}, {}), ("zoom=9", "get", {}, {"zoom": 9})],
+    "survey-list": lambda s: [("", "get", {}, {"wave_code": s["wave"]})],
+    "question-list": lambda s: [("", "get", {}, {"survey_id": s["survey_id"]}), ("q", "get", {}, {"q": s["word"]})],
+    "question-search": lambda s: [("", "get", {}, {"q": s["word"], "wave_code": s["wave"]})],
+    "question-grouped-list": lambda s: [
+        ("wave", "get", {}, {"wave": s["wave"]}),
+        ("survey+city", "get", {}, {"wave": s["wave"], "survey_id": s["survey_id"], "city": s["city"]}),
+    ],
+    "datapoint-list": lambda s: [
+        ("page", "get", {}, {"wave_code": s["wave"], "page_size": 500}),
+        ("columns", "get", {}, {"wave_code": s["wave"], "page_size": 500, "format": "columns"}),
+    ],
+    "datapoint-export": lambda s: [("ndjson", "get", {}, {"wave_code": s["wave"], "format": "ndjson"})],
+    "choropleth": lambda s: [
+        ("", "get", {}, {"metric": s["metric"], "wave": s["wave"]}),
+        ("weighted region", "get", {}, {"metric": s["metric"], "wave": s["wave"], "weighted": 1, "level": "region"}),
+    ],
+    "async-choropleth": lambda s: [("", "get", {}, {"metric": s["metric"], "wave": s["wave"]})],
+    "async-question-grouped": lambda s: [("", "get", {}, {"wave": s["wave"]})],
+    "dashboard": lambda s: [("", "get", {}, {"wave": s["wave"], "city": s["city"]})],
+    "timeseries": lambda s: [
+        ("metric", "get", {}, {"metric": s["metric"]}),
+        ("question", "get", {}, {"question": s["question_code"]}),
+    ],
+    "crosstab": lambda s: [("", "get", {}, {"wave": s["wave"], "question": s["question_code"]})] if s["microdata"] else [],
+    "locate": lambda s: [("1000 points", "post", {}, {"points": [s["center"]] * 1000})] if s["center"] else [],
+    "geometry": lambda s: [("", "get", {"hash": s["geometry"]}, {}), ("zoom=9", "get", {"hash": s["geometry"]}, {"zoom": 9})]
+    if s["geometry"] else [],
+    "tile": lambda s: [("z8", "get", _tile(*s["center"]), {})] if s["center"] else [],
+    # staff only: the benchmark client is anonymous
+    **{name: lambda s: [] for name in ("job-list", "job-detail", "job-cancel", "job-retry")},
+}
+
+
+def _routes(patterns, seen=None):
+    """Route names of the API, once each (the format-suffix duplicates skipped)."""
+    seen = seen if seen is not None else []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            _routes(pattern.url_patterns, seen)
+        elif isinstance(pattern, URLPattern) and pattern.name and pattern.name not in seen:
+            seen.append(pattern.name)
+    return seen
+
+
+def endpoint_cases(values=None):
+    """[(name, method, path, params)] for every API route; routes without a sample are reported as skipped."""
+    values = values or sample()
+    cases, skipped = [], []
+    for name in _routes(api_urls.urlpatterns):
+        builder = CASES.get(name, lambda s: [("", "get", {}, {})])
+        built = builder(values) if values["wave"] or name not in CASES else []
+        if not built:
+            skipped.append(name)
+        for label, method, kwargs, params in built:
+            params = {k: v for k, v in params.items() if v is not None}
+            cases.append((f"{name} {label}".strip(), method, reverse(name, kwargs=kwargs or None), params))
+    return cases, skipped
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _send(client, method, path, params):
+    if method == "post":
+        response = client.post(path, json.dumps(params), content_type="application/json")
+    else:
+        response = client.get(path, params)
+    return response, b"".join(response.streaming_content) if response.streaming else response.content
+
+
+def time_request(client, method, path, params, repeat, cold):
+    timings, queries, size, status = [], 0, 0, None
+    if not cold:
+        _send(client, method, path, params)  # fill the cache
+    for _ in range(repeat):
+        if cold:
+            get_store().clear()
+        started = time.perf_counter()
+        response, body = _send(client, method, path, params)
+        timings.append((time.perf_counter() - started) * 1000)
+        profile = getattr(response, "profile", None)
+        queries = profile.queries if profile is not None else None
+        size, status = len(body), response.status_code
+
+    if cold:
+        get_store().clear()
+    tracemalloc.start()
+    _send(client, method, path, params)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "p50_ms": round(statistics.median(timings), 2), "p95_ms": round(_percentile(timings, 0.95), 2),
+        "queries": queries, "bytes": size, "status": status, "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_endpoints(repeat=20, modes=("cold", "warm"), progress=None, only=None):
+    """{case name + mode: result}, skipped route names. `only`: substring a case name must contain."""
+    client = Client()
+    cases, skipped = endpoint_cases()
+    results = {}
+    for name, method, path, params in cases:
+        if only and only not in name:
+            continue
+        for mode in modes:
+            result = time_request(client, method, path, params, repeat, cold=mode == "cold")
+            results[f"{name} [{mode}]"] = result
+            if progress:
+                progress(f"{name} [{mode}]", result)
+    return results, skipped
+
+
+def _measure(action):
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as captured:
+        started = time.perf_counter()
+        action()
+        elapsed = (time.perf_counter() - started) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"p50_ms": round(elapsed, 2), "p95_ms": round(elapsed, 2), "queries": len(captured), "peak_kb": round(peak / 1024, 1)}
+
+
+def run_imports(rows=20000, progress=None):
+    """load_wave (JSONL, both modes) and import_geojson timings; every change is rolled back."""
+    results = {}
+    folder = tempfile.mkdtemp(prefix="bench-")
+    try:
+        districts = [(f"bench-{n}", "bench") for n in range(20)]
+        path = os.path.join(folder, "wave.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for n, row in enumerate(synthetic.datapoint_rows(districts, ["BENCH"], surveys=1, questions=rows // 80 + 1)):
+                if n >= rows:
+                    break
+                f.write(json.dumps({**row, "region": "Бенчмарк", "city": row["city_slug"]}, ensure_ascii=False) + "\n")
+
+        geojson = os.path.join(folder, "geojson")
+        os.makedirs(geojson)
+        for slug, _, feature, _ in synthetic.city_templates():
+            with open(os.path.join(geojson, f"bench-{slug}.geojson"), "w", encoding="utf-8") as f:
+                json.dump(feature, f)
+
+        cases = {
+            f"load_wave orm {rows} rows": lambda: call_command("load_wave", path, mode="orm", stdout=io.StringIO()),
+            f"load_wave copy {rows} rows": lambda: call_command("load_wave", path, mode="copy", stdout=io.StringIO()),
+            "import_geojson city.json": lambda: call_command(
+                "import_geojson", geojson, region="bench-region", stdout=io.StringIO(),
+            ),
+        }
+        for name, action in cases.items():
+            with transaction.atomic():
+                results[name] = _measure(action)
+                transaction.set_rollback(True)
+            if progress:
+                progress(name, results[name])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """[(name, metric, old, new, change)] for every result also in the baseline; change is a ratio or None."""
+    rows = []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p95_ms", "queries", "peak_kb"):
+            if metric in old and metric in new:
+                change = (new[metric] - old[metric]) / old[metric] if old[metric] else None
+                rows.append((name, metric, old[metric], new[metric], change))
+    return rows
+
+
+def regressions(rows, tolerance=REGRESSION_TOLERANCE):
+    """Rows that got slower than tolerance on p95 (beyond NOISE_MS) or run more queries."""
+    return [
+        r for r in rows
+        if (r[1] == "p95_ms" and r[3] - r[2] > NOISE_MS and (r[4] or 0) > tolerance)
+        or (r[1] == "queries" and r[3] > r[2])
+    ]
@@ -0,0 +1,194 @@
+"""
+Versioned response cache for the read-only API.
+
+Every analytics table has a DataVersion counter ("table:<model_name>") that is
+bumped on writes; DataPoint and ChoroplethCell are additionally versioned per
+wave ("wave:<code>"), so loading one wave leaves the cache of the others intact.
+
+A cached view lists the tables it is built from. Its ETag is a hash of the
+request and the current versions of those tables, so it is known before the
+view runs: conditional requests get a 304 after one small query, and rendered
+bodies are kept in the `api` cache (locmem, file or Redis, see settings).
+Responses for a locked wave are marked immutable. A bump also drops the static
+snapshots built from the bumped scopes (analytics.snapshots).
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from .models import DataVersion
+
+WAVE_MODELS = ("datapoint", "choroplethcell")
+LOCKED_MAX_AGE = 365 * 24 * 3600
+
+
+def table_scope(model):
+    return f"table:{model._meta.model_name}"
+
+
+def wave_scope(code):
+    return f"wave:{code}"
+
+
+def bump(*scopes, is_locked=None):
+    from . import snapshots
+
+    now = timezone.now()
+    extra = {} if is_locked is None else {"is_locked": is_locked}
+    for scope in dict.fromkeys(scopes):
+        if not DataVersion.objects.filter(scope=scope).update(version=F("version") + 1, updated_at=now, **extra):
+            DataVersion.objects.get_or_create(scope=scope, defaults={"version": 1, **extra})
+    snapshots.invalidate(scopes)
+
+
+def bump_models(*models, waves=()):
+    """Invalidate cached responses built from `models` (and from data of the given wave codes)."""
+    bump(*[table_scope(m) for m in models], *[wave_scope(code) for code in waves])
+
+
+def mark_waves(waves, is_locked):
+    """Record a lock/unlock done behind the ORM signals (e.g. QuerySet.update)."""
+    from .models import SurveyWave
+
+    codes = [getattr(w, "code", w) for w in waves]
+    bump(table_scope(SurveyWave))
+    for code in codes:
+        bump(wave_scope(code), is_locked=is_locked)
+
+
+def get_store():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "api")]
+
+
+def scopes_for(models, wave=None):
+    scopes = {wave_scope(wave)} if wave else set()
+    for model in models:
+        name = model._meta.model_name
+        scopes.add(wave_scope(wave) if wave and name in WAVE_MODELS else table_scope(model))
+    return sorted(scopes)
+
+
+def version_key(parts, scopes, rows):
+    """Cache key of `parts` (anything with a stable repr) at the current versions of `scopes`."""
+    raw = repr((parts, [(s, rows[s].version if s in rows else 0) for s in scopes]))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def aversions(scopes):
+    """{scope: DataVersion} for `scopes`, read through the async ORM."""
+    return {row.scope: row async for row in DataVersion.objects.filter(scope__in=scopes)}
+
+
+def _state(name, request, wave, scopes, rows):
+    """(key, last_modified, locked) from the DataVersion rows of `scopes`."""
+    query = sorted((k, v) for k, values in request.GET.lists() for v in values)
+    key = version_key((name, request.path, query, request.META.get("HTTP_ACCEPT", "")), scopes, rows)
+    modified = [row.updated_at for row in rows.values()]
+    locked = bool(wave and wave_scope(wave) in rows and rows[wave_scope(wave)].is_locked)
+    return key, (max(modified) if modified else None), locked
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return "*" in etags or etag in etags
+    since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return bool(since and last_modified and int(last_modified.timestamp()) <= since)
+
+
+def cache_timeout(locked):
+    return None if locked else getattr(settings, "API_CACHE_TIMEOUT", 24 * 3600)
+
+
+def cache_headers(response, etag, last_modified, locked):
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    response["Cache-Control"] = f"public, max-age={LOCKED_MAX_AGE}, immutable" if locked else "no-cache"
+    response["Vary"] = "Accept"
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Conditional GET + body cache for read-only views.
+    cache_models: tables the response depends on.
+    cache_wave_param: query param naming a wave code, if the view is wave-scoped.
+    """
+    cache_models = ()
+    cache_wave_param = None
+
+    def cache_state(self, request):
+        wave = request.GET.get(self.cache_wave_param) if self.cache_wave_param else None
+        scopes = scopes_for(self.cache_models, wave)
+        rows = {row.scope: row for row in DataVersion.objects.filter(scope__in=scopes)}
+        return _state(type(self).__name__, request, wave, scopes, rows)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        key, last_modified, locked = self.cache_state(request)
+        etag = quote_etag(key[:40])
+        if not_modified(request, etag, last_modified):
+            return cache_headers(HttpResponseNotModified(), etag, last_modified, locked)
+
+        store = get_store()
+        cached = store.get(key)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response["X-Cache"] = "HIT"
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if response.streaming:
+                # exports: conditional GET still applies, the body is not kept
+                return cache_headers(response, etag, last_modified, locked)
+            if hasattr(response, "render"):
+                response.render()
+            store.set(key, (response.content, response.get("Content-Type")), cache_timeout(locked))
+            response["X-Cache"] = "MISS"
+        return cache_headers(response, etag, last_modified, locked)
+
+
+def async_cached(models=(), wave_param=None):
+    """
+    The CachedResponseMixin protocol for async function views (async ORM and cache calls).
+    The DataVersion rows read are left on request.data_versions for the view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, *args, **kwargs)
+            wave = request.GET.get(wave_param) if wave_param else None
+            scopes = scopes_for(models, wave)
+            rows = request.data_versions = await aversions(scopes)
+            key, last_modified, locked = _state(view.__name__, request, wave, scopes, rows)
+            etag = quote_etag(key[:40])
+            if not_modified(request, etag, last_modified):
+                return cache_headers(HttpResponseNotModified(), etag, last_modified, locked)
+
+            store = get_store()
+            cached = await store.aget(key)
+            if cached is not None:
+                response = HttpResponse(cached[0], content_type=cached[1])
+                response["X-Cache"] = "HIT"
+            else:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                await store.aset(key, (response.content, response.get("Content-Type")), cache_timeout(locked))
+                response["X-Cache"] = "MISS"
+            return cache_headers(response, etag, last_modified, locked)
+        return wrapper
+    return decorator
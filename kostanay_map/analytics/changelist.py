@@ -0,0 +1,141 @@
+"""
+Admin changelist pieces for tables too big for the stock ChangeList (DataPointAdmin).
+
+The stock changelist counts every matching row (twice unless
+show_full_result_count is off), pages with OFFSET and renders a link per related
+row for each list_filter; all of these grow with the table. HighVolumeAdminMixin
+swaps in an estimated count, keyset pages (?before=<pk>, newest first) and
+AutocompleteFilter, so a page costs the same at any depth and table size.
+"""
+import json
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.utils import get_last_value_from_parameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import connections
+from django.utils.translation import gettext as _
+
+EXACT_COUNT_LIMIT = 10000
+
+
+def _planner_rows(qs, connection):
+    """PostgreSQL's row estimate for qs: pg_class.reltuples unfiltered, EXPLAIN otherwise; None if never analyzed."""
+    with connection.cursor() as cursor:
+        if not qs.query.where:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [qs.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        sql, params = qs.order_by().values("pk").query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def estimated_count(qs, limit=EXACT_COUNT_LIMIT):
+    """
+    (count, kind) without scanning the table: kind is "exact" up to `limit` rows,
+    "estimate" for a PostgreSQL planner estimate above it and "at least" elsewhere
+    (count stops at `limit`).
+    """
+    connection = connections[qs.db]
+    if connection.vendor == "postgresql":
+        estimate = _planner_rows(qs, connection)
+        if estimate is not None and estimate > limit:
+            return estimate, "estimate"
+    count = qs.order_by()[:limit + 1].count()
+    return (count, "exact") if count <= limit else (limit, "at least")
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages by primary key, newest first: ?before=<pk> lists the rows below that key,
+    so the 1000th page costs what the first does. Column sorting has to stay off
+    (sortable_by = ()) since the key order is the page order.
+    """
+    cursor_param = "before"
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.cursor = int(request.GET[self.cursor_param]) if request.GET.get(self.cursor_param) else None
+        except ValueError:
+            raise IncorrectLookupParameters
+        super().__init__(request, *args, **kwargs)
+        self.params.pop(self.cursor_param, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(self.cursor_param, None)
+        return lookup_params
+
+    def get_results(self, request):
+        qs = self.queryset.order_by("-pk")
+        if self.cursor is not None:
+            qs = qs.filter(pk__lt=self.cursor)
+        rows = list(qs[:self.list_per_page + 1])
+        count, kind = estimated_count(self.queryset)
+
+        self.result_list = rows[:self.list_per_page]
+        self.result_count = count
+        self.result_count_label = {"exact": f"{count}", "estimate": f"≈{count}", "at least": f"{count}+"}[kind]
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = len(rows) > self.list_per_page or self.cursor is not None
+        self.paginator = None
+        self.next_page_url = (
+            self.get_query_string({self.cursor_param: self.result_list[-1].pk}) if len(rows) > self.list_per_page else None
+        )
+        self.first_page_url = self.get_query_string(remove=[self.cursor_param]) if self.cursor is not None else None
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    list_filter for a foreign key with many rows: one select2 box on the admin
+    autocomplete view (the related admin needs search_fields) instead of a link per row.
+    Usage: list_filter = (("question", AutocompleteFilter),)
+    """
+    template = "admin/analytics/autocomplete_filter.html"
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f"{field_path}__{field.target_field.name}__exact"
+        self.lookup_val = get_last_value_from_parameters(params, self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.formfield = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(), required=False,
+            widget=AutocompleteSelect(field, model_admin.admin_site, attrs={"data-lookup": self.lookup_kwarg}),
+        )
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.lookup_val is None,
+            "query_string": changelist.get_query_string(remove=[self.lookup_kwarg]),
+            "display": _("All"),
+        }
+
+    def rendered(self):
+        return self.formfield.widget.render(f"filter-{self.lookup_kwarg}", self.lookup_val, attrs={"id": f"filter-{self.lookup_kwarg}"})
+
+
+class HighVolumeAdminMixin:
+    """ModelAdmin mixin: estimated counts, keyset pages, no column sorting; use AutocompleteFilter in list_filter."""
+    change_list_template = "admin/analytics/keyset_change_list.html"
+    show_full_result_count = False
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
@@ -0,0 +1,114 @@
+"""
+Column-oriented payloads for numeric endpoints.
+
+A table is {"length": n, "columns": {name: [...]}, "dictionaries": {name: [...]}}:
+repeated strings (slugs, codes, option labels) are stored once in `dictionaries`
+and referenced by index (null when missing), values are float32. The packed JSON
+renderer writes this as is; the Arrow renderer turns it into an IPC stream with
+dictionary-encoded columns (only when pyarrow is installed).
+"""
+from decimal import Decimal
+
+import numpy as np
+
+# column name -> arrow type name; dictionary columns are "dictionary"
+DATAPOINT_COLUMNS = {
+    "id": "int64",
+    "wave_code": "dictionary",
+    "region_slug": "dictionary",
+    "city_slug": "dictionary",
+    "question_id": "int64",
+    "option_label": "dictionary",
+    "metric_code": "dictionary",
+    "value": "float32",
+}
+CHOROPLETH_COLUMNS = {
+    "metric": "dictionary",
+    "slug": "dictionary",
+    "value": "float32",
+    "count": "int64",
+    "sum": "float64",
+    "min": "float32",
+    "max": "float32",
+}
+
+ROLLUP_COLUMNS = {
+    "metric": "dictionary",
+    "slug": "dictionary",
+    "value": "float32",
+    "n": "float64",
+    "moe": "float32",
+    "low": "float32",
+    "high": "float32",
+}
+
+
+def float32(values):
+    """Round-trip through float32 and print the shortest repr that survives it."""
+    array = np.asarray([np.nan if v is None else float(v) for v in values], dtype=np.float32)
+    return [None if np.isnan(v) else float(np.format_float_positional(v, unique=True, trim="-")) for v in array]
+
+
+def build_table(rows, schema):
+    """rows: tuples in `schema` order. Returns the columnar dict described above."""
+    names = list(schema)
+    columns = {name: [] for name in names}
+    dictionaries = {name: {} for name, kind in schema.items() if kind == "dictionary"}
+    for row in rows:
+        for name, value in zip(names, row):
+            lookup = dictionaries.get(name)
+            if lookup is not None and value is not None:
+                value = lookup.setdefault(value, len(lookup))
+            elif isinstance(value, Decimal):
+                value = float(value)
+            columns[name].append(value)
+    for name, kind in schema.items():
+        if kind == "float32":
+            columns[name] = float32(columns[name])
+    return {
+        "length": len(columns[names[0]]),
+        "columns": columns,
+        "dictionaries": {name: list(lookup) for name, lookup in dictionaries.items()},
+        "types": dict(schema),
+    }
+
+
+def datapoint_table(qs):
+    rows = qs.order_by("id").values_list(
+        "id", "wave__code", "region__slug", "city__slug", "question_id", "option__label", "metric__code", "value",
+    )
+    return build_table(rows.iterator(chunk_size=5000), DATAPOINT_COLUMNS)
+
+
+def choropleth_table(cells_by_metric):
+    """cells_by_metric: output of cube.choropleth()."""
+    rows = (
+        (metric, slug, average, count, total, minimum, maximum)
+        for metric, cells in cells_by_metric.items()
+        for slug, average, count, total, minimum, maximum in cells
+    )
+    return build_table(rows, CHOROPLETH_COLUMNS)
+
+
+def rollup_table(cells_by_metric):
+    """cells_by_metric: output of rollup.by_owner()."""
+    rows = ((metric, *cell) for metric, cells in cells_by_metric.items() for cell in cells)
+    return build_table(rows, ROLLUP_COLUMNS)
+
+
+def to_arrow(table):
+    """RecordBatch for a columnar dict; needs pyarrow."""
+    import pyarrow as pa
+
+    arrays, names = [], []
+    for name, kind in table["types"].items():
+        values = table["columns"][name]
+        if kind == "dictionary":
+            array = pa.DictionaryArray.from_arrays(
+                pa.array(values, type=pa.int32()), pa.array(table["dictionaries"][name], type=pa.string()),
+            )
+        else:
+            array = pa.array(values, type=getattr(pa, kind)())
+        arrays.append(array)
+        names.append(name)
+    return pa.RecordBatch.from_arrays(arrays, names=names)
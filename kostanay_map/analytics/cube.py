@@ -0,0 +1,121 @@
+"""
+Choropleth cube: ChoroplethCell rows hold count/sum/min/max/avg of DataPoint.value
+per (wave, metric, level, slug).
+
+Single DataPoint writes refresh only the cells they touch (see signals);
+bulk loads call `refresh_cube` for the waves they wrote, which rebuilds those
+waves with one aggregate query per level.
+"""
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Sum
+
+from .cache import bump_models
+from .models import Region, City, SurveyWave, Metric, DataPoint, ChoroplethCell
+
+LEVELS = ("city", "region")
+
+
+def _aggregates():
+    return {
+        "count": Count("id"),
+        "total": Sum("value"),
+        "minimum": Min("value"),
+        "maximum": Max("value"),
+        "average": Avg("value"),
+    }
+
+
+def _stats(row):
+    return {
+        "count": row["count"],
+        "total": float(row["total"] or 0),
+        "minimum": float(row["minimum"] or 0),
+        "maximum": float(row["maximum"] or 0),
+        "average": float(row["average"] or 0),
+    }
+
+
+def refresh_cell(wave_id, metric_id, level, owner_id):
+    """Recompute one cell from DataPoint; deletes it when no datapoints are left."""
+    if not owner_id:
+        return
+    key = {"wave_id": wave_id, "metric_id": metric_id, "level": level, "owner_id": owner_id}
+    row = DataPoint.objects.filter(wave_id=wave_id, metric_id=metric_id, **{f"{level}_id": owner_id}) \
+        .aggregate(**_aggregates())
+    if not row["count"]:
+        ChoroplethCell.objects.filter(**key).delete()
+        return
+    owner = (City if level == "city" else Region).objects.only("slug").get(pk=owner_id)
+    ChoroplethCell.objects.update_or_create(**key, defaults={
+        **_stats(row),
+        "wave_code": SurveyWave.objects.values_list("code", flat=True).get(pk=wave_id),
+        "metric_code": Metric.objects.values_list("code", flat=True).get(pk=metric_id),
+        "slug": owner.slug,
+    })
+
+
+def refresh_datapoint(dp):
+    for level in LEVELS:
+        refresh_cell(dp.wave_id, dp.metric_id, level, getattr(dp, f"{level}_id"))
+
+
+def refresh_cube(waves=None):
+    """
+    Rebuild cells for the given waves (ids or SurveyWave objects; all waves when None)
+    with one GROUP BY per level. Returns the number of cells written.
+    """
+    datapoints = DataPoint.objects.all()
+    cells = ChoroplethCell.objects.all()
+    if waves is not None:
+        wave_ids = [getattr(w, "pk", w) for w in waves]
+        datapoints = datapoints.filter(wave_id__in=wave_ids)
+        cells = cells.filter(wave_id__in=wave_ids)
+
+    new_cells = []
+    for level in LEVELS:
+        rows = (
+            datapoints.exclude(**{f"{level}__isnull": True})
+            .values("wave_id", "metric_id", f"{level}_id", "wave__code", "metric__code", f"{level}__slug")
+            .annotate(**_aggregates())
+            .order_by()
+        )
+        new_cells += [
+            ChoroplethCell(
+                wave_id=r["wave_id"], metric_id=r["metric_id"], level=level, owner_id=r[f"{level}_id"],
+                wave_code=r["wave__code"], metric_code=r["metric__code"], slug=r[f"{level}__slug"],
+                **_stats(r),
+            )
+            for r in rows
+        ]
+    with transaction.atomic():
+        cells.delete()
+        ChoroplethCell.objects.bulk_create(new_cells, batch_size=2000)
+        wave_codes = SurveyWave.objects.all() if waves is None else SurveyWave.objects.filter(pk__in=wave_ids)
+        bump_models(ChoroplethCell, waves=wave_codes.values_list("code", flat=True))
+    return len(new_cells)
+
+
+def _choropleth_rows(metric_codes, wave_code, level):
+    return (
+        ChoroplethCell.objects
+        .filter(wave_code=wave_code, level=level, metric_code__in=metric_codes)
+        .order_by("metric_code", "slug")
+        .values_list("metric_code", "slug", "average", "count", "total", "minimum", "maximum")
+    )
+
+
+def _by_metric(metric_codes, rows):
+    result = {code: [] for code in metric_codes}
+    for metric_code, *cell in rows:
+        result[metric_code].append(tuple(cell))
+    return result
+
+
+def choropleth(metric_codes, wave_code, level="city"):
+    """{metric_code: [(slug, average, count, total, minimum, maximum), ...]} read straight from the cube."""
+    return _by_metric(metric_codes, _choropleth_rows(metric_codes, wave_code, level))
+
+
+async def achoropleth(metric_codes, wave_code, level="city"):
+    """choropleth through the async ORM."""
+    return _by_metric(metric_codes, [row async for row in _choropleth_rows(metric_codes, wave_code, level)])
@@ -0,0 +1,94 @@
+"""
+Bootstrap payload of the main page: cities, surveys, metrics and grouped
+questions for one wave / survey / city in a single response.
+
+Every component is cached on its own in the `api` store, keyed by its own
+parameters and the DataVersions of the tables it reads, so loading a wave
+only rebuilds the questions while cities, surveys and metrics stay hits.
+The components share what they already fetched: the survey list picks the
+default survey, and the city list names the DataPoint rows of the grouped
+questions and resolves the city filter, so that query skips the City join.
+"""
+import asyncio
+
+from .aggregation import agrouped_questions
+from .api.fast import FastList
+from .api.serializers import CitySerializer, MetricSerializer, SurveySerializer
+from .cache import aversions, cache_timeout, get_store, scopes_for, version_key, wave_scope
+from .geometry import pick_level, tolerance_for_zoom
+from .models import Region, City, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint
+
+DEFAULT_ZOOM = 9
+COMPONENTS = {
+    "cities": (City, Region, FeatureLevel),
+    "surveys": (Survey, SurveyWave),
+    "metrics": (Metric,),
+    "questions": (Question, Survey, SurveyWave, DataPoint, AnswerOption, Metric, City),
+}
+DASHBOARD_MODELS = tuple(dict.fromkeys(m for models in COMPONENTS.values() for m in models))
+
+
+def feature_level(zoom):
+    # 0: parsed full geometry when no stored level is coarse enough (see FeatureLevelMixin)
+    return pick_level(tolerance_for_zoom(zoom)) or 0
+
+
+async def _cities(level):
+    qs = City.objects.select_related("region").order_by("region__sort_order", "sort_order")
+    return await FastList(CitySerializer, {"feature_level": level}).adata(qs)
+
+
+async def _surveys(wave_code):
+    qs = Survey.objects.order_by("id")
+    if wave_code:
+        qs = qs.filter(wave__code=wave_code)
+    return await FastList(SurveySerializer).adata(qs)
+
+
+async def _metrics():
+    return await FastList(MetricSerializer).adata(Metric.objects.order_by("code"))
+
+
+async def build(wave_code=None, survey_id=None, city_slug=None, zoom=DEFAULT_ZOOM, versions=None):
+    """
+    ({"wave", "survey_id", "city", "cities", "surveys", "metrics", "questions"}, {component: "HIT"|"MISS"}).
+    Without survey_id the wave's first survey is used; a city slug that is not a known city is dropped.
+    `versions`: DataVersion rows already read for these scopes (async_cached's request.data_versions).
+    """
+    level = feature_level(zoom)
+    # only the questions read wave-versioned data; the other parts follow their tables alone
+    scopes = {name: scopes_for(models, wave_code if name == "questions" else None) for name, models in COMPONENTS.items()}
+    wanted = sorted({s for names in scopes.values() for s in names})
+    rows = versions if versions is not None else await aversions(wanted)
+    wave_row = rows.get(wave_scope(wave_code)) if wave_code else None
+    locked = bool(wave_row and wave_row.is_locked)
+    store = get_store()
+
+    def key(name, *params):
+        return version_key(("dashboard", name, *params), scopes[name], rows)
+
+    keys = {"cities": key("cities", level), "surveys": key("surveys", wave_code), "metrics": key("metrics")}
+    found = await store.aget_many(list(keys.values()))
+    data = {name: found[k] for name, k in keys.items() if k in found}
+    status = {name: "HIT" if name in data else "MISS" for name in keys}
+    builders = {"cities": lambda: _cities(level), "surveys": lambda: _surveys(wave_code), "metrics": _metrics}
+    missing = [name for name in keys if name not in data]
+    data.update(zip(missing, await asyncio.gather(*(builders[name]() for name in missing))))
+
+    if not survey_id and data["surveys"]:
+        survey_id = data["surveys"][0]["id"]
+    if city_slug and city_slug not in {c["slug"] for c in data["cities"]}:
+        city_slug = None
+    keys["questions"] = key("questions", wave_code, survey_id, city_slug)
+    questions = await store.aget(keys["questions"])
+    status["questions"] = "MISS" if questions is None else "HIT"
+    if questions is None:
+        questions = await agrouped_questions(
+            wave_code=wave_code, survey_id=survey_id, city_slug=city_slug, cities=data["cities"],
+        )
+    data["questions"] = questions
+
+    fresh = {keys[name]: data[name] for name, hit in status.items() if hit == "MISS"}
+    if fresh:
+        await store.aset_many(fresh, cache_timeout(locked))
+    return {"wave": wave_code, "survey_id": survey_id, "city": city_slug, **data}, status
@@ -0,0 +1,56 @@
+"""
+Flat DataPoint rows for cursor pages and streaming exports.
+
+Rows come from `.values()` over the filtered queryset, so no model instances and
+no geometry are loaded; related objects are reduced to their code, slug or id.
+"""
+import csv
+import io
+import json
+
+from django.db.models import F
+
+FLAT_FIELDS = ("id", "wave_code", "region_slug", "city_slug", "question_id", "option_id", "metric_code", "value", "extra")
+
+
+def flat_values(qs):
+    return qs.values(
+        "id", "question_id", "option_id", "value", "extra",
+        wave_code=F("wave__code"), region_slug=F("region__slug"),
+        city_slug=F("city__slug"), metric_code=F("metric__code"),
+    )
+
+
+def flat_row(row):
+    row = {field: row[field] for field in FLAT_FIELDS}
+    row["value"] = str(row["value"])  # same string form as DataPointSerializer
+    return row
+
+
+def iter_rows(qs, chunk_size=2000):
+    for row in flat_values(qs).order_by("id").iterator(chunk_size=chunk_size):
+        yield flat_row(row)
+
+
+def iter_ndjson(qs, chunk_size=2000):
+    for row in iter_rows(qs, chunk_size):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_csv(qs, chunk_size=2000):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def pop():
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return value
+
+    writer.writerow(FLAT_FIELDS)
+    yield pop()
+    for row in iter_rows(qs, chunk_size):
+        if row["extra"] is not None:
+            row["extra"] = json.dumps(row["extra"], ensure_ascii=False)
+        writer.writerow([row[field] for field in FLAT_FIELDS])
+        yield pop()
@@ -0,0 +1,175 @@
+"""
+GeoJSON district import (see the `import_geojson` command).
+
+Sources are a folder of `<slug>.geojson` files or one collection file: either
+the city.json layout (a JSON array of {slug, name, feature, sort_order}) or a
+GeoJSON FeatureCollection whose features carry `slug` / `name` properties.
+
+Every source is parsed, repaired (geometry.repair_geometry) and pre-simplified
+(geometry.build_levels) by `prepare`, in a process pool when there are several
+workers; the database is then written by `save` in one transaction: the
+cities upserted with one bulk statement, the FeatureLevel rows of changed
+outlines replaced, the stale tiles dropped and the data versions bumped once.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import transaction
+
+from .geometry import (
+    bounding_box, build_levels, count_points, feature_hash, parse_feature, prune_geometries, repair_geometry,
+    store_geometries,
+)
+
+DEFAULT_NDIGITS = 6  # ~0.1 m, far below what the map can show
+
+
+def read_folder(folder):
+    """Jobs for every <slug>.geojson in a folder, sorted by slug."""
+    return [
+        {"slug": os.path.splitext(name)[0], "path": os.path.join(folder, name)}
+        for name in sorted(os.listdir(folder)) if name.endswith(".geojson")
+    ]
+
+
+def read_collection(path):
+    """Jobs for a city.json-style array or a FeatureCollection with slug properties."""
+    with open(path, encoding="utf-8-sig") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return [
+            {"slug": item["slug"], "name": item.get("name"), "sort_order": item.get("sort_order"), "source": item.get("feature")}
+            for item in data
+        ]
+    if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        jobs = []
+        for n, feature in enumerate(data.get("features") or []):
+            properties = feature.get("properties") or {}
+            slug = properties.get("slug") or feature.get("id")
+            if not slug:
+                raise ValueError(f"{path}: feature {n} has no slug property or id")
+            jobs.append({
+                "slug": str(slug), "name": properties.get("name"), "sort_order": properties.get("sort_order"),
+                "source": {"type": "FeatureCollection", "features": [feature]},
+            })
+        return jobs
+    raise ValueError(f"{path}: expected a JSON array of cities or a FeatureCollection")
+
+
+def prepare(job):
+    """
+    Parse, repair and simplify one source (runs in the worker processes).
+    job: {slug, path | source, ndigits, known_hash}; the result adds feature, hash,
+    levels (None when the hash is known), fixes, errors, sizes and timings.
+    """
+    started = time.perf_counter()
+    result = {**job, "feature": None, "hash": None, "levels": None, "fixes": {}, "errors": []}
+    try:
+        if job.get("path"):
+            with open(job["path"], encoding="utf-8-sig") as f:
+                raw = f.read()
+        else:
+            raw = job.get("source")
+            raw = raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False)
+        result["bytes_in"] = len(raw.encode("utf-8"))
+        source = json.loads(raw)
+    except (OSError, ValueError) as e:
+        result["errors"].append(f"cannot read: {e}")
+        result["timings"] = {"parse": time.perf_counter() - started}
+        return result
+    parsed = time.perf_counter()
+
+    feature, fixes, errors = repair_geometry(source, job.get("ndigits", DEFAULT_NDIGITS))
+    repaired = time.perf_counter()
+    result.update(fixes=dict(fixes), errors=errors, points_in=count_points(parse_feature(source)))
+    if feature is not None:
+        result.update(
+            feature=feature, hash=feature_hash(feature), points_out=count_points(feature),
+            bytes_out=len(json.dumps(feature, ensure_ascii=False).encode("utf-8")),
+        )
+        if result["hash"] != job.get("known_hash"):
+            result["levels"] = build_levels(feature)
+    result["timings"] = {
+        "parse": parsed - started, "repair": repaired - parsed, "levels": time.perf_counter() - repaired,
+    }
+    return result
+
+
+def known_hashes(slugs):
+    """{slug: source hash of the stored FeatureLevel rows} for cities already imported."""
+    from .models import FeatureLevel
+
+    return dict(
+        FeatureLevel.objects.filter(city__slug__in=slugs).exclude(source_hash="")
+        .values_list("city__slug", "source_hash")
+    )
+
+
+def prepare_all(jobs, workers=None, ndigits=DEFAULT_NDIGITS, progress=None):
+    """Run `prepare` over the jobs, in `workers` processes (None: one per CPU, 1: in this process)."""
+    known = known_hashes([job["slug"] for job in jobs])
+    jobs = [{**job, "ndigits": ndigits, "known_hash": known.get(job["slug"])} for job in jobs]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    results = []
+    try:
+        for result in pool.map(prepare, jobs) if pool else map(prepare, jobs):
+            results.append(result)
+            if progress:
+                progress(result)
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
+
+
+def save(region, results, oblast_slug=None):
+    """
+    Upsert the repaired cities of `region` in one transaction (results without
+    a feature are skipped). Returns {created, updated, levels}.
+    """
+    from . import tiles
+    from .cache import bump_models
+    from .models import City, FeatureLevel
+
+    results = [r for r in results if r["feature"] is not None]
+    slugs = [r["slug"] for r in results]
+    with transaction.atomic():
+        existing = {
+            slug: (name, sort_order, geometry_id, bbox)
+            for slug, name, sort_order, geometry_id, bbox in City.objects.filter(slug__in=slugs)
+            .values_list("slug", "name", "sort_order", "geometry_id", "geometry__bbox")
+        }
+        geometries = store_geometries([r["feature"] for r in results])
+        cities = []
+        for r, geometry in zip(results, geometries):
+            name, sort_order, _, _ = existing.get(r["slug"], (r["slug"].replace("-", " ").title(), 0, None, None))
+            cities.append(City(
+                region=region, slug=r["slug"], geometry=geometry, name=r.get("name") or name,
+                sort_order=sort_order if r.get("sort_order") is None else r["sort_order"], is_oblast=r["slug"] == oblast_slug,
+            ))
+        City.objects.bulk_create(
+            cities, update_conflicts=True, unique_fields=["slug"],
+            update_fields=["region", "name", "geometry", "sort_order", "is_oblast"], batch_size=200,
+        )
+
+        changed = [r for r in results if r["levels"] is not None]
+        ids = dict(City.objects.filter(slug__in=[r["slug"] for r in changed]).values_list("slug", "id"))
+        FeatureLevel.objects.filter(city_id__in=ids.values()).delete()
+        FeatureLevel.objects.bulk_create([
+            FeatureLevel(
+                city_id=ids[r["slug"]], tolerance=tolerance, feature=simplified, points=points,
+                bbox=bounding_box(simplified), source_hash=r["hash"],
+            )
+            for r in changed for tolerance, simplified, points in r["levels"]
+        ], batch_size=200)
+
+        for r, geometry in zip(results, geometries):
+            if r["levels"] is not None:
+                tiles.invalidate_bbox(existing.get(r["slug"], (None,) * 4)[3])
+                tiles.invalidate_bbox(geometry.bbox)
+        prune_geometries([old[2] for old in existing.values() if old[2]])
+        bump_models(City, FeatureLevel)
+    return {"created": len(set(slugs) - set(existing)), "updated": len(set(slugs) & set(existing)), "levels": len(changed)}
@@ -0,0 +1,440 @@
+import hashlib
+import importlib.util
+import json
+from collections import Counter
+
+from django.db import transaction
+
+# optional: repairs self-intersecting rings; without it they are only reported
+if importlib.util.find_spec("shapely") is not None:
+    import shapely
+    from shapely.geometry import mapping, shape
+else:
+    shapely = None
+
+# Simplification tolerances in degrees, finest first. At zoom z one screen pixel
+# covers about 360 / (256 * 2**z) degrees, so these cover zooms ~6..12.
+TOLERANCES = (0.0002, 0.001, 0.004, 0.016)
+
+
+def tolerance_for_zoom(zoom):
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def pick_level(tolerance):
+    """Coarsest stored tolerance that still fits `tolerance`, or None for full resolution."""
+    fitting = [t for t in TOLERANCES if t <= tolerance]
+    return max(fitting) if fitting else None
+
+
+def parse_feature(feature):
+    """City.feature may hold a GeoJSON dict or its JSON-encoded string."""
+    if not feature:
+        return None
+    if isinstance(feature, str):
+        try:
+            return json.loads(feature)
+        except ValueError:
+            return None
+    return feature
+
+
+def _segment_distance(p, a, b):
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    if dx == 0 and dy == 0:
+        return ((p[0] - ax) ** 2 + (p[1] - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((p[0] - ax) * dx + (p[1] - ay) * dy) / (dx * dx + dy * dy)))
+    return ((p[0] - ax - t * dx) ** 2 + (p[1] - ay - t * dy) ** 2) ** 0.5
+
+
+def simplify_line(points, tolerance):
+    """Iterative Douglas–Peucker; keeps both endpoints."""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(start + 1, end):
+            d = _segment_distance(points[i], points[start], points[end])
+            if d > max_dist:
+                max_dist, index = d, i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def simplify_ring(ring, tolerance):
+    """
+    Closed rings start and end on the same point, which makes plain DP degenerate,
+    so split at the vertex farthest from the start and simplify both halves.
+    Returns None when the ring collapses below a valid polygon.
+    """
+    if len(ring) < 4:
+        return None
+    first = ring[0]
+    split = max(range(1, len(ring) - 1), key=lambda i: (ring[i][0] - first[0]) ** 2 + (ring[i][1] - first[1]) ** 2)
+    head = simplify_line(ring[:split + 1], tolerance)
+    tail = simplify_line(ring[split:], tolerance)
+    out = head[:-1] + tail
+    return out if len(out) >= 4 else None
+
+
+def _round(points, ndigits):
+    return [[round(x, ndigits), round(y, ndigits)] for x, y, *_ in points]
+
+
+def _simplify_polygon(rings, tolerance, ndigits):
+    out = []
+    for i, ring in enumerate(rings):
+        simplified = simplify_ring(ring, tolerance)
+        if simplified is None:
+            if i == 0:
+                return None
+            continue
+        out.append(_round(simplified, ndigits))
+    return out
+
+
+def simplify_geometry(geometry, tolerance):
+    """Simplified copy of a GeoJSON geometry, feature or collection."""
+    if not geometry:
+        return geometry
+    # keep coordinates about ten times finer than the tolerance
+    ndigits = max(0, min(7, len(str(int(1 / tolerance))) + 1))
+    kind = geometry.get("type")
+    if kind == "FeatureCollection":
+        return {**geometry, "features": [simplify_geometry(f, tolerance) for f in geometry.get("features", [])]}
+    if kind == "Feature":
+        return {**geometry, "geometry": simplify_geometry(geometry.get("geometry"), tolerance)}
+    if kind == "GeometryCollection":
+        return {**geometry, "geometries": [simplify_geometry(g, tolerance) for g in geometry.get("geometries", [])]}
+    coords = geometry.get("coordinates")
+    if kind == "LineString":
+        coords = _round(simplify_line(coords, tolerance), ndigits)
+    elif kind == "MultiLineString":
+        coords = [_round(simplify_line(line, tolerance), ndigits) for line in coords]
+    elif kind == "Polygon":
+        coords = _simplify_polygon(coords, tolerance, ndigits) or coords
+    elif kind == "MultiPolygon":
+        polygons = [_simplify_polygon(p, tolerance, ndigits) for p in coords]
+        # never drop every part: a tiny district should still be clickable
+        coords = [p for p in polygons if p] or coords
+    return {**geometry, "coordinates": coords}
+
+
+def iter_positions(geometry):
+    if isinstance(geometry, dict):
+        for key in ("features", "geometry", "geometries", "coordinates"):
+            if key in geometry:
+                yield from iter_positions(geometry[key])
+    elif isinstance(geometry, list):
+        if geometry and isinstance(geometry[0], (int, float)):
+            yield geometry
+        else:
+            for item in geometry:
+                yield from iter_positions(item)
+
+
+def count_points(geometry):
+    return sum(1 for _ in iter_positions(geometry))
+
+
+def bounding_box(geometry):
+    """[min_lon, min_lat, max_lon, max_lat] or None for an empty geometry."""
+    xs, ys = [], []
+    for position in iter_positions(geometry):
+        xs.append(position[0])
+        ys.append(position[1])
+    return [min(xs), min(ys), max(xs), max(ys)] if xs else None
+
+
+def iter_polygons(geometry):
+    """Every polygon (as a list of rings) inside a GeoJSON geometry, feature or collection."""
+    if not isinstance(geometry, dict):
+        return
+    kind = geometry.get("type")
+    if kind == "FeatureCollection":
+        for feature in geometry.get("features", []):
+            yield from iter_polygons(feature)
+    elif kind == "Feature":
+        yield from iter_polygons(geometry.get("geometry"))
+    elif kind == "GeometryCollection":
+        for item in geometry.get("geometries", []):
+            yield from iter_polygons(item)
+    elif kind == "Polygon":
+        yield geometry["coordinates"]
+    elif kind == "MultiPolygon":
+        yield from geometry["coordinates"]
+
+
+def ring_area(ring):
+    """Signed shoelace area of a closed ring: positive when counter-clockwise."""
+    return sum(x0 * y1 - x1 * y0 for (x0, y0, *_), (x1, y1, *_) in zip(ring, ring[1:])) / 2
+
+
+def _orient(a, b, c):
+    v = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (v > 0) - (v < 0)
+
+
+def _between(a, b, p):
+    return min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def segments_intersect(a, b, c, d):
+    o1, o2, o3, o4 = _orient(a, b, c), _orient(a, b, d), _orient(c, d, a), _orient(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _between(a, b, c)) or (o2 == 0 and _between(a, b, d))
+            or (o3 == 0 and _between(c, d, a)) or (o4 == 0 and _between(c, d, b)))
+
+
+def self_intersection(ring):
+    """
+    First crossing of two non-adjacent edges of a closed ring as a point near it,
+    or None. Edges are swept by their min x, so only edges overlapping in x are tested.
+    """
+    n = len(ring) - 1
+    edges = sorted(range(n), key=lambda i: min(ring[i][0], ring[i + 1][0]))
+    active = []
+    for i in edges:
+        a, b = ring[i], ring[i + 1]
+        left = min(a[0], b[0])
+        active = [j for j in active if max(ring[j][0], ring[j + 1][0]) >= left]
+        for j in active:
+            if abs(i - j) in (1, n - 1):
+                continue  # neighbours share a vertex
+            if segments_intersect(a, b, ring[j], ring[j + 1]):
+                return a
+        active.append(i)
+    return None
+
+
+def clean_ring(ring, ndigits, fixes):
+    """
+    Ring rounded to `ndigits` (Z dropped), without repeated points or zero-width
+    spikes, and closed. None when fewer than three distinct vertices remain.
+    """
+    points = [[round(x, ndigits), round(y, ndigits)] for x, y, *_ in ring]
+    if points and points[0] == points[-1]:
+        points.pop()
+    elif points:
+        fixes["unclosed ring"] += 1
+    out = []
+    for p in points:
+        if out and p == out[-1]:
+            fixes["repeated point"] += 1
+        elif len(out) >= 2 and p == out[-2]:
+            out.pop()  # A, B, A: the spike to B has no area
+            fixes["spike"] += 1
+        else:
+            out.append(p)
+    while len(out) > 1 and out[-1] == out[0]:
+        out.pop()
+        fixes["repeated point"] += 1
+    return out + [out[0]] if len(out) >= 3 else None
+
+
+def _make_valid(rings):
+    """Polygons (lists of rings) covering the same area as a self-intersecting polygon, via shapely."""
+    fixed = shapely.make_valid(shape({"type": "Polygon", "coordinates": rings}))
+    parts = getattr(fixed, "geoms", [fixed])
+    polygons = []
+    for part in parts:
+        geojson = mapping(part)
+        if geojson["type"] == "Polygon":
+            polygons.append(geojson["coordinates"])
+        elif geojson["type"] == "MultiPolygon":
+            polygons.extend(geojson["coordinates"])
+    return [[[list(p) for p in ring] for ring in polygon] for polygon in polygons]
+
+
+def repair_polygon(rings, ndigits, fixes, errors, valid=False):
+    """
+    Cleaned polygons for one GeoJSON polygon, wound the RFC 7946 way (outer ring
+    counter-clockwise, holes clockwise). Usually one; several after a shapely repair.
+    """
+    cleaned = []
+    for i, ring in enumerate(rings):
+        ring = clean_ring(ring, ndigits, fixes)
+        if ring is not None and ring_area(ring) == 0 and self_intersection(ring) is None:
+            ring = None  # collinear; a bow tie also sums to zero but is repairable
+        if ring is None:
+            if i == 0:
+                fixes["degenerate polygon dropped"] += 1
+                return []
+            fixes["degenerate hole dropped"] += 1
+            continue
+        if (ring_area(ring) > 0) != (i == 0):
+            ring.reverse()
+            fixes["winding order"] += 1
+        cleaned.append(ring)
+
+    if not valid:
+        for ring in cleaned:
+            crossing = self_intersection(ring)
+            if crossing is None:
+                continue
+            if shapely is None:
+                errors.append(f"self-intersection near {crossing[0]}, {crossing[1]}")
+                break
+            fixes["self-intersection"] += 1
+            return [p for polygon in _make_valid(cleaned) for p in repair_polygon(polygon, ndigits, fixes, errors, True)]
+    return [cleaned]
+
+
+def repair_geometry(geometry, ndigits=6):
+    """
+    Validated copy of a GeoJSON geometry, feature or collection: coordinates rounded
+    to `ndigits`, rings cleaned and re-wound, self-intersections repaired when
+    shapely is installed. Returns (geometry, fixes: Counter, errors: [str]);
+    geometry is None when nothing valid is left.
+    """
+    fixes, errors = Counter(), []
+
+    def repair(obj):
+        if not isinstance(obj, dict) or "type" not in obj:
+            errors.append("not a GeoJSON object")
+            return None
+        kind = obj["type"]
+        if kind == "FeatureCollection":
+            features = [f for f in (repair(f) for f in obj.get("features") or []) if f is not None]
+            return {**obj, "features": features} if features else None
+        if kind == "Feature":
+            if obj.get("geometry") is None:
+                fixes["empty feature dropped"] += 1
+                return None
+            geometry = repair(obj["geometry"])
+            return {**obj, "geometry": geometry} if geometry is not None else None
+        if kind == "GeometryCollection":
+            geometries = [g for g in (repair(g) for g in obj.get("geometries") or []) if g is not None]
+            return {**obj, "geometries": geometries} if geometries else None
+        coords = obj.get("coordinates")
+        if not isinstance(coords, list):
+            errors.append(f"{kind} without coordinates")
+            return None
+        for position in iter_positions(coords):
+            if len(position) < 2 or not (-180 <= position[0] <= 180 and -90 <= position[1] <= 90):
+                errors.append(f"{kind} has a position out of range: {position}")
+                return None
+        if kind == "Polygon":
+            polygons = repair_polygon(coords, ndigits, fixes, errors)
+        elif kind == "MultiPolygon":
+            polygons = [p for polygon in coords for p in repair_polygon(polygon, ndigits, fixes, errors)]
+        elif kind in ("Point", "MultiPoint", "LineString", "MultiLineString"):
+            return {**obj, "coordinates": _round_positions(coords, ndigits)}
+        else:
+            errors.append(f"unknown geometry type {kind!r}")
+            return None
+        if not polygons:
+            return None
+        if len(polygons) == 1:
+            return {**obj, "type": "Polygon", "coordinates": polygons[0]}
+        return {**obj, "type": "MultiPolygon", "coordinates": polygons}
+
+    try:
+        repaired = repair(parse_feature(geometry))
+    except (TypeError, ValueError, IndexError) as e:
+        errors.append(f"malformed coordinates: {e}")
+        repaired = None
+    if repaired is None and not errors:
+        errors.append("no polygon left after repair")
+    return repaired, fixes, errors
+
+
+def _round_positions(coords, ndigits):
+    if coords and isinstance(coords[0], (int, float)):
+        return [round(c, ndigits) for c in coords[:2]]
+    return [_round_positions(c, ndigits) for c in coords]
+
+
+def build_levels(feature):
+    """[(tolerance, simplified_geojson, points), ...] for every stored tolerance."""
+    geojson = parse_feature(feature)
+    if not geojson:
+        return []
+    levels = []
+    for tolerance in TOLERANCES:
+        simplified = simplify_geometry(geojson, tolerance)
+        levels.append((tolerance, simplified, count_points(simplified)))
+    return levels
+
+
+def feature_hash(feature):
+    if isinstance(feature, str):
+        raw = feature
+    else:
+        raw = json.dumps(feature, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def store_geometries(features):
+    """
+    Geometry rows for GeoJSON values (dicts or JSON strings), created when their
+    hash is new; None for empty ones. One insert and one select for the batch.
+    """
+    from .models import Geometry
+
+    parsed = [parse_feature(f) or None for f in features]
+    hashes = [feature_hash(g) if g else None for g in parsed]
+    by_hash = {h: g for h, g in zip(hashes, parsed) if h}
+    if not by_hash:
+        return [None] * len(parsed)
+    Geometry.objects.bulk_create([
+        Geometry(hash=h, feature=g, points=count_points(g), bbox=bounding_box(g)) for h, g in by_hash.items()
+    ], ignore_conflicts=True)
+    stored = {
+        h: Geometry(id=pk, hash=h, feature=by_hash[h], points=points, bbox=bbox)
+        for pk, h, points, bbox in Geometry.objects.filter(hash__in=by_hash).values_list("id", "hash", "points", "bbox")
+    }
+    return [stored[h] if h else None for h in hashes]
+
+
+def prune_geometries(ids=None):
+    """Delete Geometry rows (of `ids`, or all) no Region or City points at any more."""
+    from django.db.models import Exists, OuterRef
+    from .models import Region, City, Geometry
+
+    orphans = Geometry.objects.exclude(Exists(City.objects.filter(geometry=OuterRef("pk")))) \
+        .exclude(Exists(Region.objects.filter(geometry=OuterRef("pk"))))
+    if ids is not None:
+        orphans = orphans.filter(pk__in=ids)
+    return orphans.delete()[0]
+
+
+def rebuild_feature_levels(owner, force=False):
+    """
+    Recompute FeatureLevel rows for a Region or City. Skips the work when the
+    stored levels were built from the same feature. Returns True if rebuilt.
+    """
+    from .models import Region, FeatureLevel, Geometry
+
+    key = {"region": owner} if isinstance(owner, Region) else {"city": owner}
+    if not owner.geometry_id:
+        source_hash = ""
+    elif owner._meta.get_field("geometry").is_cached(owner):
+        source_hash = owner.geometry.hash
+    else:  # the polygon itself is only loaded when the levels are rebuilt
+        source_hash = Geometry.objects.filter(pk=owner.geometry_id).values_list("hash", flat=True).get()
+    existing = FeatureLevel.objects.filter(**key)
+    if not force and source_hash:
+        hashes = list(existing.values_list("source_hash", flat=True))
+        if len(hashes) == len(TOLERANCES) and set(hashes) == {source_hash}:
+            return False
+
+    with transaction.atomic():
+        existing.delete()
+        FeatureLevel.objects.bulk_create([
+            FeatureLevel(
+                **key, tolerance=tolerance, feature=simplified, points=points,
+                bbox=bounding_box(simplified), source_hash=source_hash,
+            )
+            for tolerance, simplified, points in build_levels(owner.feature)
+        ])
+    return True
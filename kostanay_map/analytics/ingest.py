@@ -0,0 +1,521 @@
+"""
+Bulk survey data loading (see the `load_wave` command).
+
+Rows are streamed from JSON / JSONL / CSV / XLSX, normalized to flat dicts,
+their Region/City/Survey/Question/AnswerOption/Metric resolved through in-memory
+dimension caches and written as DataPoints in batches.
+"""
+import csv
+import io
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils.text import slugify
+
+from . import tiles
+from .cache import bump_models
+from .cube import refresh_cube
+from .models import Region, City, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint
+
+FORMATS = ("json", "jsonl", "csv", "xlsx")
+UNIQUE_FIELDS = ("wave", "region", "city", "question", "option", "metric")
+# t1.py filed the oblast's rows under this slug; other regions get a transliterated one
+REGION_NAME, REGION_SLUG = "Костанайская область", "kostanayskaya-oblast"
+LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "",
+    "э": "e", "ю": "yu", "я": "ya", "ә": "a", "ғ": "g", "қ": "k", "ң": "n", "ө": "o", "ұ": "u", "ү": "u",
+    "һ": "h", "і": "i",
+})
+
+
+def region_slug(name):
+    """kostanayskaya-oblast for the oblast, a Latin slug of the name for any other region."""
+    if name == REGION_NAME:
+        return REGION_SLUG
+    return slugify(name.lower().translate(LATIN)) or slugify(name, allow_unicode=True)
+
+
+# --- readers -----------------------------------------------------------------
+
+def _read_json(path, chunk_size=1 << 16):
+    """Stream the objects of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array")
+        buf, eof = buf[1:], False
+        while True:
+            buf = buf.lstrip(" \t\r\n,")
+            if buf.startswith("]"):
+                return
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except ValueError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)  # the object continues in the next chunk
+                eof = not more
+                buf += more
+                continue
+            yield obj
+            buf = buf[end:]
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _read_csv(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _read_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX input needs openpyxl (pip install openpyxl)")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        for values in rows:
+            if any(v is not None for v in values):
+                yield dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+READERS = {"json": _read_json, "jsonl": _read_jsonl, "csv": _read_csv, "xlsx": _read_xlsx}
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return {"ndjson": "jsonl", "xlsm": "xlsx"}.get(ext, ext)
+
+
+def normalize(raw):
+    """
+    Flat row from either the nested data.json shape
+    ({"question": {"text", "category"}, "metric": {"name", "unit"}, ...})
+    or flat CSV/XLSX columns (question, question_code, category, option, metric, unit, ...).
+    """
+    row = {k: (v.strip() if isinstance(v, str) else v) for k, v in raw.items() if k}
+    for key, fields in (
+        ("question", {"text": "question", "code": "question_code", "category": "category"}),
+        ("metric", {"name": "metric", "code": "metric_code", "unit": "unit"}),
+        ("option", {"label": "option", "code": "option_code"}),
+    ):
+        nested = row.get(key)
+        if isinstance(nested, dict):
+            row[key] = None
+            for src, dst in fields.items():
+                if nested.get(src) not in (None, ""):
+                    row[dst] = nested[src]
+    row.setdefault("question", row.pop("question_text", None))
+    row.setdefault("metric", row.pop("metric_name", None))
+    return row
+
+
+def read_rows(path, fmt=None):
+    fmt = fmt or detect_format(path)
+    if fmt not in READERS:
+        raise ValueError(f"Unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    for raw in READERS[fmt](path):
+        yield normalize(raw)
+
+
+def parse_value(value):
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value).replace(",", ".").replace("%", "").strip()).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+# --- dimensions --------------------------------------------------------------
+
+def _flag(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "да")
+
+
+class DimensionCache:
+    """
+    Resolves dimension rows to ids, creating missing ones. Each table is read
+    once up front, so a load costs one query per new entity, not per row.
+    """
+
+    def __init__(self):
+        regions = list(Region.objects.only("id", "name", "slug"))
+        self.regions = {r.name: r.id for r in regions}
+        self.region_slugs = {r.slug: r.id for r in regions}
+        self.cities = {}
+        self.city_slugs = {}
+        for c in City.objects.only("id", "region_id", "name", "slug"):
+            self.cities[(c.region_id, c.name)] = c.id
+            self.city_slugs[c.slug] = c.id
+        self.waves = dict(SurveyWave.objects.values_list("code", "id"))
+        self.surveys = {(s.wave_id, s.title): s.id for s in Survey.objects.all()}
+        self.questions = {}
+        for q in Question.objects.only("id", "survey_id", "code", "text"):
+            self.questions[(q.survey_id, "text", q.text)] = q.id
+            if q.code:
+                self.questions[(q.survey_id, "code", q.code)] = q.id
+        self.options = {(o.question_id, o.label): o.id for o in AnswerOption.objects.only("id", "question_id", "label")}
+        self.metrics = {}
+        for m in Metric.objects.all():
+            self.metrics[("name", m.name)] = m.id
+            if m.code:
+                self.metrics[("code", m.code)] = m.id
+        self.created = 0
+
+    def _create(self, model, **fields):
+        self.created += 1
+        return model.objects.create(**fields).id
+
+    def region(self, row):
+        name, slug = row.get("region"), row.get("region_slug")
+        if not name and not slug:
+            return None
+        if slug and slug in self.region_slugs:
+            return self.region_slugs[slug]
+        if name in self.regions:
+            return self.regions[name]
+        slug = slug or region_slug(name)
+        if slug in self.region_slugs:
+            return self.region_slugs[slug]
+        rid = self._create(Region, name=name or slug, slug=slug)
+        self.regions[name or slug] = self.region_slugs[slug] = rid
+        return rid
+
+    def city(self, row, region_id):
+        name, slug = row.get("city"), row.get("city_slug")
+        if not name and not slug:
+            return None
+        if slug and slug in self.city_slugs:
+            return self.city_slugs[slug]
+        if (region_id, name) in self.cities:
+            return self.cities[(region_id, name)]
+        if region_id is None:
+            raise ValueError(f"city {name or slug!r} needs a region")
+        # same slug rule t1.py used, so re-loads find the cities it created
+        slug = slug or name.lower().replace(" ", "-")
+        if slug in self.city_slugs:
+            return self.city_slugs[slug]
+        cid = self._create(City, region_id=region_id, name=name or slug, slug=slug)
+        self.cities[(region_id, name or slug)] = self.city_slugs[slug] = cid
+        return cid
+
+    def wave(self, code):
+        if code not in self.waves:
+            self.waves[code] = self._create(SurveyWave, code=code)
+        return self.waves[code]
+
+    def survey(self, row, wave_id):
+        key = (wave_id, row["survey"])
+        if key not in self.surveys:
+            self.surveys[key] = self._create(
+                Survey, wave_id=wave_id, title=row["survey"], is_frontier=_flag(row.get("is_frontier", "")),
+            )
+        return self.surveys[key]
+
+    def question(self, row, survey_id):
+        code, text = row.get("question_code"), row.get("question")
+        if code and (survey_id, "code", code) in self.questions:
+            return self.questions[(survey_id, "code", code)]
+        if (survey_id, "text", text) in self.questions:
+            return self.questions[(survey_id, "text", text)]
+        qid = self._create(
+            Question, survey_id=survey_id, code=code or None, text=text or code, category=row.get("category") or "",
+        )
+        self.questions[(survey_id, "text", text or code)] = qid
+        if code:
+            self.questions[(survey_id, "code", code)] = qid
+        return qid
+
+    def option(self, row, question_id):
+        label = row.get("option")
+        if not label or question_id is None:
+            return None
+        key = (question_id, str(label))
+        if key not in self.options:
+            self.options[key] = self._create(
+                AnswerOption, question_id=question_id, label=str(label), code=row.get("option_code") or "",
+            )
+        return self.options[key]
+
+    def metric(self, row):
+        code, name = row.get("metric_code"), row.get("metric")
+        if code and ("code", code) in self.metrics:
+            return self.metrics[("code", code)]
+        if name and ("name", name) in self.metrics:
+            return self.metrics[("name", name)]
+        if not code and not name:
+            raise ValueError("metric is required")
+        mid = self._create(Metric, code=code or None, name=name or code, unit=row.get("unit") or "percent")
+        self.metrics[("name", name or code)] = mid
+        if code:
+            self.metrics[("code", code)] = mid
+        return mid
+
+
+# --- loader ------------------------------------------------------------------
+
+class WaveLoader:
+    """
+    Writes rows as DataPoints in batches of `batch_size`.
+
+    Rows that already exist are updated with bulk_update and new ones go through
+    bulk_create(update_conflicts=True). Existing keys are looked up per wave because
+    region/option are usually NULL and NULLs never conflict in a unique index.
+    """
+
+    def __init__(self, batch_size=5000, wave=None, progress=None):
+        self.batch_size = batch_size
+        self.wave_override = wave
+        self.progress = progress
+        self.stats = {"rows": 0, "created": 0, "updated": 0, "skipped": 0, "dimensions": 0, "seconds": 0.0}
+        self._existing = {}  # wave_id -> {key: datapoint id}
+
+    def existing_keys(self, wave_id):
+        if wave_id not in self._existing:
+            self._existing[wave_id] = {
+                (wave_id, *key): pk
+                for pk, *key in DataPoint.objects.filter(wave_id=wave_id).values_list(
+                    "id", "region_id", "city_id", "question_id", "option_id", "metric_id",
+                ).iterator(chunk_size=self.batch_size)
+            }
+        return self._existing[wave_id]
+
+    def resolve(self, dims, row):
+        value = parse_value(row.get("value"))
+        wave_code = self.wave_override or row.get("wave")
+        if value is None or not wave_code or not row.get("survey"):
+            return None
+        wave_id = dims.wave(str(wave_code))
+        region_id = dims.region(row)
+        city_id = dims.city(row, region_id)
+        question_id = dims.question(row, dims.survey(row, wave_id)) if (row.get("question") or row.get("question_code")) else None
+        option_id = dims.option(row, question_id)
+        metric_id = dims.metric(row)
+        # like t1.py: a row with a city is stored against the city only
+        key = (wave_id, None if city_id else region_id, city_id, question_id, option_id, metric_id)
+        return key, value, row.get("extra")
+
+    def flush(self, pending):
+        creates, updates = [], []
+        for key, (value, extra) in pending.items():
+            wave_id, region_id, city_id, question_id, option_id, metric_id = key
+            dp = DataPoint(
+                wave_id=wave_id, region_id=region_id, city_id=city_id, question_id=question_id,
+                option_id=option_id, metric_id=metric_id, value=value, extra=extra,
+            )
+            existing = self.existing_keys(wave_id)
+            if key in existing:
+                dp.pk = existing[key]
+                updates.append(dp)
+            else:
+                creates.append(dp)
+        if updates:
+            DataPoint.objects.bulk_update(updates, ["value", "extra"], batch_size=self.batch_size)
+        if creates:
+            DataPoint.objects.bulk_create(
+                creates, batch_size=self.batch_size,
+                update_conflicts=True, unique_fields=UNIQUE_FIELDS, update_fields=["value", "extra"],
+            )
+            for dp in creates:
+                self.existing_keys(dp.wave_id)[(dp.wave_id, dp.region_id, dp.city_id, dp.question_id,
+                                                 dp.option_id, dp.metric_id)] = dp.pk
+        self.stats["created"] += len(creates)
+        self.stats["updated"] += len(updates)
+
+    def load(self, rows):
+        started = time.monotonic()
+        touched_waves = set()
+        with transaction.atomic():
+            dims = DimensionCache()
+            pending = {}
+            for row in rows:
+                self.stats["rows"] += 1
+                resolved = self.resolve(dims, row)
+                if resolved is None:
+                    self.stats["skipped"] += 1
+                    continue
+                key, value, extra = resolved
+                touched_waves.add(key[0])
+                pending[key] = (value, extra)  # later duplicates win
+                if len(pending) >= self.batch_size:
+                    self.flush(pending)
+                    pending = {}
+                    if self.progress:
+                        self.progress(self.stats, time.monotonic() - started)
+            if pending:
+                self.flush(pending)
+            codes = self.finish(dims, touched_waves)
+        for code in codes:
+            tiles.invalidate_values(code)
+        self.stats["seconds"] = time.monotonic() - started
+        return self.stats
+
+    def finish(self, dims, touched_waves):
+        """Refresh the cube and caches of the touched waves; returns their codes."""
+        self.stats["dimensions"] = dims.created
+        if not touched_waves:
+            return []
+        refresh_cube(touched_waves)
+        codes = list(SurveyWave.objects.filter(pk__in=touched_waves).values_list("code", flat=True))
+        bump_models(DataPoint, waves=codes)
+        return codes
+
+
+DIMENSION_FIELDS = (
+    "region", "region_slug", "city", "city_slug", "wave", "survey", "is_frontier", "question", "question_code",
+    "category", "option", "option_code", "metric", "metric_code", "unit",
+)
+KEY_COLUMNS = ("wave_id", "region_id", "city_id", "question_id", "option_id", "metric_id")
+NULLABLE_KEY_COLUMNS = ("region_id", "city_id", "question_id", "option_id")
+
+
+class CopyLoader(WaveLoader):
+    """
+    Set-based variant of WaveLoader for large waves.
+
+    Rows are staged into temp tables (COPY FROM STDIN on PostgreSQL, executemany
+    elsewhere) against a small integer key per distinct dimension tuple; only those
+    distinct tuples go through DimensionCache. The merge is then two statements:
+    an UPDATE for rows that already exist (NULL-safe key match on the
+    datapoint_merge_key expression index) and an
+    INSERT ... ON CONFLICT on the DataPoint unique_together for the rest.
+    """
+
+    def load(self, rows):
+        started = time.monotonic()
+        with transaction.atomic(), connection.cursor() as cursor:
+            stage = Staging(cursor)
+            stage.create()
+            keys, buffer = {}, []
+            for seq, row in enumerate(rows):
+                self.stats["rows"] += 1
+                value = parse_value(row.get("value"))
+                if self.wave_override:
+                    row["wave"] = self.wave_override
+                if value is None or not row.get("wave") or not row.get("survey"):
+                    self.stats["skipped"] += 1
+                    continue
+                dim = tuple(str(row[f]) if row.get(f) not in (None, "") else None for f in DIMENSION_FIELDS)
+                extra = row.get("extra")
+                buffer.append((seq, keys.setdefault(dim, len(keys)), value, json.dumps(extra) if extra else None))
+                if len(buffer) >= self.batch_size:
+                    stage.copy_rows(buffer)
+                    buffer = []
+                    if self.progress:
+                        self.progress(self.stats, time.monotonic() - started)
+            stage.copy_rows(buffer)
+
+            dims = DimensionCache()
+            resolved = []
+            for dim, dim_key in keys.items():
+                ids = self.resolve(dims, {**dict(zip(DIMENSION_FIELDS, dim)), "value": 0})
+                resolved.append((dim_key, *ids[0]))
+            stage.copy_dims(resolved)
+
+            self.stats["updated"], self.stats["created"] = stage.merge()
+            codes = self.finish(dims, {r[1] for r in resolved})
+            stage.drop()
+        for code in codes:
+            tiles.invalidate_values(code)
+        self.stats["seconds"] = time.monotonic() - started
+        return self.stats
+
+
+class Staging:
+    """Temp tables and merge SQL behind CopyLoader; PostgreSQL uses COPY, other backends executemany."""
+    rows_table = "load_rows"
+    dims_table = "load_dims"
+    merge_table = "load_merge"
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.postgres = connection.vendor == "postgresql"
+        self.target = connection.ops.quote_name(DataPoint._meta.db_table)
+
+    def create(self):
+        self.drop()
+        temp = "CREATE TEMPORARY TABLE {} ({})" + (" ON COMMIT DROP" if self.postgres else "")
+        extra_type = "jsonb" if self.postgres else "text"
+        self.cursor.execute(temp.format(
+            self.rows_table, f"seq bigint PRIMARY KEY, dim_key integer, value numeric(10, 2), extra {extra_type}",
+        ))
+        self.cursor.execute(temp.format(
+            self.dims_table, "dim_key integer PRIMARY KEY, " + ", ".join(f"{c} bigint" for c in KEY_COLUMNS),
+        ))
+
+    def drop(self):
+        for table in (self.rows_table, self.dims_table, self.merge_table):
+            self.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def _copy(self, table, columns, rows):
+        if not rows:
+            return
+        if not self.postgres:
+            placeholders = ", ".join(["%s"] * len(columns))
+            self.cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+            return
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)  # None -> empty unquoted field -> NULL in CSV COPY
+        buf.seek(0)
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        raw = self.cursor.cursor
+        if hasattr(raw, "copy_expert"):  # psycopg2
+            raw.copy_expert(sql, buf)
+        else:  # psycopg 3
+            with raw.copy(sql) as copy:
+                copy.write(buf.getvalue())
+
+    def copy_rows(self, rows):
+        self._copy(self.rows_table, ("seq", "dim_key", "value", "extra"), rows)
+
+    def copy_dims(self, rows):
+        self._copy(self.dims_table, ("dim_key",) + KEY_COLUMNS, rows)
+
+    def merge(self):
+        """Returns (updated, created)."""
+        keys = ", ".join(KEY_COLUMNS)
+        self.cursor.execute(f"""
+            CREATE TEMPORARY TABLE {self.merge_table} AS
+            SELECT {", ".join(f"d.{c}" for c in KEY_COLUMNS)}, r.value, r.extra
+            FROM {self.rows_table} r JOIN {self.dims_table} d ON d.dim_key = r.dim_key
+            WHERE r.seq IN (
+                SELECT MAX(r2.seq) FROM {self.rows_table} r2 JOIN {self.dims_table} d2 ON d2.dim_key = r2.dim_key
+                GROUP BY {", ".join(f"d2.{c}" for c in KEY_COLUMNS)}
+            )
+        """)
+        # plain equality (COALESCE for the nullable columns, as in the datapoint_merge_key
+        # index) so PostgreSQL can hash join; IS NOT DISTINCT FROM only nested-loops
+        match = " AND ".join(
+            f"COALESCE(t.{c}, 0) = COALESCE(m.{c}, 0)" if c in NULLABLE_KEY_COLUMNS else f"t.{c} = m.{c}"
+            for c in KEY_COLUMNS
+        )
+        self.cursor.execute(f"""
+            UPDATE {self.target} AS t SET value = m.value, extra = m.extra
+            FROM {self.merge_table} m WHERE {match}
+        """)
+        updated = self.cursor.rowcount
+        self.cursor.execute(f"""
+            INSERT INTO {self.target} ({keys}, value, extra)
+            SELECT {keys}, value, extra FROM {self.merge_table} m
+            WHERE NOT EXISTS (SELECT 1 FROM {self.target} t WHERE {match})
+            ON CONFLICT ({keys}) DO UPDATE SET value = EXCLUDED.value, extra = EXCLUDED.extra
+        """)
+        return updated, self.cursor.rowcount
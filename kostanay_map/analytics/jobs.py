@@ -0,0 +1,330 @@
+"""
+Background jobs without a broker: the Job table is the queue and the
+`run_workers` command runs it in a process pool.
+
+A job is claimed with a conditional UPDATE (status queued -> running), so any
+number of worker commands can share the table. Tasks are plain functions
+registered with @task(name) and called as fn(progress, **job.params);
+`progress(done, total, message)` records how far they got (throttled) and
+raises Cancelled once cancel() was asked for the job. A task's own transaction
+would hide those writes until it commits, so on PostgreSQL they go through a
+second connection (SQLite only has one writer at a time and writes inline).
+
+A failed attempt is queued again with a growing delay until max_attempts; a
+running job whose heartbeat stopped (its worker died) is requeued by the next
+worker that polls. Results are the task's return value, stored as JSON.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from multiprocessing import get_context
+
+import django
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.db.models.sql import UpdateQuery
+from django.db.models.sql.constants import CURSOR, SINGLE
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+HEARTBEAT_INTERVAL = 30.0
+STALE_AFTER = 600.0  # a running job without a heartbeat for this long is requeued
+RETRY_DELAY = 30.0  # seconds before the first retry, doubled per attempt
+
+
+class Cancelled(Exception):
+    pass
+
+
+def task(name):
+    """Register fn(progress, **params) as job kind `name`."""
+    def register(fn):
+        TASKS[name] = fn
+        return fn
+    return register
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# --- queue ----------------------------------------------------------------------
+
+def enqueue(kind, params=None, user=None, priority=0, max_attempts=3):
+    if kind not in TASKS:
+        raise ValueError(f"Unknown job kind {kind!r}; expected one of {', '.join(sorted(TASKS))}")
+    return Job.objects.create(kind=kind, params=params or {}, created_by=user, priority=priority, max_attempts=max_attempts)
+
+
+def cancel(job):
+    """Cancel a queued job now, or ask a running one to stop at its next progress call. False if already finished."""
+    now = timezone.now()
+    if Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.CANCELLED, finished_at=now):
+        return True
+    return bool(Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(cancel_requested=True))
+
+
+def retry(job):
+    """Queue a failed or cancelled job again with fresh attempts. False for other states."""
+    return bool(Job.objects.filter(pk=job.pk, status__in=(Job.FAILED, Job.CANCELLED)).update(
+        status=Job.QUEUED, attempts=0, cancel_requested=False, error="", result=None, done=0, total=None,
+        message="", worker="", run_after=timezone.now(), started_at=None, heartbeat_at=None, finished_at=None,
+    ))
+
+
+def claim(worker):
+    """The next due job, marked running for `worker`; None when the queue is empty."""
+    while True:
+        now = timezone.now()
+        candidate = (
+            Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by("-priority", "run_after", "id").values_list("pk", flat=True).first()
+        )
+        if candidate is None:
+            return None
+        claimed = Job.objects.filter(pk=candidate, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, attempts=F("attempts") + 1, started_at=now, heartbeat_at=now,
+            cancel_requested=False,
+        )
+        if claimed:
+            return Job.objects.get(pk=candidate)
+        # another worker took it first
+
+
+def requeue_stale(after=STALE_AFTER):
+    """Requeue running jobs whose heartbeat is older than `after` seconds. Returns how many."""
+    return Job.objects.filter(
+        status=Job.RUNNING, heartbeat_at__lt=timezone.now() - timedelta(seconds=after),
+    ).update(status=Job.QUEUED, worker="", message="requeued: worker stopped responding")
+
+
+# --- running ----------------------------------------------------------------------
+
+class Progress:
+    """The `progress` callable handed to tasks."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.written = 0.0
+        self.side = None
+
+    def __call__(self, done, total=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.written < PROGRESS_INTERVAL:
+            return
+        self.written = now
+        fields = {"done": done, "heartbeat_at": timezone.now()}
+        if total is not None:
+            fields["total"] = total
+        if message is not None:
+            fields["message"] = str(message)[:255]
+        if self.write(fields):
+            raise Cancelled
+
+    def write(self, fields):
+        """Update the job row; returns whether a cancel was requested."""
+        if not connection.in_atomic_block or connection.vendor != "postgresql":
+            Job.objects.filter(pk=self.job_id).update(**fields)
+            return Job.objects.filter(pk=self.job_id, cancel_requested=True).exists()
+        if self.side is None:
+            self.side = connections.create_connection(DEFAULT_DB_ALIAS)
+        query = Job.objects.filter(pk=self.job_id).query.chain(UpdateQuery)
+        query.add_update_values(fields)
+        query.get_compiler(connection=self.side).execute_sql(CURSOR)
+        check = Job.objects.filter(pk=self.job_id, cancel_requested=True).values("pk").query
+        return bool(check.get_compiler(connection=self.side).execute_sql(SINGLE))
+
+    def close(self):
+        if self.side is not None:
+            self.side.close()
+
+
+def _heartbeat(job_id, stop):
+    """Keeps heartbeat_at fresh while a task runs quietly (own thread, so its own connection)."""
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                Job.objects.filter(pk=job_id, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+            except OperationalError:
+                pass  # SQLite is locked by the task's transaction; try again next beat
+    finally:
+        connection.close()
+
+
+def _failed(job, error):
+    """Fields for a failed attempt: queued again after a growing delay, or failed for good."""
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+        return {"status": Job.QUEUED, "worker": "", "run_after": now + timedelta(seconds=delay), "error": error}
+    return {"status": Job.FAILED, "finished_at": now, "error": error}
+
+
+def run(job_id):
+    """Run a claimed job to the end and store its outcome. Returns the final status."""
+    job = Job.objects.get(pk=job_id)
+    progress = Progress(job_id)
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True).start()
+    try:
+        result = TASKS[job.kind](progress, **job.params)
+    except Cancelled:
+        fields = {"status": Job.CANCELLED, "finished_at": timezone.now()}
+    except Exception:
+        fields = _failed(job, traceback.format_exc())
+    else:
+        fields = {"status": Job.DONE, "finished_at": timezone.now(), "result": result, "error": "", "done": Coalesce("total", "done")}
+    finally:
+        stop.set()
+        progress.close()
+    Job.objects.filter(pk=job_id).update(heartbeat_at=timezone.now(), **fields)
+    return fields["status"]
+
+
+def _pool(workers):
+    # spawn, not fork: children must not share the parent's database connections;
+    # django.setup is the initializer so that nothing imports models before it
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=django.setup)
+
+
+def work(workers=1, once=False, poll=1.0, log=None, stop=None):
+    """
+    Claim and run jobs until `stop` (a threading.Event) is set, or until the queue
+    is empty with once=True. workers=1 runs jobs in this process, more use a pool.
+    """
+    name = worker_name()
+    log = log or (lambda message: None)
+    stop = stop or threading.Event()
+    pool = _pool(workers) if workers > 1 else None
+    running = {}
+    try:
+        while not stop.is_set():
+            stale = requeue_stale()
+            if stale:
+                log(f"requeued {stale} stale jobs")
+            while len(running) < workers and (job := claim(name)):
+                log(f"start {job}")
+                if pool is None:
+                    log(f"{job.kind}#{job.pk} {run(job.pk)}")
+                else:
+                    running[pool.submit(run, job.pk)] = job
+            if once and not running:
+                return
+            if not running:
+                stop.wait(poll)
+                continue
+            finished, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    log(f"{job.kind}#{job.pk} {future.result()}")
+                except Exception as e:  # the process running it died (killed, out of memory...)
+                    Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(**_failed(job, repr(e)))
+                    log(f"{job.kind}#{job.pk} crashed: {e!r}")
+            if any(isinstance(f.exception(), BrokenProcessPool) for f in finished):
+                # a broken pool fails every job it still holds; their rows are handled above as they finish
+                pool.shutdown(wait=False, cancel_futures=True)
+                for job in running.values():
+                    Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(**_failed(job, "worker pool restarted"))
+                running = {}
+                pool = _pool(workers)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+# --- tasks ------------------------------------------------------------------------
+
+def _count_lines(path):
+    count = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            count += block.count(b"\n")
+    return count
+
+
+@task("load_wave")
+def load_wave(progress, path, wave=None, format=None, mode="orm", batch_size=5000):
+    from .ingest import CopyLoader, WaveLoader, detect_format, read_rows
+
+    fmt = format or detect_format(path)
+    total = {"jsonl": _count_lines(path), "csv": max(_count_lines(path) - 1, 0)}.get(fmt)
+    loader_class = CopyLoader if mode == "copy" else WaveLoader
+    loader = loader_class(batch_size=batch_size, wave=wave, progress=lambda stats, elapsed: progress(stats["rows"], total))
+    stats = loader.load(read_rows(path, fmt))
+    progress(stats["rows"], stats["rows"], "loaded", force=True)
+    return stats
+
+
+@task("import_geojson")
+def import_geojson(progress, path, region, oblast_slug="kostanayskaya-oblast", workers=1, precision=None, strict=False):
+    from . import geoimport
+    from .models import Region
+
+    jobs = geoimport.read_folder(path) if os.path.isdir(path) else geoimport.read_collection(path)
+    prepared = []
+
+    def report(result):
+        prepared.append(result)
+        progress(len(prepared), len(jobs), result["slug"])
+
+    results = geoimport.prepare_all(jobs, workers=workers, ndigits=precision or geoimport.DEFAULT_NDIGITS, progress=report)
+    failed = [r["slug"] for r in results if r["errors"]]
+    if failed and strict:
+        raise ValueError(f"{len(failed)} sources with errors: {', '.join(failed)}")
+    owner, _ = Region.objects.get_or_create(slug=region, defaults={"name": region.replace("-", " ").title()})
+    progress(len(jobs), len(jobs), "saving", force=True)
+    return {**geoimport.save(owner, results, oblast_slug=oblast_slug), "failed": failed}
+
+
+def _waves(codes):
+    from .models import SurveyWave
+
+    waves = SurveyWave.objects.order_by("code")
+    return list(waves.filter(code__in=codes) if codes else waves)
+
+
+@task("rebuild_cube")
+def rebuild_cube(progress, waves=None):
+    from .cube import refresh_cube
+
+    selected = _waves(waves)
+    cells = 0
+    for n, wave in enumerate(selected):
+        progress(n, len(selected), wave.code)
+        cells += refresh_cube([wave])
+    return {"waves": len(selected), "cells": cells}
+
+
+@task("rebuild_timeseries")
+def rebuild_timeseries(progress, waves=None):
+    from .timeseries import refresh_waves
+
+    selected = _waves(waves)
+    progress(0, len(selected), force=True)
+    return {"waves": len(selected), "points": refresh_waves(selected)}
+
+
+@task("rebuild_search")
+def rebuild_search(progress):
+    from . import search
+
+    search.ensure_indexes()
+    return {"questions": search.reindex()}
+
+
+@task("build_snapshots")
+def build_snapshots(progress, waves=None, force=False, workers=None):
+    from . import snapshots
+
+    results = snapshots.build(waves, workers=workers, force=force, progress=progress)
+    return {"waves": len(results), "files": sum(r["files"] for r in results), "written": sum(r["written"] for r in results)}
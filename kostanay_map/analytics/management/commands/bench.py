@@ -0,0 +1,89 @@
+import json
+import logging
+import platform
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from analytics import benchmark
+from analytics.models import DataPoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every API endpoint (cold and warm cache) and the import commands on the current data: "
+        "p50/p95 ms, queries, bytes, peak memory; optionally save or compare with a baseline JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="Requests per endpoint and cache mode")
+        parser.add_argument("--cache", choices=("cold", "warm", "both"), default="both")
+        parser.add_argument("--only", help="Run only cases whose name contains this text")
+        parser.add_argument("--import-rows", type=int, default=20000, help="Rows for the load_wave cases (0 skips imports)")
+        parser.add_argument("--save", help="Write the results to this baseline file")
+        parser.add_argument("--baseline", help="Compare with this baseline file")
+        parser.add_argument("--tolerance", type=float, default=benchmark.REGRESSION_TOLERANCE, help="Allowed p95 slowdown (0.2 = 20%%)")
+        parser.add_argument("--fail", action="store_true", help="Exit with an error on regressions")
+
+    def handle(self, *args, **opts):
+        modes = ("cold", "warm") if opts["cache"] == "both" else (opts["cache"],)
+        self.stdout.write(f"{'case':58} {'p50 ms':>9} {'p95 ms':>9} {'queries':>7} {'bytes':>10} {'peak KB':>9}")
+
+        def report(name, result):
+            queries = "-" if result["queries"] is None else result["queries"]
+            status = "" if result.get("status", 200) < 400 else f"  HTTP {result['status']}"
+            self.stdout.write(
+                f"{name[:58]:58} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {queries:>7} "
+                f"{result.get('bytes', ''):>10} {result['peak_kb']:>9.0f}{status}"
+            )
+
+        slow_log = logging.getLogger("analytics.profiling")
+        level = slow_log.level
+        slow_log.setLevel(logging.ERROR)  # cold runs are slow by design
+        try:
+            with override_settings(ALLOWED_HOSTS=["testserver"], DEBUG=False):
+                results, skipped = benchmark.run_endpoints(opts["repeat"], modes, report, only=opts["only"])
+        finally:
+            slow_log.setLevel(level)
+        if skipped:
+            self.stdout.write(f"skipped (no sample data or staff only): {', '.join(skipped)}")
+        if opts["import_rows"] and (not opts["only"] or "import" in opts["only"] or "load_wave" in opts["only"]):
+            results.update(benchmark.run_imports(opts["import_rows"], report))
+
+        if opts["save"]:
+            with open(opts["save"], "w", encoding="utf-8") as f:
+                json.dump({"meta": self.meta(opts), "results": results}, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved {len(results)} results to {opts['save']}"))
+
+        if opts["baseline"]:
+            try:
+                with open(opts["baseline"], encoding="utf-8") as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+            self.compare(results, baseline, opts)
+
+    def meta(self, opts):
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "database": connection.vendor, "datapoints": DataPoint.objects.count(), "repeat": opts["repeat"],
+        }
+
+    def compare(self, results, baseline, opts):
+        meta = baseline.get("meta", {})
+        self.stdout.write(f"\nBaseline {meta.get('created', '?')} ({meta.get('database', '?')}, {meta.get('datapoints', '?')} datapoints)")
+        rows = benchmark.compare(results, baseline.get("results", {}))
+        for name, metric, old, new, change in rows:
+            if metric in ("p95_ms", "queries"):
+                ratio = "" if change is None else f"{change * 100:+.0f}%"
+                self.stdout.write(f"{name[:58]:58} {metric:8} {old:>9} -> {new:>9} {ratio:>6}")
+        slower = benchmark.regressions(rows, opts["tolerance"])
+        if not slower:
+            self.stdout.write(self.style.SUCCESS("No regressions"))
+            return
+        for name, metric, old, new, _ in slower:
+            self.stdout.write(self.style.ERROR(f"REGRESSION {name}: {metric} {old} -> {new}"))
+        if opts["fail"]:
+            raise CommandError(f"{len(slower)} regressions against {opts['baseline']}")
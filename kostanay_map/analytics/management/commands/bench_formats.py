@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from analytics.api.fast import FastList, dumps
+from analytics.api.renderers import COLUMNAR_RENDERERS
+from analytics.api.serializers import DataPointSerializer
+from analytics.columnar import choropleth_table, datapoint_table
+from analytics.cube import choropleth
+from analytics.ingest import WaveLoader
+from analytics.models import DataPoint
+
+
+class Command(BaseCommand):
+    help = "Compare payload size and serialize time of JSON, fast-path JSON and columnar formats on a synthetic wave (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--cities", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        with transaction.atomic():
+            WaveLoader(wave="BENCH").load(self.rows(opts))
+            qs = DataPoint.objects.select_related("city", "region", "metric", "wave").filter(wave__code="BENCH")
+            metrics = [f"bench_{m}" for m in range(5)]
+
+            cases = [
+                ("datapoints json", lambda: JSONRenderer().render(DataPointSerializer(qs, many=True).data)),
+                ("datapoints fast", lambda: dumps(FastList(DataPointSerializer).data(qs))),
+            ]
+            if cases[0][1]() != cases[1][1]():
+                self.stderr.write("fast path output differs from DataPointSerializer")
+            cases += [
+                (f"datapoints {r.format}", lambda r=r: r().render(datapoint_table(qs)))
+                for r in COLUMNAR_RENDERERS
+            ]
+            cases.append(("choropleth json", lambda: JSONRenderer().render({
+                m: [{"slug": s, "value": v} for s, v, *_ in cells] for m, cells in choropleth(metrics, "BENCH").items()
+            })))
+            cases += [
+                (f"choropleth {r.format}", lambda r=r: r().render(choropleth_table(choropleth(metrics, "BENCH"))))
+                for r in COLUMNAR_RENDERERS
+            ]
+            for name, render in cases:
+                best, size = None, 0
+                for _ in range(opts["repeat"]):
+                    started = time.perf_counter()
+                    size = len(render())
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                self.stdout.write(f"{name:20} {size:>10} bytes {best * 1000:9.1f} ms")
+            transaction.set_rollback(True)
+
+    def rows(self, opts):
+        options = ("Да", "Нет", "Затрудняюсь ответить")
+        for i in range(opts["rows"]):
+            q, rest = divmod(i, opts["cities"] * len(options))
+            c, o = divmod(rest, len(options))
+            yield {
+                "region": "Бенчмарк", "region_slug": "bench",
+                "city": f"Район {c}", "city_slug": f"bench-{c}",
+                "survey": "Бенчмарк", "question_code": f"Q{q}", "question": f"Вопрос {q}",
+                "option": options[o], "metric_code": f"bench_{q % 5}", "metric": "Доля",
+                "value": (i * 7919) % 10000 / 100,
+            }
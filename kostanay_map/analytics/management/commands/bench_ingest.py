@@ -0,0 +1,53 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analytics.ingest import CopyLoader, WaveLoader, read_rows
+
+
+class Command(BaseCommand):
+    help = "Compare the ORM and COPY load_wave paths on a synthetic wave (rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--cities", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        path = self.generate(opts)
+        try:
+            for name, loader_class in (("orm", WaveLoader), ("copy", CopyLoader)):
+                with transaction.atomic():
+                    # first run inserts, second updates the same keys
+                    for run in ("insert", "update"):
+                        stats = loader_class(batch_size=opts["batch_size"]).load(read_rows(path))
+                        self.stdout.write(
+                            f"{name:5} {run:7} rows={stats['rows']} created={stats['created']} "
+                            f"updated={stats['updated']} {stats['seconds']:.2f}s "
+                            f"({stats['rows'] / max(stats['seconds'], 1e-9):.0f} rows/s)"
+                        )
+                    transaction.set_rollback(True)
+        finally:
+            os.remove(path)
+
+    def generate(self, opts):
+        rnd = random.Random(42)
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        options = ("Да", "Нет", "Затрудняюсь ответить")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            keys = ((q, c, o) for q in itertools.count() for c in range(opts["cities"]) for o in options)
+            for q, c, option in itertools.islice(keys, opts["rows"]):
+                f.write(json.dumps({
+                    "region": "Бенчмарк", "region_slug": "bench",
+                    "city": f"Район {c}", "city_slug": f"bench-{c}",
+                    "wave": "BENCH", "survey": "Бенчмарк",
+                    "question_code": f"Q{q}", "question": f"Вопрос {q}",
+                    "option": option, "metric_code": "bench_share", "metric": "Доля",
+                    "value": round(rnd.uniform(0, 100), 2),
+                }, ensure_ascii=False) + "\n")
+        return path
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import snapshots
+from analytics.models import SurveyWave
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the API responses of locked waves into precompressed static snapshots "
+        "(all locked waves or --wave CODE); only changed files are written"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wave", type=str, action="append", help="Wave code; may be repeated")
+        parser.add_argument("--workers", type=int, default=None, help="Compression processes (default: one per CPU)")
+        parser.add_argument("--force", action="store_true", help="Rebuild even when the manifest is current")
+        parser.add_argument("--clear", action="store_true", help="Delete the snapshots instead of building them")
+
+    def handle(self, *args, **opts):
+        if opts["wave"]:
+            found = set(SurveyWave.objects.filter(code__in=opts["wave"]).values_list("code", flat=True))
+            missing = set(opts["wave"]) - found
+            if missing:
+                raise CommandError(f"Unknown wave(s): {', '.join(sorted(missing))}")
+
+        if opts["clear"]:
+            codes = opts["wave"] or SurveyWave.objects.values_list("code", flat=True)
+            snapshots.remove(codes)
+            self.stdout.write(self.style.SUCCESS(f"Snapshots removed: {', '.join(sorted(codes)) or 'none'}"))
+            return
+
+        started = time.monotonic()
+        results = snapshots.build(opts["wave"], workers=opts["workers"], force=opts["force"])
+        for r in results:
+            state = "current" if r["skipped"] else f"{r['written']} files written, {r['bytes'] / 1024:.0f} KiB"
+            self.stdout.write(f"{r['wave']}: {r['files']} responses, {state}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshots built: waves={len(results)} in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import synthetic
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset (cities from city.json, waves, surveys, questions, DataPoints) for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--regions", type=int, default=1)
+        parser.add_argument("--cities", type=int, default=20, help="District count; city.json is copied side by side past 19")
+        parser.add_argument("--waves", type=int, default=4)
+        parser.add_argument("--first-wave", default="2024Q1")
+        parser.add_argument("--surveys", type=int, default=3)
+        parser.add_argument("--questions", type=int, default=20, help="Questions per survey")
+        parser.add_argument("--options", type=int, default=4, help=f"Answer options per question (max {len(synthetic.OPTIONS)})")
+        parser.add_argument("--metrics", type=int, default=2)
+        parser.add_argument("--datapoints", type=int, help="Approximate DataPoint total; sets --questions")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--lock", action="store_true", help="Lock every wave but the last (builds the time series)")
+        parser.add_argument("--no-levels", action="store_true", help="Skip the pre-simplified feature levels")
+        parser.add_argument("--mode", choices=("auto", "orm", "copy"), default="auto")
+        parser.add_argument("--batch-size", type=int, default=20000)
+        parser.add_argument("--replace", action="store_true", help="Remove the previous synthetic data first")
+        parser.add_argument("--clear", action="store_true", help="Only remove the synthetic data")
+
+    def handle(self, *args, **opts):
+        if opts["clear"] or opts["replace"]:
+            removed = synthetic.clear()
+            self.stdout.write(f"Removed synthetic data ({removed} DataPoints)")
+            if opts["clear"]:
+                return
+
+        def progress(stats, elapsed):
+            self.stdout.write(f"  {stats['rows']} rows, {stats['rows'] / max(elapsed, 1e-9):.0f} rows/s")
+
+        try:
+            stats = synthetic.generate(
+                regions=opts["regions"], cities=opts["cities"], waves=opts["waves"], surveys=opts["surveys"],
+                questions=opts["questions"], options=opts["options"], metrics=opts["metrics"],
+                datapoints=opts["datapoints"], first_wave=opts["first_wave"], seed=opts["seed"], lock=opts["lock"],
+                levels=not opts["no_levels"], mode=opts["mode"], batch_size=opts["batch_size"], progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {stats['rows']} DataPoints in {stats['seconds']:.1f}s: waves={stats['waves']}, "
+            f"cities={stats['cities']}, questions={stats['questions']}, created={stats['created']}"
+        ))
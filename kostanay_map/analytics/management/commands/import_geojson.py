@@ -1,39 +1,71 @@
-import json
 import os
+import time
+
 from django.core.management.base import BaseCommand, CommandError
-from analytics.models import Region, City
+
+from analytics import geoimport
+from analytics.models import Region
 
 
 class Command(BaseCommand):
-    help = "Import GeoJSON files from a folder. File name should be <slug>.geojson"
+    help = (
+        "Import district outlines: a folder of <slug>.geojson files or one collection file "
+        "(city.json array or FeatureCollection with slug properties). Geometry is validated and repaired "
+        "in a process pool, then all cities are upserted in one transaction"
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument("folder", type=str, help="Path to folder with *.geojson")
+        parser.add_argument("folder", type=str, help="Folder with *.geojson, or a collection file such as city.json")
         parser.add_argument("--region", type=str, help="Region slug for all cities", required=True)
         parser.add_argument("--oblast-slug", type=str, help="Slug for oblast outline file (optional)", default="kostanayskaya-oblast")
+        parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU; 1 runs in this process)")
+        parser.add_argument("--precision", type=int, default=geoimport.DEFAULT_NDIGITS, help="Decimal places kept in coordinates")
+        parser.add_argument("--strict", action="store_true", help="Import nothing if any source has unrepaired errors")
+        parser.add_argument("--dry-run", action="store_true", help="Validate and report only")
 
     def handle(self, *args, **opts):
-        folder = opts["folder"]
-        region_slug = opts["region"]
-        oblast_slug = opts["oblast_slug"]
-
-        if not os.path.isdir(folder):
-            raise CommandError(f"Folder not found: {folder}")
-
-        region, _ = Region.objects.get_or_create(slug=region_slug, defaults={"name": region_slug.replace("-", " ").title()})
-
-        files = [f for f in os.listdir(folder) if f.endswith(".geojson")]
-        created, updated = 0, 0
+        path = opts["folder"]
+        started = time.perf_counter()
+        try:
+            if os.path.isdir(path):
+                jobs = geoimport.read_folder(path)
+            elif os.path.isfile(path):
+                jobs = geoimport.read_collection(path)
+            else:
+                raise CommandError(f"Folder not found: {path}")
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        if not jobs:
+            raise CommandError(f"No GeoJSON sources in {path}")
 
-        for fname in files:
-            slug = os.path.splitext(fname)[0]
-            path = os.path.join(folder, fname)
-            with open(path, "r", encoding="utf-8") as f:
-                feature = json.load(f)
+        results = geoimport.prepare_all(jobs, workers=opts["workers"], ndigits=opts["precision"], progress=self.report)
+        failed = [r for r in results if r["errors"]]
+        if failed and opts["strict"]:
+            raise CommandError(f"{len(failed)} sources with errors: {', '.join(r['slug'] for r in failed)}")
+        if opts["dry_run"]:
+            self.stdout.write(f"Dry run: {len(results) - len(failed)} valid, {len(failed)} with errors")
+            return
 
-            defaults = {"name": slug.replace("-", " ").title(), "feature": feature, "is_oblast": (slug == oblast_slug)}
-            obj, was_created = City.objects.update_or_create(slug=slug, defaults={**defaults, "region": region})
-            if was_created: created += 1
-            else: updated += 1
+        region, _ = Region.objects.get_or_create(slug=opts["region"], defaults={"name": opts["region"].replace("-", " ").title()})
+        stats = geoimport.save(region, results, oblast_slug=opts["oblast_slug"])
+        skipped = sum(1 for r in results if r["feature"] is None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Cities imported: created={stats['created']}, updated={stats['updated']}, "
+            f"outlines changed={stats['levels']}, skipped={skipped} in {time.perf_counter() - started:.2f}s"
+        ))
 
-        self.stdout.write(self.style.SUCCESS(f"Cities imported: created={created}, updated={updated}"))
+    def report(self, result):
+        timings = " ".join(f"{part} {seconds * 1000:.0f}ms" for part, seconds in result["timings"].items())
+        line = f"  {result['slug']:28} {timings}"
+        if result["feature"] is not None:
+            line += (
+                f"  {result['points_in']} -> {result['points_out']} points,"
+                f" {result['bytes_in'] / 1024:.0f} -> {result['bytes_out'] / 1024:.0f} KB"
+            )
+        if result["fixes"]:
+            line += "  fixed: " + ", ".join(f"{count} {fix}" for fix, count in sorted(result["fixes"].items()))
+        if result["feature"] is not None and result["levels"] is None:
+            line += "  (unchanged)"
+        self.stdout.write(line)
+        for error in result["errors"]:
+            self.stdout.write(self.style.ERROR(f"    {error}" if result["feature"] is not None else f"    {error} (skipped)"))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.ingest import FORMATS, READERS, detect_format
+from analytics.microdata import publish, write_wave
+
+
+class Command(BaseCommand):
+    help = "Store respondent-level answers of one wave as memory-mapped columns (optionally publish DataPoints)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="One row per respondent: city, weight, attributes, question columns")
+        parser.add_argument("--wave", type=str, required=True)
+        parser.add_argument("--format", choices=FORMATS, help="Input format (default: from the file extension)")
+        parser.add_argument("--question", action="append", help="Column to treat as a question; may be repeated")
+        parser.add_argument("--publish", action="store_true", help="Write weighted city percentages as DataPoints")
+        parser.add_argument("--survey", type=str, help="Survey title for published questions that do not exist yet")
+
+    def handle(self, *args, **opts):
+        fmt = opts["format"] or detect_format(opts["path"])
+        if fmt not in READERS:
+            raise CommandError(f"Unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+        started = time.monotonic()
+        try:
+            rows = write_wave(opts["wave"], READERS[fmt](opts["path"]), questions=opts["question"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {rows} respondents for {opts['wave']} in {time.monotonic() - started:.2f}s"
+        ))
+
+        if opts["publish"]:
+            stats = publish(opts["wave"], survey=opts["survey"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Published: created={stats['created']}, updated={stats['updated']} in {stats['seconds']:.2f}s"
+            ))
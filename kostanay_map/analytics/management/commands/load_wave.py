@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.ingest import FORMATS, CopyLoader, WaveLoader, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk-load survey rows (JSON array, JSONL, CSV or XLSX) into DataPoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="Input file, e.g. data.json")
+        parser.add_argument("--format", choices=FORMATS, help="Input format (default: from the file extension)")
+        parser.add_argument("--wave", type=str, help="Wave code for every row (overrides the 'wave' column)")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--mode", choices=("orm", "copy"), default="orm",
+            help="orm: batched bulk_create; copy: staged COPY + set-based merge (fastest on PostgreSQL)",
+        )
+
+    def handle(self, *args, **opts):
+        def progress(stats, elapsed):
+            self.stdout.write(f"  {stats['rows']} rows, {stats['rows'] / max(elapsed, 1e-9):.0f} rows/s")
+
+        loader_class = CopyLoader if opts["mode"] == "copy" else WaveLoader
+        loader = loader_class(batch_size=opts["batch_size"], wave=opts["wave"], progress=progress)
+        try:
+            stats = loader.load(read_rows(opts["path"], opts["format"]))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        rate = stats["rows"] / max(stats["seconds"], 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {stats['rows']} rows in {stats['seconds']:.2f}s ({rate:.0f} rows/s): "
+            f"created={stats['created']}, updated={stats['updated']}, skipped={stats['skipped']}, "
+            f"new dimensions={stats['dimensions']}"
+        ))
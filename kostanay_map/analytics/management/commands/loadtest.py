@@ -0,0 +1,91 @@
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+# sync endpoint -> its async twin
+PAIRS = (
+    ("choropleth?metric={metric}&wave={wave}", "async/choropleth?metric={metric}&wave={wave}"),
+    ("questions/grouped/?wave={wave}", "async/questions/grouped/?wave={wave}"),
+    ("cities/", "async/cities/"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the sync (WSGI) and async (ASGI) read endpoints at rising concurrency. "
+        "Run against two servers, e.g. gunicorn core.wsgi --threads 8 and uvicorn core.asgi --workers 1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wsgi", help="Base URL of the WSGI server, e.g. http://127.0.0.1:8000/api/")
+        parser.add_argument("--asgi", help="Base URL of the ASGI server, e.g. http://127.0.0.1:8001/api/")
+        parser.add_argument("--wave", default="2025Q3")
+        parser.add_argument("--metric", default="share")
+        parser.add_argument("--concurrency", default="1,8,32,64", help="Comma-separated client counts")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and level")
+        parser.add_argument("--no-cache", action="store_true", help="Add a unique query param so every request misses the body cache")
+        parser.add_argument("--dashboard", action="store_true", help="Also compare /api/dashboard with the three sync calls it replaces")
+
+    def handle(self, *args, **opts):
+        if not opts["wsgi"] and not opts["asgi"]:
+            raise CommandError("Give --wsgi and/or --asgi base URLs")
+        levels = [int(c) for c in opts["concurrency"].split(",") if c]
+        self.counter = iter(range(10 ** 9))
+        self.lock = threading.Lock()
+
+        cases = []
+        for sync_path, async_path in PAIRS:
+            if opts["wsgi"]:
+                cases.append(("wsgi", opts["wsgi"], [sync_path]))
+            if opts["asgi"]:
+                cases.append(("asgi", opts["asgi"], [async_path]))
+        if opts["dashboard"]:
+            if opts["wsgi"]:
+                cases.append(("wsgi", opts["wsgi"], ["cities/", "surveys/?wave_code={wave}", "questions/grouped/?wave={wave}"]))
+            if opts["asgi"]:
+                cases.append(("asgi", opts["asgi"], ["dashboard?wave={wave}"]))
+
+        self.stdout.write(f"{'server':6} {'endpoint':40} {'clients':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}")
+        for server, base, paths in cases:
+            paths = [p.format(**opts) for p in paths]
+            urls = [base.rstrip("/") + "/" + p for p in paths]
+            for clients in levels:
+                rps, p50, p95, errors = self.run(urls, clients, opts["requests"], opts["no_cache"])
+                name = " + ".join(paths)[:40]
+                self.stdout.write(f"{server:6} {name:40} {clients:>7} {rps:>8.1f} {p50:>8.1f} {p95:>8.1f} {errors:>6}")
+
+    def run(self, urls, clients, total, no_cache):
+        """One "request" fetches every url in order; returns (rps, p50 ms, p95 ms, errors)."""
+        latencies, errors = [], 0
+
+        def one(_):
+            started = time.perf_counter()
+            for url in urls:
+                if no_cache:
+                    with self.lock:
+                        n = next(self.counter)
+                    url = f"{url}{'&' if '?' in url else '?'}_lt={n}"
+                try:
+                    with urllib.request.urlopen(url, timeout=60) as response:
+                        response.read()
+                except (urllib.error.URLError, OSError):
+                    return None
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            for elapsed in pool.map(one, range(total)):
+                if elapsed is None:
+                    errors += 1
+                else:
+                    latencies.append(elapsed * 1000)
+        wall = time.perf_counter() - started
+        if len(latencies) < 2:
+            return 0.0, 0.0, 0.0, errors
+        cuts = statistics.quantiles(latencies, n=20)
+        return len(latencies) / wall, statistics.median(latencies), cuts[18], errors
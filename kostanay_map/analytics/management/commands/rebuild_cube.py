@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.cube import refresh_cube
+from analytics.models import SurveyWave
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized choropleth cube from DataPoint (all waves or --wave CODE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wave", type=str, action="append", help="Wave code; may be repeated")
+
+    def handle(self, *args, **opts):
+        waves = None
+        if opts["wave"]:
+            waves = list(SurveyWave.objects.filter(code__in=opts["wave"]))
+            missing = set(opts["wave"]) - {w.code for w in waves}
+            if missing:
+                raise CommandError(f"Unknown wave(s): {', '.join(sorted(missing))}")
+
+        started = time.monotonic()
+        cells = refresh_cube(waves)
+        self.stdout.write(self.style.SUCCESS(f"Cube rebuilt: cells={cells} in {time.monotonic() - started:.2f}s"))
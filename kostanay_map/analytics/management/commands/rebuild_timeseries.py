@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.models import SurveyWave
+from analytics.timeseries import refresh_waves
+
+
+class Command(BaseCommand):
+    help = "Recompute stored series points (deltas, rolling averages) for locked waves (all or --wave CODE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wave", type=str, action="append", help="Wave code; may be repeated")
+
+    def handle(self, *args, **opts):
+        waves = SurveyWave.objects.all()
+        if opts["wave"]:
+            waves = list(waves.filter(code__in=opts["wave"]))
+            missing = set(opts["wave"]) - {w.code for w in waves}
+            if missing:
+                raise CommandError(f"Unknown wave(s): {', '.join(sorted(missing))}")
+
+        started = time.monotonic()
+        points = refresh_waves(waves)
+        self.stdout.write(self.style.SUCCESS(f"Series rebuilt: points={points} in {time.monotonic() - started:.2f}s"))
@@ -0,0 +1,27 @@
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from analytics import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs from the Job table (imports, cube/series/search rebuilds) in a process pool "
+        "until stopped; several commands may run side by side"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Jobs run in parallel (1 runs them in this process)")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds between queue checks")
+
+    def handle(self, *args, **opts):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        self.stdout.write(f"{jobs.worker_name()}: {opts['workers']} workers, tasks: {', '.join(sorted(jobs.TASKS))}")
+        jobs.work(workers=max(opts["workers"], 1), once=opts["once"], poll=opts["poll"], log=self.stdout.write, stop=stop)
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from analytics.geometry import rebuild_feature_levels
+from analytics.models import Region, City
+
+
+class Command(BaseCommand):
+    help = "Rebuild pre-simplified feature levels for every Region and City"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild even if the feature did not change")
+
+    def handle(self, *args, **opts):
+        rebuilt, skipped = 0, 0
+        for owner in [*Region.objects.exclude(geometry=None), *City.objects.all()]:
+            if rebuild_feature_levels(owner, force=opts["force"]):
+                rebuilt += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(f"Feature levels: rebuilt={rebuilt}, skipped={skipped}"))
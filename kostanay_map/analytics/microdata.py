@@ -0,0 +1,234 @@
+"""
+Respondent-level microdata and weighted crosstabs.
+
+One directory per wave under settings.MICRODATA_DIR:
+
+    <wave>/meta.json        row count, column kinds and code -> label tables
+    <wave>/<column>.npy     int16/int32 codes per respondent (-1 = no answer)
+    <wave>/weight.npy       float32 design weight per respondent
+
+Every answer and attribute is dictionary-encoded, so a wave is a handful of
+small integer arrays that are memory-mapped on open. A crosstab is a mask from
+the filters plus one np.bincount over `row code * options + answer code`,
+which stays in the milliseconds for hundreds of thousands of respondents.
+`publish` writes city-level weighted percentages back as DataPoints through
+WaveLoader, so the cube and caches follow as for any other load.
+"""
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+
+from .cache import bump, wave_scope
+from .ingest import WaveLoader
+from .models import City, Question, Survey
+
+QUESTION_NAME = re.compile(r"^[QqВв]\d")
+WAVE_CODE = re.compile(r"[\w-]+")  # wave codes double as directory names
+
+
+def microdata_root():
+    return getattr(settings, "MICRODATA_DIR", os.path.join(settings.MEDIA_ROOT, "microdata"))
+
+
+def wave_dir(wave_code):
+    if not WAVE_CODE.fullmatch(wave_code or ""):
+        raise LookupError(f"No microdata for wave {wave_code!r}")
+    return os.path.join(microdata_root(), wave_code)
+
+
+def has_wave(wave_code):
+    try:
+        return os.path.exists(os.path.join(wave_dir(wave_code), "meta.json"))
+    except LookupError:
+        return False
+
+
+def _city_slugs():
+    slugs = {}
+    for slug, name in City.objects.values_list("slug", "name"):
+        slugs[slug] = slugs[name] = slugs[name.lower()] = slug
+    return slugs
+
+
+def write_wave(wave_code, rows, questions=None):
+    """
+    Encode respondent rows (dicts: city, weight, attributes, answers by question code)
+    into the wave's column store, replacing the previous one. A column is a question
+    when it is listed in `questions`, is a Question.code in the wave or looks like Q12;
+    everything else is an attribute. City names are stored as slugs. Returns the row count.
+    """
+    known = set(Question.objects.filter(survey__wave__code=wave_code).exclude(code=None).values_list("code", flat=True))
+    questions = set(questions or ()) | known
+    city_slugs = _city_slugs()
+
+    codes, labels, weights = {}, {}, []
+    for n, row in enumerate(rows):
+        row = {str(k).strip(): v for k, v in row.items() if k}
+        answers = row.pop("answers", None) or {}
+        row.update(answers)
+        if "city_slug" in row:
+            row["city"] = row.pop("city_slug")
+        weight = row.pop("weight", None)
+        weights.append(float(weight) if weight not in (None, "") else 1.0)
+        row.pop("respondent_id", None)
+        for column, value in row.items():
+            if column not in codes:
+                codes[column], labels[column] = [-1] * n, {}
+            if value is None or str(value).strip() == "":
+                codes[column].append(-1)
+                continue
+            value = str(value).strip()
+            if column == "city":
+                value = city_slugs.get(value) or city_slugs.get(value.lower()) or value
+            lookup = labels[column]
+            codes[column].append(lookup.setdefault(value, len(lookup)))
+        for column in codes.keys() - row.keys():
+            codes[column].append(-1)
+
+    target = wave_dir(wave_code)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {"wave": wave_code, "rows": len(weights), "columns": {}}
+    np.save(os.path.join(tmp, "weight.npy"), np.asarray(weights, dtype=np.float32))
+    for column, values in codes.items():
+        dtype = np.int16 if len(labels[column]) < np.iinfo(np.int16).max else np.int32
+        np.save(os.path.join(tmp, f"{_file_name(column)}.npy"), np.asarray(values, dtype=dtype))
+        meta["columns"][column] = {
+            "kind": "question" if column in questions or QUESTION_NAME.match(column) else "attribute",
+            "file": _file_name(column),
+            "labels": list(labels[column]),
+        }
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    old = f"{target}.old-{os.getpid()}"
+    if os.path.isdir(target):
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    bump(wave_scope(wave_code))
+    return meta["rows"]
+
+
+def _file_name(column):
+    return "col_" + re.sub(r"[^\w-]", "_", column)
+
+
+class MicrodataStore:
+    """Memory-mapped columns of one wave."""
+
+    def __init__(self, wave_code):
+        path = wave_dir(wave_code)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise LookupError(f"No microdata for wave {wave_code!r}")
+        with open(meta_path, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.wave_code = wave_code
+        self.path = path
+        self.rows = self.meta["rows"]
+        self.weight = np.load(os.path.join(path, "weight.npy"), mmap_mode="r")
+        self._columns = {}
+
+    @property
+    def columns(self):
+        return self.meta["columns"]
+
+    def questions(self):
+        return [name for name, column in self.columns.items() if column["kind"] == "question"]
+
+    def labels(self, column):
+        return self._info(column)["labels"]
+
+    def codes(self, column):
+        if column not in self._columns:
+            info = self._info(column)
+            self._columns[column] = np.load(os.path.join(self.path, f"{info['file']}.npy"), mmap_mode="r")
+        return self._columns[column]
+
+    def _info(self, column):
+        try:
+            return self.columns[column]
+        except KeyError:
+            raise LookupError(f"Unknown microdata column {column!r}")
+
+    def mask(self, filters):
+        """filters: {column: [label, ...]}; "is_frontier" selects respondents by Survey.is_frontier."""
+        mask = np.ones(self.rows, dtype=bool)
+        for column, values in (filters or {}).items():
+            values = [values] if isinstance(values, str) else list(values)
+            if column == "is_frontier":
+                frontier = any(str(v).lower() in ("1", "true", "yes", "да") for v in values)
+                titles = Survey.objects.filter(wave__code=self.wave_code, is_frontier=frontier).values_list("title", flat=True)
+                column, values = "survey", list(titles)
+            lookup = {label: code for code, label in enumerate(self.labels(column))}
+            wanted = [lookup[v] for v in map(str, values) if v in lookup]
+            mask &= np.isin(self.codes(column), wanted)
+        return mask
+
+    def crosstab(self, column, by="city", filters=None, weighted=True):
+        """
+        Percent of `column` answers within each `by` group (weighted by default).
+        {"options": [...], "rows": [{"key", "base", "weighted_base", "values": {option: percent}}], "total": {...}}
+        """
+        answers = self.codes(column)
+        groups = self.codes(by) if by else np.zeros(self.rows, dtype=np.int16)
+        options, keys = self.labels(column), (self.labels(by) if by else ["total"])
+        valid = self.mask(filters) & (answers >= 0) & (groups >= 0)
+
+        index = groups[valid].astype(np.int64) * len(options) + answers[valid]
+        size = len(keys) * len(options)
+        weights = np.asarray(self.weight[valid], dtype=np.float64) if weighted else None
+        table = np.bincount(index, weights=weights, minlength=size).reshape(len(keys), len(options))
+        counts = np.bincount(groups[valid], minlength=len(keys))
+
+        def row(key, cells, base):
+            total = cells.sum()
+            return {
+                "key": key, "base": int(base), "weighted_base": round(float(total), 4),
+                "values": {o: round(float(c) * 100 / total, 4) if total else 0.0 for o, c in zip(options, cells)},
+            }
+
+        return {
+            "wave": self.wave_code, "column": column, "by": by, "weighted": weighted, "options": options,
+            "rows": [row(key, table[i], counts[i]) for i, key in enumerate(keys) if counts[i]],
+            "total": row("total", table.sum(axis=0), counts.sum()),
+        }
+
+
+def publish(wave_code, columns=None, filters=None, survey=None, metric_code="share", metric="Доля", loader=None):
+    """
+    Write weighted city percentages of the given question columns (all by default)
+    as DataPoints. The survey title defaults to the question's existing survey.
+    Returns the WaveLoader stats.
+    """
+    store = MicrodataStore(wave_code)
+    existing = {
+        q["code"]: q for q in Question.objects.filter(survey__wave__code=wave_code)
+        .values("code", "text", "category", survey_title=F("survey__title"))
+    }
+    regions = dict(City.objects.values_list("slug", "region__slug"))
+
+    def rows():
+        for column in columns or store.questions():
+            question = existing.get(column, {})
+            table = store.crosstab(column, by="city", filters=filters)
+            for row in table["rows"]:
+                for option, percent in row["values"].items():
+                    yield {
+                        "survey": survey or question.get("survey_title") or "Микроданные",
+                        "region_slug": regions.get(row["key"]), "city_slug": row["key"],
+                        "question_code": column, "question": question.get("text") or column,
+                        "category": question.get("category") or "", "option": option,
+                        "metric_code": metric_code, "metric": metric, "value": percent,
+                        "extra": {"source": "microdata", "base": row["base"], "weighted_base": row["weighted_base"]},
+                    }
+
+    return (loader or WaveLoader(wave=wave_code)).load(rows())
+
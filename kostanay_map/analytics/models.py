@@ -1,14 +1,70 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Coalesce
+
+from .geometry import feature_hash, prune_geometries, store_geometries
 
 User = get_user_model()
 
 
-class Region(models.Model):
+class Geometry(models.Model):
+    """
+    A Region/City outline, stored once per content hash and kept out of the
+    owner rows, so queries that join Region/City never read polygons. Rows are
+    immutable: editing an outline stores a new row (see GeometryOwner).
+    """
+    hash = models.CharField(max_length=32, unique=True)  # geometry.feature_hash of `feature`
+    feature = models.JSONField()  # parsed GeoJSON
+    points = models.IntegerField(default=0)
+    bbox = models.JSONField(blank=True, null=True)  # [min_lon, min_lat, max_lon, max_lat]
+
+    def __str__(self):
+        return self.hash
+
+
+class GeometryOwner(models.Model):
+    """
+    `feature` reads the outline through the `geometry` row, loaded on first use,
+    and assigning it (or editing it in place) stores a new Geometry on save().
+    Bulk writes must set `geometry` themselves (geometry.store_geometries).
+    """
+    geometry = models.ForeignKey(Geometry, on_delete=models.PROTECT, null=True, blank=True, related_name="+")
+
+    class Meta:
+        abstract = True
+
+    @property
+    def feature(self):
+        if hasattr(self, "_feature"):
+            return self._feature
+        return self.geometry.feature if self.geometry_id else None
+
+    @feature.setter
+    def feature(self, value):
+        self._feature = value
+
+    def save(self, *args, **kwargs):
+        previous = self.geometry_id
+        if hasattr(self, "_feature"):
+            self.geometry = store_geometries([self._feature])[0]
+            del self._feature
+        elif previous and self._meta.get_field("geometry").is_cached(self) \
+                and feature_hash(self.geometry.feature) != self.geometry.hash:
+            self.geometry = store_geometries([self.geometry.feature])[0]
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "feature" in update_fields:
+            kwargs["update_fields"] = {*update_fields} - {"feature"} | {"geometry"}
+        super().save(*args, **kwargs)
+        if previous and previous != self.geometry_id:
+            prune_geometries([previous])
+
+
+class Region(GeometryOwner):
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(unique=True)
-    feature = models.JSONField(blank=True, null=True)   # Region GeoJSON (optional; usually only City has it)
     sort_order = models.IntegerField(default=0)
+    # `feature`: Region GeoJSON (optional; usually only City has it)
 
     class Meta:
         ordering = ["sort_order", "name"]
@@ -17,13 +73,13 @@ class Region(models.Model):
         return self.name
 
 
-class City(models.Model):
+class City(GeometryOwner):
     region = models.ForeignKey(Region, on_delete=models.CASCADE, related_name="cities")
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True)
-    feature = models.JSONField()  # GeoJSON string/dict expected by your Vue/Leaflet
     sort_order = models.IntegerField(default=0)
     is_oblast = models.BooleanField(default=False)  # e.g., "Костанайская область" outline
+    # `feature`: the GeoJSON expected by the Vue/Leaflet map
 
     class Meta:
         ordering = ["region__sort_order", "sort_order", "name"]
@@ -33,6 +89,28 @@ class City(models.Model):
         return f"{self.name}"
 
 
+class FeatureLevel(models.Model):
+    """
+    Pre-simplified copy of a Region/City feature at one tolerance (degrees).
+    Rebuilt whenever the owner is saved; `feature` is always a parsed GeoJSON object.
+    """
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True, related_name="feature_levels")
+    city = models.ForeignKey(City, on_delete=models.CASCADE, null=True, blank=True, related_name="feature_levels")
+    tolerance = models.FloatField()
+    feature = models.JSONField()
+    points = models.IntegerField(default=0)
+    bbox = models.JSONField(blank=True, null=True)  # [min_lon, min_lat, max_lon, max_lat]
+    source_hash = models.CharField(max_length=32, blank=True, default="")  # md5 of the owner's feature
+
+    class Meta:
+        ordering = ["tolerance"]
+        unique_together = (("region", "city", "tolerance"),)
+
+    def __str__(self):
+        owner = self.city or self.region
+        return f"{owner}@{self.tolerance}"
+
+
 class SurveyWave(models.Model):
     """
     '2025Q3', '2025Q4', or month codes (e.g., '2025M07').
@@ -71,6 +149,7 @@ class Question(models.Model):
     text = models.TextField()
     category = models.CharField(max_length=50, blank=True, default="")  # 'media', 'wellbeing', ...
     sort_order = models.IntegerField(default=0)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)  # PostgreSQL only, see search.py
 
     class Meta:
         unique_together = (("survey", "code"),)
@@ -125,6 +204,12 @@ class DataPoint(models.Model):
             models.Index(fields=["wave", "city", "region"]),
             models.Index(fields=["metric", "wave"]),
             models.Index(fields=["question", "option"]),
+            # the NULL-safe key CopyLoader merges on (see ingest.Staging.merge)
+            models.Index(
+                "wave", "metric",
+                *[Coalesce(f, 0, output_field=models.BigIntegerField()) for f in ("region", "city", "question", "option")],
+                name="datapoint_merge_key",
+            ),
         ]
         unique_together = (
             ("wave", "region", "city", "question", "option", "metric"),
@@ -135,6 +220,86 @@ class DataPoint(models.Model):
         return f"{self.wave.code}:{who}:{self.metric.code}={self.value}"
 
 
+class ChoroplethCell(models.Model):
+    """
+    Materialized DataPoint aggregate per (wave, metric, level, city/region).
+    Codes and slug are denormalized so choropleth reads touch only this table;
+    kept current by analytics.cube (signals, bulk loads, `rebuild_cube`).
+    """
+    LEVEL_CHOICES = (("city", "City"), ("region", "Region"))
+
+    wave = models.ForeignKey(SurveyWave, on_delete=models.CASCADE, related_name="choropleth_cells")
+    metric = models.ForeignKey(Metric, on_delete=models.CASCADE, related_name="choropleth_cells")
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    owner_id = models.BigIntegerField()  # City.id or Region.id, depending on level
+    wave_code = models.CharField(max_length=20)
+    metric_code = models.CharField(max_length=80, null=True, blank=True)
+    slug = models.SlugField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    minimum = models.FloatField(default=0)
+    maximum = models.FloatField(default=0)
+    average = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["wave_code", "level", "metric_code"]),
+        ]
+        unique_together = (("wave", "metric", "level", "owner_id"),)
+
+    def __str__(self):
+        return f"{self.wave_code}:{self.level}:{self.slug}:{self.metric_code}={self.average}"
+
+
+class SeriesPoint(models.Model):
+    """
+    One value of a cross-wave series, stored when its wave is locked (see analytics.timeseries).
+    A series is (metric, question_code, option_label, level, slug) within one cadence;
+    metric_code is only its display copy (codes are optional and not unique), and
+    question_code/option_label are blank for whole-metric series (the choropleth average).
+    delta is against the previous locked wave of the same cadence, rolling averages the
+    last ROLLING_WINDOW waves.
+    """
+    wave = models.ForeignKey(SurveyWave, on_delete=models.CASCADE, related_name="series_points")
+    wave_code = models.CharField(max_length=20)
+    cadence = models.CharField(max_length=10)  # quarter|month|other
+    position = models.IntegerField(default=0)  # wave order within the cadence
+    metric = models.ForeignKey(Metric, on_delete=models.CASCADE, related_name="series_points")
+    metric_code = models.CharField(max_length=80, blank=True, default="")
+    question_code = models.CharField(max_length=50, blank=True, default="")
+    option_label = models.CharField(max_length=255, blank=True, default="")
+    level = models.CharField(max_length=10)  # city|region
+    slug = models.SlugField()
+    value = models.FloatField()
+    count = models.IntegerField(default=0)
+    delta = models.FloatField(null=True, blank=True)
+    rolling = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["metric_code", "level", "question_code", "option_label"]),
+        ]
+        unique_together = (("wave", "metric", "question_code", "option_label", "level", "slug"),)
+
+    def __str__(self):
+        return f"{self.wave_code}:{self.level}:{self.slug}:{self.metric_code}/{self.question_code}/{self.option_label}={self.value}"
+
+
+class DataVersion(models.Model):
+    """
+    Monotonic version counters behind the API response cache.
+    Scopes: "table:<model_name>" for every analytics table and "wave:<code>" for
+    wave-partitioned data (DataPoint, ChoroplethCell). See analytics.cache.
+    """
+    scope = models.CharField(max_length=120, unique=True)
+    version = models.BigIntegerField(default=0)
+    is_locked = models.BooleanField(default=False)  # wave scopes: mirrors SurveyWave.is_locked
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.scope}@{self.version}"
+
+
 class SavedView(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="saved_views")
     name = models.CharField(max_length=255)
@@ -146,3 +311,54 @@ class SavedView(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class Job(models.Model):
+    """
+    A background task for the `run_workers` command (see analytics.jobs): `kind`
+    names a function in jobs.TASKS and `params` are its keyword arguments.
+    Progress is `done` of `total` (total is null when unknown).
+    """
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+    STATUSES = [(s, s) for s in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    done = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True, default="")
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True, default="")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(auto_now_add=True)  # moved forward when a failed attempt is retried
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"{self.kind}#{self.pk} {self.status}"
+
+    @property
+    def fraction(self):
+        if self.status == self.DONE:
+            return 1.0
+        return min(self.done / self.total, 1.0) if self.total else None
+
+    @property
+    def eta_seconds(self):
+        """Seconds left at the average rate so far; None until there is a rate."""
+        if self.status != self.RUNNING or not self.started_at or not self.heartbeat_at or not self.fraction:
+            return None
+        elapsed = (self.heartbeat_at - self.started_at).total_seconds()
+        return round(elapsed / self.fraction * (1 - self.fraction), 1)
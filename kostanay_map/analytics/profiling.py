@@ -0,0 +1,292 @@
+"""
+Per-request profile of the API: SQL queries, database time, serialization
+time and response size, per resolved view name.
+
+`ProfilingMiddleware` (outermost in settings.MIDDLEWARE) keeps a RequestProfile
+in a context variable for the request. Every database connection gets an
+execute wrapper that adds to it, so queries run by async views on Django's
+database thread are counted too. Serialization is the FastList row building
+plus the rendering of DRF responses and the JSON encoding of the async views.
+
+The profile is reported three ways:
+  * a `Server-Timing` header (db, serialize, app, total) for the browser's devtools;
+  * process-wide counters served as Prometheus text by `metrics_view` (/metrics);
+  * a warning on the `analytics.profiling` logger, with the slowest SQL, for
+    requests over settings.SLOW_REQUEST_MS or over their query budget.
+
+Budgets are maximum query counts per view name (QUERY_BUDGETS, extended by
+settings.QUERY_BUDGETS). Test client responses carry the profile as
+`response.profile`; QueryBudgetMixin.assertWithinBudget checks it.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# view name -> most SQL queries one request may run (the DataVersion lookup of the cache included)
+QUERY_BUDGETS = {
+    "region-list": 4,
+    "city-list": 6,
+    "wave-list": 2,
+    "survey-list": 2,
+    "question-list": 5,  # ?q= adds the search index version check (and its first build)
+    "question-grouped-list": 3,
+    "metric-list": 2,
+    "datapoint-list": 3,
+    "choropleth": 2,
+    "timeseries": 2,
+    "geometry": 2,
+    "dashboard": 10,
+    "async-choropleth": 2,
+    "async-cities": 2,
+    "async-question-grouped": 3,
+    "job-list": 3,  # session and user lookups included
+    "job-detail": 3,
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_SQL = 100  # statements kept per request for the slow log
+
+_current = contextvars.ContextVar("analytics_profile", default=None)
+
+
+class RequestProfile:
+    __slots__ = ("started", "queries", "db", "serialize", "sql", "view", "bytes", "total")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = self.serialize = self.total = 0.0
+        self.sql = []
+        self.view = None
+        self.bytes = None
+
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.db += elapsed
+        if len(self.sql) < MAX_SQL:
+            self.sql.append((elapsed, sql))
+
+    def server_timing(self):
+        app = max(0.0, self.total - self.db - self.serialize)
+        return ", ".join((
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f"serialize;dur={self.serialize * 1000:.1f}",
+            f"app;dur={app * 1000:.1f}",
+            f"total;dur={self.total * 1000:.1f}",
+        ))
+
+
+@contextmanager
+def timed(part="serialize"):
+    """Add the block's wall time to the current request's `part` (no-op outside a request)."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(profile, part, getattr(profile, part) + time.perf_counter() - started)
+
+
+def _execute(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def instrument(connection, **kwargs):
+    """connection_created receiver: count this connection's queries into the request profile."""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def instrument_open_connections():
+    for connection in connections.all(initialized_only=True):
+        instrument(connection)
+
+
+def budget_for(view_name):
+    return {**QUERY_BUDGETS, **getattr(settings, "QUERY_BUDGETS", {})}.get(view_name)
+
+
+class Registry:
+    """Process-wide counters per (view, method, status), rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.views = {}
+
+    def observe(self, profile, method, status):
+        view = profile.view or "unresolved"
+        with self.lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    "buckets": [0] * len(BUCKETS), "count": 0, "seconds": 0.0,
+                    "queries": 0, "db": 0.0, "serialize": 0.0, "bytes": 0,
+                }
+            for i, bound in enumerate(BUCKETS):
+                if profile.total <= bound:
+                    stats["buckets"][i] += 1
+            stats["count"] += 1
+            stats["seconds"] += profile.total
+            stats["queries"] += profile.queries
+            stats["db"] += profile.db
+            stats["serialize"] += profile.serialize
+            stats["bytes"] += profile.bytes or 0
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.views.clear()
+
+    def render(self):
+        def label(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"')
+
+        with self.lock:
+            lines = [
+                "# HELP kostanay_http_requests_total API requests by view, method and status.",
+                "# TYPE kostanay_http_requests_total counter",
+            ]
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'kostanay_http_requests_total{{view="{label(view)}",method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                "# HELP kostanay_http_request_duration_seconds Time to the response, by view.",
+                "# TYPE kostanay_http_request_duration_seconds histogram",
+            ]
+            for view, stats in sorted(self.views.items()):
+                name = label(view)
+                for bound, count in zip(BUCKETS, stats["buckets"]):
+                    lines.append(f'kostanay_http_request_duration_seconds_bucket{{view="{name}",le="{bound}"}} {count}')
+                lines.append(f'kostanay_http_request_duration_seconds_bucket{{view="{name}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'kostanay_http_request_duration_seconds_sum{{view="{name}"}} {stats["seconds"]:.6f}')
+                lines.append(f'kostanay_http_request_duration_seconds_count{{view="{name}"}} {stats["count"]}')
+
+            for metric, field, kind, text in (
+                ("kostanay_db_queries_total", "queries", "counter", "SQL queries run, by view."),
+                ("kostanay_db_seconds_total", "db", "counter", "Time spent in SQL, by view."),
+                ("kostanay_serialize_seconds_total", "serialize", "counter", "Time spent serializing and rendering, by view."),
+                ("kostanay_response_bytes_total", "bytes", "counter", "Response body bytes (streamed bodies excluded), by view."),
+            ):
+                lines += [f"# HELP {metric} {text}", f"# TYPE {metric} {kind}"]
+                for view, stats in sorted(self.views.items()):
+                    value = stats[field]
+                    lines.append(f'{metric}{{view="{label(view)}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{metric}{{view="{label(view)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    """GET /metrics: Prometheus text exposition of this process's counters; bearer METRICS_TOKEN when set."""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token and request.META.get("HTTP_AUTHORIZATION") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "PROFILING_ENABLED", True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def process_template_response(self, request, response):
+        # runs right before DRF renders the response; the callback closes the span
+        profile = _current.get()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.serialize += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, profile):
+        match = getattr(request, "resolver_match", None)
+        profile.view = match.view_name if match else None
+        profile.total = time.perf_counter() - profile.started
+        profile.bytes = None if response.streaming else len(response.content)
+        response["Server-Timing"] = profile.server_timing()
+        response.profile = profile
+        registry.observe(profile, request.method, response.status_code)
+
+        budget = budget_for(profile.view)
+        over_budget = budget is not None and profile.queries > budget
+        slow = profile.total * 1000 >= getattr(settings, "SLOW_REQUEST_MS", 500)
+        if slow or over_budget:
+            statements = "\n".join(
+                f"  {elapsed * 1000:8.1f} ms  {sql}" for elapsed, sql in sorted(profile.sql, reverse=True)[:20]
+            )
+            logger.warning(
+                "%s %s (%s): %.0f ms, %d queries%s, db %.0f ms, serialize %.0f ms\n%s",
+                request.method, request.get_full_path(), profile.view, profile.total * 1000, profile.queries,
+                f" over budget {budget}" if over_budget else "", profile.db * 1000, profile.serialize * 1000,
+                statements,
+            )
+        return response
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: assertWithinBudget(response[, budget]) against the view's QUERY_BUDGETS entry."""
+
+    def assertWithinBudget(self, response, budget=None):
+        profile = getattr(response, "profile", None)
+        self.assertIsNotNone(profile, "response has no profile; is ProfilingMiddleware installed?")
+        budget = budget if budget is not None else budget_for(profile.view)
+        self.assertIsNotNone(budget, f"no query budget for {profile.view!r}")
+        queries = "\n".join(sql for _, sql in profile.sql)
+        self.assertLessEqual(
+            profile.queries, budget,
+            f"{profile.view} ran {profile.queries} queries (budget {budget}):\n{queries}",
+        )
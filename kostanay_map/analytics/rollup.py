@@ -0,0 +1,184 @@
+"""
+Weighted rollups of survey shares with their sampling error (?weighted=1 on the
+choropleth endpoints).
+
+A cell is one (metric, question, option) value of a city. Its sample size is the
+respondent count in DataPoint.extra: "base" (what microdata.publish writes) or
+"n". Region figures are the cities' values weighted by sample size (a
+stratified estimate) rather than the plain average of city percentages the
+cube stores:
+
+    p_R = Σ n_i p_i / Σ n_i        var(p_R) = Σ n_i p_i (1 - p_i) / (Σ n_i)²
+
+which for one city is the usual p (1 - p) / n. The margin of error is
+z · sqrt(var) for the requested confidence, and is only given for share
+metrics (unit "percent"). Cities without a sample size count with the mean
+size of the other cities of their cell; when none has one the rollup is the
+plain average and has no margin. Region-level datapoints (no city) are
+measurements in their own right and replace the rollup of their cell.
+
+One query reads the wave; grouping and sums are NumPy bincounts over every
+metric at once.
+"""
+from statistics import NormalDist
+
+import numpy as np
+
+from .models import DataPoint
+
+SHARE_UNITS = ("percent", "%")
+SIZE_KEYS = ("base", "n")  # DataPoint.extra keys holding the sample size, first found wins
+LEVELS = ("city", "region")
+DEFAULT_CONFIDENCE = 0.95
+
+
+def z_score(confidence):
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _codes(values):
+    if not values:
+        return np.array([], dtype=object), np.zeros(0, dtype=np.int64)
+    labels, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return labels, codes.ravel()
+
+
+def load(wave_code, metric_codes=None, question=None, option=None):
+    """
+    The wave's datapoints as column arrays in one query: ({column: array}, {column: labels}).
+    metric/question/option/city/region are codes into the labels ("" for none),
+    n is NaN when unknown; region is the city's region for city rows.
+    """
+    qs = DataPoint.objects.filter(wave__code=wave_code)
+    if metric_codes:
+        qs = qs.filter(metric__code__in=metric_codes)
+    if question:
+        qs = qs.filter(question__code=question)
+    if option:
+        qs = qs.filter(option__label=option)
+    rows = list(qs.values_list(
+        "metric__code", "metric__unit", "question__code", "option__label", "city__slug",
+        "city__region__slug", "region__slug", "value", *[f"extra__{key}" for key in SIZE_KEYS],
+    ))
+    frame, labels = {}, {}
+    columns = {
+        "metric": [r[0] for r in rows], "question": [r[2] or "" for r in rows], "option": [r[3] or "" for r in rows],
+        "city": [r[4] or "" for r in rows], "region": [(r[5] if r[4] else r[6]) or "" for r in rows],
+    }
+    for name, values in columns.items():
+        labels[name], frame[name] = _codes(values)
+    frame["has_city"] = np.array([bool(r[4]) for r in rows], dtype=bool)
+    frame["share"] = np.array([r[1] in SHARE_UNITS for r in rows], dtype=bool)
+    frame["value"] = np.array([_number(r[7]) for r in rows], dtype=np.float64)
+    sizes = np.full(len(rows), np.nan)
+    for offset in range(len(SIZE_KEYS)):
+        sizes = np.where(np.isnan(sizes), np.array([_number(r[8 + offset]) for r in rows], dtype=np.float64), sizes)
+    frame["n"] = np.where(sizes > 0, sizes, np.nan)
+    return frame, labels
+
+
+def estimate(keys, values, sizes, share):
+    """
+    Size-weighted rollup of rows grouped by `keys` (int matrix, one row per datapoint):
+    (groups, value, n, variance), n and variance NaN when unknown.
+    """
+    if not len(keys):
+        empty = np.zeros(0)
+        return keys.reshape(0, keys.shape[1] if keys.ndim == 2 else 0), empty, empty, empty
+    groups, index = np.unique(keys, axis=0, return_inverse=True)
+    index = index.ravel()
+    count = len(groups)
+
+    def total(weights):
+        return np.bincount(index, weights=weights, minlength=count)
+
+    known = ~np.isnan(sizes)
+    known_count = total(known.astype(np.float64))
+    mean_size = np.divide(total(np.where(known, sizes, 0)), known_count, out=np.ones(count), where=known_count > 0)
+    weights = np.where(known, sizes, mean_size[index])
+    size = total(weights)
+    p = values / 100
+    value = total(weights * p) / size * 100
+    variance = total(weights * p * (1 - p)) / size ** 2
+    unknown = known_count == 0
+    variance[unknown | (total((~share).astype(np.float64)) > 0)] = np.nan
+    return groups, value, np.where(unknown, np.nan, size), variance
+
+
+def rollup(frame, level="city"):
+    """(cells, owners, value, n, variance); cells are (metric, question, option) code rows, owners city or region codes."""
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    cells = np.column_stack([frame["metric"], frame["question"], frame["option"]]).astype(np.int64)
+    rows = frame["has_city"]
+    owner = frame["city"] if level == "city" else frame["region"]
+    groups, value, n, variance = estimate(
+        np.column_stack([cells[rows], owner[rows]]), frame["value"][rows], frame["n"][rows], frame["share"][rows],
+    )
+    if level == "region":
+        direct = ~frame["has_city"]
+        if direct.any():
+            measured = estimate(
+                np.column_stack([cells[direct], owner[direct]]), frame["value"][direct], frame["n"][direct], frame["share"][direct],
+            )
+            replaced = {tuple(key) for key in measured[0].tolist()}
+            keep = np.array([tuple(key) not in replaced for key in groups.tolist()], dtype=bool)
+            groups = np.concatenate([groups[keep], measured[0]])
+            value, n, variance = (np.concatenate([a[keep], b]) for a, b in zip((value, n, variance), measured[1:]))
+    return groups[:, :3], groups[:, 3], value, n, variance
+
+
+def _optional(value, ndigits):
+    return None if np.isnan(value) else round(float(value), ndigits)
+
+
+def shares(wave_code, metric_codes=None, level="city", confidence=DEFAULT_CONFIDENCE, question=None, option=None):
+    """
+    [{metric, question, option, slug, value, n, moe, low, high}] for every cell of the
+    wave at `level`, sorted; question/option are None for plain metrics, n/moe/low/high
+    None when unknown. low/high are clipped to 0..100.
+    """
+    z = z_score(confidence)
+    frame, labels = load(wave_code, metric_codes, question, option)
+    cells, owners, value, n, variance = rollup(frame, level)
+    moe = z * np.sqrt(variance) * 100
+    low, high = np.clip(value - moe, 0, 100), np.clip(value + moe, 0, 100)
+    owner_labels = labels[level]
+    result = []
+    for i in range(len(value)):
+        metric, question_code, option_label = (labels[name][cells[i, k]] for k, name in enumerate(("metric", "question", "option")))
+        result.append({
+            "metric": metric, "question": question_code or None, "option": option_label or None,
+            "slug": owner_labels[owners[i]], "value": round(float(value[i]), 4), "n": _optional(n[i], 1),
+            "moe": _optional(moe[i], 4), "low": _optional(low[i], 4), "high": _optional(high[i], 4),
+        })
+    return sorted(result, key=lambda r: (r["metric"], r["question"] or "", r["option"] or "", r["slug"]))
+
+
+def by_owner(rows):
+    """
+    {metric: [(slug, value, n, moe, low, high)]} from `shares` rows, one entry per slug:
+    a metric with several cells per slug (options not filtered) gets their mean and no n/moe.
+    """
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row["metric"], {}).setdefault(row["slug"], []).append(row)
+    result = {}
+    for metric, owners in grouped.items():
+        result[metric] = []
+        for slug, cells in sorted(owners.items()):
+            if len(cells) == 1:
+                c = cells[0]
+                result[metric].append((slug, c["value"], c["n"], c["moe"], c["low"], c["high"]))
+            else:
+                result[metric].append((slug, round(sum(c["value"] for c in cells) / len(cells), 4), None, None, None, None))
+    return result
@@ -0,0 +1,145 @@
+"""
+Read replicas for the public API (settings.DATABASE_REPLICAS, see DB_REPLICAS in settings).
+
+ReplicaMiddleware picks one replica per safe API request (under REPLICA_PATHS)
+and ReplicaRouter sends that request's analytics reads to it; everything else
+(admin, jobs, management commands, writes) stays on the primary. A replica
+is used only while its replay lag, checked at most every
+REPLICA_CHECK_INTERVAL seconds per process, is within REPLICA_MAX_LAG; with
+none healthy the primary answers.
+
+Read-your-writes: a successful unsafe request (an admin edit, an API POST)
+sets a short-lived cookie that keeps the client's next REPLICA_PIN_SECONDS
+of reads on the primary, and a write inside a request moves the rest of the
+request to the primary.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "db_pin"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_replica = contextvars.ContextVar("analytics_replica", default=None)
+_health = {}  # alias -> (checked at, lag in seconds or None when unreachable)
+_health_lock = threading.Lock()
+
+
+def replicas():
+    return list(getattr(settings, "DATABASE_REPLICAS", ()))
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary (0 off PostgreSQL); None when it cannot be reached."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError as e:
+        logger.warning("replica %s unreachable: %s", alias, e)
+        connection.close()
+        return None
+
+
+def lag(alias):
+    """replica_lag, reused for REPLICA_CHECK_INTERVAL seconds."""
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked is None or now - checked[0] >= getattr(settings, "REPLICA_CHECK_INTERVAL", 5.0):
+        with _health_lock:
+            checked = (now, replica_lag(alias))
+            _health[alias] = checked
+    return checked[1]
+
+
+def healthy_replicas():
+    max_lag = getattr(settings, "REPLICA_MAX_LAG", 5.0)
+    return [alias for alias in replicas() if (seconds := lag(alias)) is not None and seconds <= max_lag]
+
+
+def choose_replica():
+    """A replica in sync enough to read from, or None for the primary."""
+    candidates = healthy_replicas()
+    return random.choice(candidates) if candidates else None
+
+
+class ReplicaRouter:
+    """Sends the analytics reads of replica-routed requests to the request's replica."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "analytics":
+            return _replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # read-your-writes within the request: what follows reads the primary
+        _replica.set(None)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def route(self, request):
+        """The replica for this request, or None to read the primary."""
+        if request.method not in SAFE_METHODS or request.COOKIES.get(PIN_COOKIE) or not replicas():
+            return None
+        if not request.path_info.startswith(tuple(getattr(settings, "REPLICA_PATHS", ("/api/",)))):
+            return None
+        return choose_replica()
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas():
+            response.set_cookie(
+                PIN_COOKIE, "1", max_age=getattr(settings, "REPLICA_PIN_SECONDS", 10), httponly=True, samesite="Lax",
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _replica.set(self.route(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        # the lag check may query the replica
+        token = _replica.set(await sync_to_async(self.route)(request) if replicas() else None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica.reset(token)
+        return self.finish(request, response)
@@ -0,0 +1,369 @@
+"""
+Question search.
+
+On PostgreSQL every Question keeps a weighted `search_vector` (code A, text B,
+category C, russian config) behind a GIN index; queries are parsed with
+websearch_to_tsquery, ranked with ts_rank and highlighted with ts_headline.
+When full-text finds nothing (typos, partial words) a pg_trgm word-similarity
+pass over the text runs instead, also GIN indexed.
+
+Other databases (SQLite in development and tests) use an in-process inverted
+index with the same two passes: stemmed terms ranked by tf-idf, then character
+trigram similarity against the vocabulary. The index is rebuilt when the
+question table's DataVersion moves.
+
+`search_questions` returns the same shape from both backends; `ranked_ids` is the
+full ranked match set behind it. Highlights are HTML: the question text is
+escaped and only the <mark> tags are markup.
+"""
+import html
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import (
+    SearchHeadline, SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import F
+
+from .cache import table_scope
+from .models import DataVersion, Question, Survey, SurveyWave
+
+CONFIG = "russian"
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+TRIGRAM_THRESHOLD = 0.3
+START_SEL, STOP_SEL = "<mark>", "</mark>"
+# ts_headline delimiters, swapped for START_SEL/STOP_SEL once the text around them is escaped
+_START_RAW, _STOP_RAW = "\x02", "\x03"
+WEIGHTS = {"code": 1.0, "text": 0.4, "category": 0.2}  # ts_rank defaults for A, B, C
+
+
+def is_postgres():
+    return connection.vendor == "postgresql"
+
+
+def search_vector():
+    return (
+        SearchVector("code", weight="A", config=CONFIG)
+        + SearchVector("text", weight="B", config=CONFIG)
+        + SearchVector("category", weight="C", config=CONFIG)
+    )
+
+
+def ensure_indexes():
+    """pg_trgm and the GIN indexes; there are no migrations for these, so this runs after migrate."""
+    if not is_postgres():
+        return
+    table = Question._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_search_gin ON {table} USING gin (search_vector)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_text_trgm ON {table} USING gin (text gin_trgm_ops)")
+
+
+def reindex(questions=None):
+    """Recompute search_vector (PostgreSQL) for the given queryset, or all questions. Returns rows updated."""
+    if not is_postgres():
+        return 0
+    qs = Question.objects.all() if questions is None else questions
+    return qs.update(search_vector=search_vector())
+
+
+def _filtered(qs, survey_id=None, wave_code=None):
+    if survey_id:
+        qs = qs.filter(survey_id=survey_id)
+    if wave_code:
+        qs = qs.filter(survey__wave__code=wave_code)
+    return qs
+
+
+def _hit(question, rank, highlight):
+    return {
+        "id": question["id"], "survey": question["survey_id"], "code": question["code"],
+        "text": question["text"], "category": question["category"],
+        "rank": round(float(rank), 6), "highlight": highlight,
+    }
+
+
+# --- PostgreSQL --------------------------------------------------------------
+
+def _postgres_matches(q, survey_id, wave_code):
+    """(mode, query, count, matches annotated with `rank` and ordered best first)."""
+    base = _filtered(Question.objects.all(), survey_id, wave_code)
+    query = SearchQuery(q, config=CONFIG, search_type="websearch")
+    matches = base.filter(search_vector=query)
+    count = matches.count()
+    if count:
+        return "fulltext", query, count, matches.annotate(rank=SearchRank(F("search_vector"), query)).order_by(
+            "-rank", "sort_order", "id",
+        )
+    similar = base.annotate(rank=TrigramWordSimilarity(q, "text")).filter(rank__gte=TRIGRAM_THRESHOLD)
+    return "trigram", query, similar.count(), similar.order_by("-rank", "sort_order", "id")
+
+
+def _postgres_search(q, survey_id, wave_code, limit, offset):
+    fields = ("id", "survey_id", "code", "text", "category", "rank")
+    mode, query, count, matches = _postgres_matches(q, survey_id, wave_code)
+    if mode == "fulltext":
+        rows = matches.annotate(highlight=SearchHeadline(
+            "text", query, config=CONFIG, start_sel=_START_RAW, stop_sel=_STOP_RAW, highlight_all=True,
+        )).values(*fields, "highlight")[offset:offset + limit]
+        return mode, count, [_hit(r, r["rank"], _marked(r["highlight"])) for r in rows]
+    rows = matches.values(*fields)[offset:offset + limit]
+    return mode, count, [_hit(r, r["rank"], highlight_words(r["text"], _fuzzy_terms(r["text"], q))) for r in rows]
+
+
+def _marked(headline):
+    return html.escape(headline).replace(_START_RAW, START_SEL).replace(_STOP_RAW, STOP_SEL)
+
+
+def _fuzzy_terms(text, q):
+    query_grams = [trigrams(word) for word in tokenize(q)]
+    return {
+        stem(word) for word in tokenize(text)
+        if any(similarity(trigrams(word), grams) >= TRIGRAM_THRESHOLD for grams in query_grams)
+    }
+
+
+# --- in-process index --------------------------------------------------------
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_VOWELS = "аеиоуыэюя"
+# stop words dropped by the russian text search config (the frequent ones)
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+меня еще нет о из ему когда даже ли если уже или ни быть был него до вас там потом себя ей может они тут
+где есть надо ней для мы тебя их чем была сам без тоже себе под будет кто этот того потому этого какой
+ним здесь этом один мой тем чтобы нее были куда можно при об другой после над больше тот через эти нас
+про всего них какая много эту моя свою этой перед том такой им более всегда между
+""".split())
+
+# Snowball Russian stemmer (the one behind PostgreSQL's russian config); endings longest first.
+# "1" groups only match after а/я, which stays on the stem.
+_GERUND = (("ившись", "ывшись", "ивши", "ывши", "ив", "ыв"), ("вшись", "вши", "в"))
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им", "ым",
+    "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE = (("ивш", "ывш", "ующ"), ("ем", "нн", "вш", "ющ", "щ"))
+_REFLEXIVE = ("ся", "сь")
+_VERB = (
+    ("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют", "ены", "ить",
+     "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю"),
+    ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н"),
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям",
+    "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+
+
+def _regions(word):
+    """(rv, r2) start offsets."""
+    def after_vowel_consonant(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    return rv, after_vowel_consonant(after_vowel_consonant(0) - 1)
+
+
+def _strip(word, rv, endings, grouped=False):
+    """Remove the longest matching ending inside RV; returns the new word or None."""
+    groups = endings if grouped else (endings, ())
+    for ending in sorted((e for g in groups for e in g), key=len, reverse=True):
+        if not word.endswith(ending) or len(word) - len(ending) < rv:
+            continue
+        if grouped and ending in groups[1] and ending not in groups[0]:
+            cut = len(word) - len(ending)
+            if cut <= rv or word[cut - 1] not in "ая":
+                continue
+        return word[:-len(ending)]
+    return None
+
+
+def stem(word):
+    rv, r2 = _regions(word)
+    stemmed = _strip(word, rv, _GERUND, grouped=True)
+    if stemmed is None:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        adjective = _strip(word, rv, _ADJECTIVE)
+        if adjective is not None:
+            stemmed = _strip(adjective, rv, _PARTICIPLE, grouped=True) or adjective
+        else:
+            stemmed = _strip(word, rv, _VERB, grouped=True)
+            if stemmed is None:
+                stemmed = _strip(word, rv, _NOUN)
+    word = word if stemmed is None else stemmed
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+    for ending in ("ость", "ост"):
+        if word.endswith(ending) and len(word) - len(ending) >= r2:
+            word = word[:-len(ending)]
+            break
+    if word.endswith("нн") and len(word) - 1 >= rv:
+        return word[:-1]
+    for ending in ("ейше", "ейш"):
+        if word.endswith(ending) and len(word) - len(ending) >= rv:
+            word = word[:-len(ending)]
+            return word[:-1] if word.endswith("нн") else word
+    if word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [w for w in (w.lower().replace("ё", "е") for w in _WORD.findall(text or "")) if w not in STOP_WORDS]
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def highlight_words(text, stems):
+    """`text` HTML-escaped, with the words whose stem is in `stems` wrapped in <mark>."""
+    out, end = [], 0
+    for m in _WORD.finditer(text):
+        word = m.group(0)
+        out.append(html.escape(text[end:m.start()]))
+        if stem(word.lower().replace("ё", "е")) in stems:
+            out.append(f"{START_SEL}{html.escape(word)}{STOP_SEL}")
+        else:
+            out.append(html.escape(word))
+        end = m.end()
+    out.append(html.escape(text[end:]))
+    return "".join(out)
+
+
+class InvertedIndex:
+    """stem -> {question id: weighted term frequency}, plus a trigram map over the vocabulary."""
+
+    def __init__(self, questions):
+        self.docs = {}
+        self.postings = defaultdict(dict)
+        self.grams = defaultdict(set)
+        for q in questions:
+            self.docs[q["id"]] = q
+            weights = Counter()
+            for field, weight in WEIGHTS.items():
+                for word in tokenize(q[field]):
+                    weights[stem(word)] += weight
+            for term, weight in weights.items():
+                self.postings[term][q["id"]] = weight
+        for term in self.postings:
+            for gram in trigrams(term):
+                self.grams[gram].add(term)
+
+    def idf(self, term):
+        return math.log(1 + len(self.docs) / len(self.postings[term]))
+
+    def score(self, terms):
+        """{id: score} for documents containing every (term, factor) group; groups are OR-ed synonyms."""
+        scores = None
+        for group in terms:
+            found = defaultdict(float)
+            for term, factor in group:
+                for doc_id, weight in self.postings.get(term, {}).items():
+                    found[doc_id] = max(found[doc_id], weight * self.idf(term) * factor)
+            scores = found if scores is None else {
+                doc_id: score + found[doc_id] for doc_id, score in scores.items() if doc_id in found
+            }
+        return scores or {}
+
+    def similar_terms(self, word):
+        grams = trigrams(word)
+        candidates = set().union(*(self.grams.get(g, ()) for g in grams))
+        return [(term, sim) for term in candidates if (sim := similarity(grams, trigrams(term))) >= TRIGRAM_THRESHOLD]
+
+    def search(self, q):
+        """(mode, [(id, score)], matched stems), best first."""
+        words = tokenize(q)
+        if not words:
+            return "fulltext", [], set()
+        scores = self.score([[(stem(w), 1.0)] for w in words])
+        mode, matched = "fulltext", {stem(w) for w in words}
+        if not scores:
+            # like word_similarity: a document matches through any fuzzy term, scores add up
+            groups = [self.similar_terms(w) for w in words]
+            mode, matched = "trigram", {term for group in groups for term, _ in group}
+            scores = defaultdict(float)
+            for group in groups:
+                for doc_id, score in self.score([group]).items():
+                    scores[doc_id] += score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]]["sort_order"], item[0]))
+        return mode, ranked, matched
+
+
+_index = {"version": None, "index": None}
+
+
+def get_index():
+    scopes = [table_scope(Question), table_scope(Survey), table_scope(SurveyWave)]
+    version = tuple(DataVersion.objects.filter(scope__in=scopes).order_by("scope").values_list("scope", "version"))
+    if _index["index"] is None or _index["version"] != version:
+        questions = Question.objects.values(
+            "id", "survey_id", "code", "text", "category", "sort_order", wave_code=F("survey__wave__code"),
+        )
+        _index.update(version=version, index=InvertedIndex(
+            {**q, "code": q["code"] or "", "category": q["category"] or ""} for q in questions
+        ))
+    return _index["index"]
+
+
+def _memory_matches(q, survey_id, wave_code):
+    """(index, mode, [(id, score)] best first, matched stems)."""
+    index = get_index()
+    mode, ranked, matched = index.search(q)
+    ranked = [
+        (doc_id, score) for doc_id, score in ranked
+        if (not survey_id or str(index.docs[doc_id]["survey_id"]) == str(survey_id))
+        and (not wave_code or index.docs[doc_id]["wave_code"] == wave_code)
+    ]
+    return index, mode, ranked, matched
+
+
+def _memory_search(q, survey_id, wave_code, limit, offset):
+    index, mode, ranked, matched = _memory_matches(q, survey_id, wave_code)
+    hits = []
+    for doc_id, score in ranked[offset:offset + limit]:
+        doc = index.docs[doc_id]
+        hits.append(_hit({**doc, "code": doc["code"] or None}, score, highlight_words(doc["text"], matched)))
+    return mode, len(ranked), hits
+
+
+# --- entry point -------------------------------------------------------------
+
+def search_questions(q, survey_id=None, wave_code=None, limit=DEFAULT_LIMIT, offset=0):
+    """
+    {"query", "mode": "fulltext"|"trigram", "count", "limit", "offset", "results": [...]}
+    Each result has id, survey, code, text, category, rank and highlight (matches in <mark>).
+    """
+    q = (q or "").strip()
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    offset = max(0, int(offset))
+    if not q:
+        mode, count, hits = "fulltext", 0, []
+    elif is_postgres():
+        mode, count, hits = _postgres_search(q, survey_id, wave_code, limit, offset)
+    else:
+        mode, count, hits = _memory_search(q, survey_id, wave_code, limit, offset)
+    return {"query": q, "mode": mode, "count": count, "limit": limit, "offset": offset, "results": hits}
+
+
+def ranked_ids(q, survey_id=None, wave_code=None):
+    """Ids of every question search_questions would return for `q`, best first (no limit)."""
+    q = (q or "").strip()
+    if not q:
+        return []
+    if is_postgres():
+        return list(_postgres_matches(q, survey_id, wave_code)[3].values_list("id", flat=True))
+    return [doc_id for doc_id, _ in _memory_matches(q, survey_id, wave_code)[2]]
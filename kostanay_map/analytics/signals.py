@@ -0,0 +1,138 @@
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import cube, search, snapshots, tiles, timeseries
+from .cache import bump, table_scope, wave_scope
+from .geometry import prune_geometries, rebuild_feature_levels
+from .models import (
+    Region, City, Geometry, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, ChoroplethCell,
+    SeriesPoint,
+)
+
+
+def _union(boxes):
+    boxes = [b for b in boxes if b]
+    if not boxes:
+        return None
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+@receiver(post_save, sender=City)
+@receiver(post_save, sender=Region)
+def feature_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "geometry" not in update_fields):
+        return
+    old_boxes = list(instance.feature_levels.values_list("bbox", flat=True))
+    if rebuild_feature_levels(instance):
+        # tiles under both the old and the new outline are stale
+        tiles.invalidate_bbox(_union(old_boxes + [instance.geometry.bbox if instance.geometry_id else None]))
+
+
+@receiver(post_save, sender=City)
+@receiver(post_save, sender=Region)
+def slug_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ChoroplethCell.objects.filter(level=sender.__name__.lower(), owner_id=instance.pk) \
+            .exclude(slug=instance.slug).update(slug=instance.slug)
+
+
+@receiver(post_delete, sender=City)
+@receiver(post_delete, sender=Region)
+def feature_deleted(sender, instance, **kwargs):
+    if instance.geometry_id:
+        tiles.invalidate_bbox(Geometry.objects.filter(pk=instance.geometry_id).values_list("bbox", flat=True).first())
+        prune_geometries([instance.geometry_id])
+
+
+@receiver(pre_save, sender=SurveyWave)
+def wave_saving(sender, instance, raw=False, **kwargs):
+    instance._was_locked = None
+    if not raw and instance.pk:
+        instance._was_locked = SurveyWave.objects.filter(pk=instance.pk).values_list("is_locked", flat=True).first()
+
+
+@receiver(post_save, sender=SurveyWave)
+def wave_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ChoroplethCell.objects.filter(wave=instance).exclude(wave_code=instance.code).update(wave_code=instance.code)
+    SeriesPoint.objects.filter(wave=instance).exclude(wave_code=instance.code).update(wave_code=instance.code)
+    if bool(getattr(instance, "_was_locked", None)) != instance.is_locked:
+        timeseries.refresh_waves([instance])
+        if not instance.is_locked:
+            snapshots.remove([instance.code])
+
+
+@receiver(post_delete, sender=SurveyWave)
+def wave_deleted(sender, instance, **kwargs):
+    snapshots.remove([instance.code])
+    # its points went with the cascade; later waves of the cadence need new deltas
+    if instance.is_locked:
+        timeseries.refresh_cadence(timeseries.cadence_of(instance.code))
+        bump(table_scope(SeriesPoint))
+
+
+@receiver(post_save, sender=Metric)
+def metric_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ChoroplethCell.objects.filter(metric=instance).update(metric_code=instance.code)
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not {"code", "text", "category"} & set(update_fields)):
+        return
+    search.reindex(Question.objects.filter(pk=instance.pk))
+
+
+@receiver(post_migrate)
+def search_indexes(sender, app_config=None, **kwargs):
+    if app_config is not None and app_config.label == "analytics":
+        search.ensure_indexes()
+        search.reindex(Question.objects.filter(search_vector__isnull=True))
+
+
+@receiver(pre_save, sender=DataPoint)
+def datapoint_saving(sender, instance, raw=False, **kwargs):
+    # remember the cells the row belonged to, in case wave/metric/city/region changed
+    instance._cube_previous = None
+    if not raw and instance.pk:
+        instance._cube_previous = DataPoint.objects.filter(pk=instance.pk).only(
+            "wave_id", "metric_id", "city_id", "region_id"
+        ).first()
+
+
+@receiver(post_save, sender=DataPoint)
+@receiver(post_delete, sender=DataPoint)
+def datapoint_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, "_cube_previous", None)
+    cube.refresh_datapoint(instance)
+    if previous and any(
+        getattr(previous, f) != getattr(instance, f) for f in ("wave_id", "metric_id", "city_id", "region_id")
+    ):
+        cube.refresh_datapoint(previous)
+    tiles.invalidate_values(instance.wave.code)
+    if previous and previous.wave_id != instance.wave_id:
+        tiles.invalidate_values(previous.wave.code)
+
+
+def bump_data_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is SurveyWave:
+        bump(table_scope(sender))
+        bump(wave_scope(instance.code), is_locked=instance.is_locked)
+    elif sender is DataPoint:
+        bump(table_scope(sender), wave_scope(instance.wave.code))
+    else:
+        bump(table_scope(sender))
+
+
+# ChoroplethCell and SeriesPoint are left out on purpose: they only change together
+# with their sources, and refresh_cube / timeseries.refresh_waves bump the versions
+# themselves after a bulk rebuild.
+for model in (Region, City, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint):
+    post_save.connect(bump_data_version, sender=model, dispatch_uid=f"bump_data_version_save_{model.__name__}")
+    post_delete.connect(bump_data_version, sender=model, dispatch_uid=f"bump_data_version_delete_{model.__name__}")
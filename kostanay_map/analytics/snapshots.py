@@ -0,0 +1,380 @@
+"""
+Precompiled static snapshots of locked waves (see the `build_snapshots` command).
+
+A locked wave no longer changes, so every response the dashboard asks for
+about it (the survey list, grouped questions per survey and city, the
+choropleth of every metric) is rendered once through the API views and kept
+under settings.SNAPSHOT_DIR/<wave>/ as content-addressed files: <hash>.json
+plus <hash>.json.gz and, when brotli is installed, <hash>.json.br. The wave's
+manifest.json maps "<url name>?<sorted query>" to a file.
+
+SnapshotMiddleware answers matching GET requests from those files, in the
+encoding the client accepts, without touching the database. A build is
+incremental (files whose hash exists are kept, a wave whose data versions
+match its manifest is skipped) and compresses new files in a process pool.
+Any write to the data behind a snapshot drops the manifest (cache.bump calls
+invalidate) and queues a rebuild, so stale files are never served.
+"""
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from django.utils.http import quote_etag
+
+if importlib.util.find_spec("brotli") is not None:
+    import brotli
+elif importlib.util.find_spec("brotlicffi") is not None:
+    import brotlicffi as brotli
+else:
+    brotli = None
+
+MANIFEST = "manifest.json"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # Content-Encoding, file suffix; preferred first
+# tables every snapshot may read besides the wave's own data; SurveyWave is left
+# out (its table version moves whenever any wave is created or locked)
+TABLES = ("survey", "question", "answeroption", "metric", "city")
+# async twins of the snapshotted views, served from the same files
+ALIASES = {"async-choropleth": "choropleth", "async-question-grouped": "question-grouped-list"}
+
+
+def root():
+    return str(settings.SNAPSHOT_DIR)
+
+
+def wave_dir(code):
+    return os.path.join(root(), quote(code, safe=""))
+
+
+def snapshot_key(name, params):
+    return f"{name}?{urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+
+def _versions(code):
+    from .cache import wave_scope
+    from .models import DataVersion
+
+    scopes = [wave_scope(code), *[f"table:{name}" for name in TABLES]]
+    rows = dict(DataVersion.objects.filter(scope__in=scopes).values_list("scope", "version"))
+    return {scope: rows.get(scope, 0) for scope in scopes}
+
+
+def read_manifest(code):
+    try:
+        with open(os.path.join(wave_dir(code), MANIFEST), "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# --- building ---------------------------------------------------------------------
+
+def targets(code):
+    """[(url name, params)] the dashboard asks for about wave `code`."""
+    from .models import ChoroplethCell, DataPoint, Survey
+
+    result = [("survey-list", {"wave_code": code}), ("question-grouped-list", {"wave": code})]
+    for survey_id in Survey.objects.filter(wave__code=code).order_by("id").values_list("id", flat=True):
+        result.append(("question-grouped-list", {"wave": code, "survey_id": survey_id}))
+    pairs = (
+        DataPoint.objects.filter(wave__code=code, city__isnull=False)
+        .values_list("question__survey_id", "city__slug").distinct().order_by("question__survey_id", "city__slug")
+    )
+    for survey_id, city in pairs:
+        if survey_id is not None:
+            result.append(("question-grouped-list", {"wave": code, "survey_id": survey_id, "city": city}))
+    cells = (
+        ChoroplethCell.objects.filter(wave_code=code).exclude(metric_code=None)
+        .values_list("metric_code", "level").distinct().order_by("metric_code", "level")
+    )
+    for metric, level in cells:
+        result.append(("choropleth", {"metric": metric, "wave": code, **({} if level == "city" else {"level": level})}))
+    return result
+
+
+def render(name, params):
+    """(body, content type) of the API response for `name` with `params`; None unless it is a 200."""
+    path = reverse(name)
+    request = RequestFactory().get(path, {k: str(v) for k, v in params.items()}, HTTP_ACCEPT="application/json")
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    if response.status_code != 200 or response.streaming:
+        return None
+    return response.content, response["Content-Type"]
+
+
+def write_file(job):
+    """Write one body with its precompressed variants (runs in the worker processes). job: (folder, hash, body)."""
+    folder, digest, body = job
+    path = os.path.join(folder, f"{digest}.json")
+    sizes = {"identity": len(body)}
+    for encoding, suffix in ENCODINGS:
+        if encoding == "br":
+            if brotli is None:
+                continue
+            data = brotli.compress(body, quality=11)
+        else:
+            data = gzip.compress(body, 9, mtime=0)
+        _write_atomic(path + suffix, data)
+        sizes[encoding] = len(data)
+    _write_atomic(path, body)  # last: its presence means the variants are complete
+    return digest, sizes
+
+
+def _encodings_on_disk(folder, digest):
+    return [encoding for encoding, suffix in ENCODINGS if os.path.exists(os.path.join(folder, f"{digest}.json{suffix}"))]
+
+
+def _prune(folder, keep):
+    for name in os.listdir(folder):
+        if not name.startswith(MANIFEST) and name.split(".", 1)[0] not in keep:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+
+def build_wave(code, workers=None, force=False, progress=None):
+    """
+    Render and store the snapshots of locked wave `code`. Returns {wave, files,
+    written, bytes, skipped}; skipped when the manifest is already current.
+    """
+    folder = wave_dir(code)
+    versions = _versions(code)
+    manifest = read_manifest(code)
+    if manifest and manifest.get("versions") == versions and not force:
+        return {"wave": code, "files": len(manifest["files"]), "written": 0, "bytes": 0, "skipped": True}
+
+    os.makedirs(folder, exist_ok=True)
+    todo = targets(code)
+    files, bodies = {}, {}
+    for n, (name, params) in enumerate(todo):
+        if progress:
+            progress(n, len(todo), f"{code} {name}")
+        rendered = render(name, params)
+        if rendered is None:
+            continue
+        body, content_type = rendered
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        files[snapshot_key(name, params)] = {"hash": digest, "content_type": content_type}
+        if force or not os.path.exists(os.path.join(folder, f"{digest}.json")):
+            bodies[digest] = body
+
+    jobs = [(folder, digest, body) for digest, body in bodies.items()]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = sum(sum(sizes.values()) for _, sizes in pool.map(write_file, jobs, chunksize=8))
+    else:
+        written = sum(sum(sizes.values()) for _, sizes in map(write_file, jobs))
+    for entry in files.values():
+        entry["encodings"] = _encodings_on_disk(folder, entry["hash"])
+
+    if _versions(code) != versions:
+        # the data moved while rendering: leave no manifest, the write queued a rebuild
+        remove_manifest(code)
+        return {"wave": code, "files": 0, "written": len(jobs), "bytes": written, "skipped": False}
+    data = {"wave": code, "versions": versions, "built_at": timezone.now().isoformat(), "files": files}
+    _write_atomic(os.path.join(folder, MANIFEST), json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    _prune(folder, {entry["hash"] for entry in files.values()})
+    return {"wave": code, "files": len(files), "written": len(jobs), "bytes": written, "skipped": False}
+
+
+def build(codes=None, workers=None, force=False, progress=None):
+    """Build the snapshots of the locked waves among `codes` (all locked waves by default); unlocked ones are removed."""
+    from .models import SurveyWave
+
+    waves = SurveyWave.objects.order_by("code")
+    if codes:
+        waves = waves.filter(code__in=codes)
+    results = []
+    for wave in waves:
+        if wave.is_locked:
+            results.append(build_wave(wave.code, workers=workers, force=force, progress=progress))
+        else:
+            remove([wave.code])
+    return results
+
+
+# --- invalidation -------------------------------------------------------------
+
+def remove_manifest(code):
+    """Stop serving `code` (its files stay for the next incremental build). True if there was a manifest."""
+    _manifests.pop(code, None)
+    try:
+        os.remove(os.path.join(wave_dir(code), MANIFEST))
+        return True
+    except OSError:
+        return False
+
+
+def remove(codes):
+    """Delete everything stored for the waves `codes`."""
+    for code in codes:
+        remove_manifest(code)
+        shutil.rmtree(wave_dir(code), ignore_errors=True)
+
+
+def built_waves():
+    try:
+        return [d for d in os.listdir(root()) if os.path.exists(os.path.join(root(), d, MANIFEST))]
+    except OSError:
+        return []
+
+
+def _queue_rebuild(codes):
+    from . import jobs
+    from .models import SurveyWave
+
+    locked = list(SurveyWave.objects.filter(code__in=codes, is_locked=True).order_by("code").values_list("code", flat=True))
+    if locked:
+        jobs.enqueue("build_snapshots", {"waves": locked})
+
+
+def invalidate(scopes):
+    """
+    Drop the manifests `scopes` (DataVersion scopes just bumped) make stale and
+    queue a rebuild of those waves once the transaction commits. Returns the wave codes.
+    """
+    tables = {f"table:{name}" for name in TABLES}
+    if tables & set(scopes):
+        codes = built_waves()
+    else:
+        codes = [scope.split(":", 1)[1] for scope in scopes if scope.startswith("wave:")]
+    removed = [code for code in codes if remove_manifest(code)]
+    if removed:
+        transaction.on_commit(lambda: _queue_rebuild(removed))
+    return removed
+
+
+# --- serving --------------------------------------------------------------------
+
+_manifests = {}  # wave code -> (manifest mtime, manifest)
+
+
+def cached_manifest(code):
+    """The manifest of `code`, re-read only when the file changed; None when there is none."""
+    try:
+        mtime = os.stat(os.path.join(wave_dir(code), MANIFEST)).st_mtime_ns
+    except OSError:
+        _manifests.pop(code, None)
+        return None
+    cached = _manifests.get(code)
+    if cached is None or cached[0] != mtime:
+        manifest = read_manifest(code)
+        if manifest is None:
+            return None
+        cached = _manifests[code] = (mtime, manifest)
+    return cached[1]
+
+
+def _wants_json(accept):
+    types = [part.split(";")[0].strip() for part in accept.split(",") if part.strip()]
+    return not types or ("text/html" not in types and any(t in ("application/json", "application/*", "*/*") for t in types))
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(","):
+        name, _, q = part.strip().partition(";")
+        if q.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def lookup(request):
+    """(manifest, entry, resolver match) of the snapshot answering `request`, or None."""
+    if request.method not in ("GET", "HEAD"):
+        return None
+    wave = request.GET.get("wave") or request.GET.get("wave_code")
+    if not wave or any(len(values) > 1 for _, values in request.GET.lists()):
+        return None
+    if not _wants_json(request.META.get("HTTP_ACCEPT", "")):
+        return None
+    manifest = cached_manifest(wave)
+    if manifest is None:
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    if match.kwargs or not match.url_name:
+        return None
+    name = ALIASES.get(match.url_name, match.url_name)
+    entry = manifest["files"].get(snapshot_key(name, request.GET.dict()))
+    return (manifest, entry, match) if entry else None
+
+
+def serve(request, manifest, entry):
+    from .cache import cache_headers, not_modified
+
+    digest = entry["hash"]
+    accepted = _accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    encoding, suffix = next(((e, s) for e, s in ENCODINGS if e in entry["encodings"] and e in accepted), (None, ""))
+    etag = quote_etag(f"{digest}-{encoding}" if encoding else digest)
+    last_modified = datetime.fromisoformat(manifest["built_at"])
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        with open(os.path.join(wave_dir(manifest["wave"]), f"{digest}.json{suffix}"), "rb") as f:
+            response = HttpResponse(f.read(), content_type=entry["content_type"])
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["X-Cache"] = "SNAPSHOT"
+    cache_headers(response, etag, last_modified, locked=True)
+    response["Vary"] = "Accept, Accept-Encoding"
+    return response
+
+
+class SnapshotMiddleware:
+    """Answers requests covered by a wave snapshot from disk, before any view (or query) runs."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "SNAPSHOTS_ENABLED", True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def snapshot(self, request):
+        found = lookup(request) if self.enabled else None
+        if found is None:
+            return None
+        manifest, entry, match = found
+        try:
+            response = serve(request, manifest, entry)
+        except OSError:
+            return None  # pruned by a concurrent build: let the view answer
+        request.resolver_match = match
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.snapshot(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.snapshot(request) or await self.get_response(request)
@@ -0,0 +1,178 @@
+"""
+Point-in-district lookup.
+
+`SpatialIndex` packs the full-resolution City/Region polygons into an STR
+(sort-tile-recursive) bounding-box tree. A batch of points descends the tree
+as NumPy index arrays, so every node only tests the points inside its box, and
+each leaf polygon runs a vectorized even-odd ray test over its remaining
+points (holes and multipolygons included).
+
+The process-wide index is built on first use and rebuilt when the city or
+region table's DataVersion moves (every feature save bumps it), so all worker
+processes follow edits. Oblast outlines (City.is_oblast) only answer when no
+district contains the point.
+"""
+import math
+
+import numpy as np
+
+from .cache import table_scope
+from .geometry import iter_polygons, parse_feature
+from .models import City, DataVersion, Region
+
+NODE_CAPACITY = 16
+EDGE_CHUNK = 2_000_000  # points × edges per vectorized block
+
+
+class Leaf:
+    __slots__ = ("owner", "bbox", "edges")
+
+    def __init__(self, owner, polygon):
+        self.owner = owner
+        rings = [np.asarray([p[:2] for p in ring], dtype=np.float64) for ring in polygon if len(ring) >= 3]
+        self.bbox = _box(np.concatenate(rings)) if rings else None
+        # every ring as closed edges (x1, y1, x2, y2); even-odd over all rings handles holes
+        self.edges = np.concatenate([np.hstack([r, np.roll(r, -1, axis=0)]) for r in rings]) if rings else None
+
+    def contains(self, x, y):
+        x1, y1, x2, y2 = (self.edges[:, i] for i in range(4))
+        inside = np.zeros(len(x), dtype=bool)
+        step = max(1, EDGE_CHUNK // max(1, len(self.edges)))
+        for start in range(0, len(x), step):
+            px, py = x[start:start + step, None], y[start:start + step, None]
+            crosses = (y1 > py) != (y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                at = (x2 - x1) * (py - y1) / (y2 - y1) + x1
+            inside[start:start + step] = np.count_nonzero(crosses & (px < at), axis=1) % 2 == 1
+        return inside
+
+
+class Node:
+    __slots__ = ("bbox", "children", "leaves")
+
+    def __init__(self, children=None, leaves=None):
+        self.children = children or []
+        self.leaves = leaves or []
+        items = self.children or self.leaves
+        self.bbox = (
+            min(i.bbox[0] for i in items), min(i.bbox[1] for i in items),
+            max(i.bbox[2] for i in items), max(i.bbox[3] for i in items),
+        )
+
+
+def _box(points):
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+
+def _str_pack(items, capacity=NODE_CAPACITY):
+    """Sort-tile-recursive grouping of items (anything with .bbox) into runs of `capacity`."""
+    slices = max(1, math.ceil(math.sqrt(math.ceil(len(items) / capacity))))
+    per_slice = slices * capacity
+    by_x = sorted(items, key=lambda i: i.bbox[0] + i.bbox[2])
+    groups = []
+    for s in range(0, len(by_x), per_slice):
+        by_y = sorted(by_x[s:s + per_slice], key=lambda i: i.bbox[1] + i.bbox[3])
+        groups += [by_y[g:g + capacity] for g in range(0, len(by_y), capacity)]
+    return groups
+
+
+def build_tree(leaves):
+    if not leaves:
+        return None
+    nodes = [Node(leaves=group) for group in _str_pack(leaves)]
+    while len(nodes) > 1:
+        nodes = [Node(children=group) for group in _str_pack(nodes)]
+    return nodes[0]
+
+
+class SpatialIndex:
+    """
+    owners: (key, geojson) pairs. `locate(lons, lats)` returns, per point, the key of
+    the first owner whose polygon contains it, or None.
+    """
+
+    def __init__(self, owners):
+        leaves = []
+        for key, geojson in owners:
+            for polygon in iter_polygons(geojson):
+                leaf = Leaf(key, polygon)
+                if leaf.bbox is not None:
+                    leaves.append(leaf)
+        self.size = len(leaves)
+        self.root = build_tree(leaves)
+
+    def locate(self, lons, lats):
+        x = np.asarray(lons, dtype=np.float64)
+        y = np.asarray(lats, dtype=np.float64)
+        found = np.full(len(x), None, dtype=object)
+        if self.root is not None and len(x):
+            self._descend(self.root, np.arange(len(x)), x, y, found)
+        return found.tolist()
+
+    def _descend(self, node, idx, x, y, found):
+        min_x, min_y, max_x, max_y = node.bbox
+        px, py = x[idx], y[idx]
+        idx = idx[(px >= min_x) & (px <= max_x) & (py >= min_y) & (py <= max_y)]
+        if not len(idx):
+            return
+        for child in node.children:
+            self._descend(child, idx, x, y, found)
+        for leaf in node.leaves:
+            lx0, ly0, lx1, ly1 = leaf.bbox
+            px, py = x[idx], y[idx]
+            candidates = idx[(px >= lx0) & (px <= lx1) & (py >= ly0) & (py <= ly1)]
+            candidates = candidates[np.equal(found[candidates], None)]
+            if len(candidates):
+                inside = leaf.contains(x[candidates], y[candidates])
+                found[candidates[inside]] = leaf.owner
+
+
+class DistrictIndex:
+    """City, oblast-outline and Region indexes plus each city's region slug."""
+
+    def __init__(self):
+        cities, oblasts = [], []
+        self.city_regions = {}
+        for slug, is_oblast, region_slug, feature in City.objects.values_list("slug", "is_oblast", "region__slug", "geometry__feature"):
+            (oblasts if is_oblast else cities).append((slug, parse_feature(feature)))
+            self.city_regions[slug] = region_slug
+        self.cities = SpatialIndex(cities)
+        self.oblasts = SpatialIndex(oblasts)
+        self.regions = SpatialIndex(
+            (slug, parse_feature(feature))
+            for slug, feature in Region.objects.exclude(geometry=None).values_list("slug", "geometry__feature")
+        )
+
+    def locate(self, lons, lats):
+        """[{"city": slug|None, "region": slug|None}, ...]"""
+        cities = self.cities.locate(lons, lats)
+        missing = [i for i, slug in enumerate(cities) if slug is None]
+        if missing:
+            oblasts = self.oblasts.locate([lons[i] for i in missing], [lats[i] for i in missing])
+            for i, slug in zip(missing, oblasts):
+                cities[i] = slug
+        regions = self.regions.locate(lons, lats) if self.regions.size else [None] * len(cities)
+        return [
+            {"city": city, "region": region or self.city_regions.get(city)}
+            for city, region in zip(cities, regions)
+        ]
+
+
+_index = {"version": None, "index": None}
+
+
+def get_index():
+    scopes = [table_scope(City), table_scope(Region)]
+    version = tuple(DataVersion.objects.filter(scope__in=scopes).order_by("scope").values_list("scope", "version"))
+    if _index["index"] is None or _index["version"] != version:
+        _index.update(version=version, index=DistrictIndex())
+    return _index["index"]
+
+
+def locate(points):
+    """points: [(lon, lat), ...] -> [{"city": slug|None, "region": slug|None}, ...]"""
+    if not points:
+        return []
+    lons, lats = zip(*((float(p[0]), float(p[1])) for p in points))
+    return get_index().locate(list(lons), list(lats))
+
@@ -0,0 +1,181 @@
+"""
+Synthetic survey data at production scale (see the `generate_data` command).
+
+Cities are copies of the real district outlines in city.json, translated
+side by side so every copy is a plausible oblast: one `is_oblast` outline
+plus its districts per copy, spread over the synthetic regions. Waves are
+consecutive quarters; every survey asks the same question codes in every
+wave, so time series line up. Option shares of a question sum to 100 per
+city and drift a little from wave to wave.
+
+Everything generated is tagged (wave label, "synthetic-" region slugs,
+"synthetic_" metric codes) so `clear()` removes it without touching real data.
+"""
+import json
+import math
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import bump_models
+from .geometry import bounding_box, parse_feature, rebuild_feature_levels, store_geometries
+from .ingest import CopyLoader, WaveLoader
+from .models import Region, City, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint
+
+LABEL = "synthetic"
+REGION_PREFIX = "synthetic-"
+METRIC_PREFIX = "synthetic_"
+CATEGORIES = ("media", "wellbeing", "economy", "security", "infrastructure", "services")
+OPTIONS = (
+    "Полностью согласен", "Скорее согласен", "Скорее не согласен", "Полностью не согласен",
+    "Затрудняюсь ответить", "Отказ от ответа", "Другое", "Не знаю",
+)
+
+
+def city_templates(path=None):
+    """[(slug, name, feature, is_oblast)] from city.json (the oblast outline last)."""
+    with open(path or settings.BASE_DIR / "city.json", encoding="utf-8") as f:
+        cities = json.load(f)
+    templates = [
+        (c["slug"], c["name"], parse_feature(c["feature"]), c["slug"].endswith("-oblast"))
+        for c in cities
+    ]
+    return sorted(templates, key=lambda t: t[3])
+
+
+def _shift(obj, dx, dy):
+    if isinstance(obj, dict):
+        return {k: (_shift_coords(v, dx, dy) if k == "coordinates" else _shift(v, dx, dy)) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_shift(v, dx, dy) for v in obj]
+    return obj
+
+
+def _shift_coords(coords, dx, dy):
+    if coords and isinstance(coords[0], (int, float)):
+        return [round(coords[0] + dx, 7), round(coords[1] + dy, 7), *coords[2:]]
+    return [_shift_coords(c, dx, dy) for c in coords]
+
+
+def quarter_codes(first, count):
+    year, quarter = int(first[:4]), int(first[-1])
+    codes = []
+    for _ in range(count):
+        codes.append(f"{year}Q{quarter}")
+        year, quarter = (year + 1, 1) if quarter == 4 else (year, quarter + 1)
+    return codes
+
+
+def questions_for(datapoints, waves, surveys, cities, options):
+    """Questions per survey needed for about `datapoints` rows."""
+    return max(1, math.ceil(datapoints / max(1, waves * surveys * cities * options)))
+
+
+def create_geography(regions=1, cities=20, levels=True, templates=None):
+    """
+    Create `regions` synthetic regions and `cities` district copies (plus one oblast
+    outline per copy of city.json). Returns [(city_slug, region_slug)] of the districts.
+    """
+    templates = templates or city_templates()
+    districts = [t for t in templates if not t[3]]
+    oblasts = [t for t in templates if t[3]]
+    boxes = [bounding_box(t[2]) for t in templates]
+    width = max(b[2] for b in boxes if b) - min(b[0] for b in boxes if b)
+    height = max(b[3] for b in boxes if b) - min(b[1] for b in boxes if b)
+    copies = math.ceil(cities / len(districts))
+    columns = max(1, math.ceil(math.sqrt(copies)))
+
+    region_objs = Region.objects.bulk_create([
+        Region(name=f"Синтетическая область {n + 1}", slug=f"{REGION_PREFIX}{n + 1}", sort_order=100 + n)
+        for n in range(regions)
+    ])
+    objs, features, created = [], [], []
+    for copy in range(copies):
+        dx, dy = (copy % columns) * width * 1.05, -(copy // columns) * height * 1.05
+        region = region_objs[copy % regions]
+        wanted = districts[:cities - copy * len(districts)] + oblasts
+        for n, (slug, name, feature, is_oblast) in enumerate(wanted):
+            city_slug = f"{REGION_PREFIX}{copy + 1}-{slug}"
+            objs.append(City(
+                region=region, name=f"{name} ({copy + 1})", slug=city_slug,
+                sort_order=-1 if is_oblast else n, is_oblast=is_oblast,
+            ))
+            features.append(_shift(feature, dx, dy))
+            if not is_oblast:
+                created.append((city_slug, region.slug))
+    for city, geometry in zip(objs, store_geometries(features)):
+        city.geometry = geometry
+    objs = City.objects.bulk_create(objs, batch_size=500)
+    if levels:
+        for city in objs:
+            rebuild_feature_levels(city)
+    bump_models(Region, City, FeatureLevel)
+    return created
+
+
+def datapoint_rows(districts, waves, surveys=3, questions=20, options=4, metrics=2, seed=42):
+    """Loader rows (see ingest.normalize) for every wave × survey × question × district × option."""
+    rnd = random.Random(seed)
+    labels = OPTIONS[:max(2, min(options, len(OPTIONS)))]
+    base = {}
+    for wave_index, wave in enumerate(waves):
+        for s in range(surveys):
+            for q in range(questions):
+                code = f"S{s + 1}Q{q + 1}"
+                for city_slug, region_slug in districts:
+                    key = (s, q, city_slug)
+                    if key not in base:
+                        base[key] = [rnd.gammavariate(2.0, 1.0) for _ in labels]
+                    weights = [max(0.01, w * rnd.uniform(0.85, 1.15)) for w in base[key]]
+                    total = sum(weights)
+                    for label, weight in zip(labels, weights):
+                        yield {
+                            "region_slug": region_slug, "city_slug": city_slug, "wave": wave,
+                            "survey": f"Синтетический опрос {s + 1}", "is_frontier": "1" if s % 2 else "",
+                            "question_code": code, "question": f"Синтетический вопрос {code}: оценка услуг и условий",
+                            "category": CATEGORIES[q % len(CATEGORIES)], "option": label,
+                            "metric_code": f"{METRIC_PREFIX}{q % metrics}", "metric": f"Синтетическая доля {q % metrics}",
+                            "value": round(weight * 100 / total, 2),
+                        }
+
+
+def generate(regions=1, cities=20, waves=4, surveys=3, questions=20, options=4, metrics=2, datapoints=None,
+             first_wave="2024Q1", seed=42, lock=False, levels=True, mode="auto", batch_size=20000, progress=None):
+    """
+    Create a synthetic dataset; `datapoints` (approximate total) overrides `questions`.
+    mode: "orm" | "copy" | "auto" (COPY on PostgreSQL). Returns the loader stats plus counts.
+    """
+    options = max(2, min(options, len(OPTIONS)))
+    if datapoints:
+        questions = questions_for(datapoints, waves, surveys, cities, options)
+    codes = quarter_codes(first_wave, waves)
+    taken = set(SurveyWave.objects.filter(code__in=codes).exclude(label=LABEL).values_list("code", flat=True))
+    if taken:
+        raise ValueError(f"Waves {', '.join(sorted(taken))} already hold real data; pick another first wave")
+
+    with transaction.atomic():
+        districts = create_geography(regions, cities, levels=levels)
+        SurveyWave.objects.bulk_create([SurveyWave(code=code, label=LABEL) for code in codes], ignore_conflicts=True)
+        if mode == "auto":
+            mode = "copy" if connection.vendor == "postgresql" else "orm"
+        loader_class = CopyLoader if mode == "copy" else WaveLoader
+        stats = loader_class(batch_size=batch_size, progress=progress).load(
+            datapoint_rows(districts, codes, surveys, questions, options, metrics, seed),
+        )
+        if lock:
+            for wave in SurveyWave.objects.filter(code__in=codes[:-1]):
+                wave.is_locked = True
+                wave.save()
+    return {**stats, "waves": len(codes), "cities": len(districts), "questions": questions * surveys}
+
+
+def clear():
+    """Delete every synthetic wave, region (with its cities) and metric. Returns deleted DataPoint count."""
+    with transaction.atomic():
+        datapoints = DataPoint.objects.filter(wave__label=LABEL).count()
+        SurveyWave.objects.filter(label=LABEL).delete()
+        Region.objects.filter(slug__startswith=REGION_PREFIX).delete()
+        Metric.objects.filter(code__startswith=METRIC_PREFIX).delete()
+        bump_models(Region, City, FeatureLevel, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint)
+    return datapoints
@@ -1,3 +1,1281 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import io
+import json
+import math
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.forms import modelform_factory
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import benchmark, geometry, jobs, profiling, routers, search, snapshots, spatial, synthetic, tiles
+from .api.fast import FastList, dumps
+from .api.serializers import CitySerializer, DataPointSerializer
+from .cache import bump_models, get_store
+from .columnar import float32
+from .cube import refresh_cube
+from .ingest import CopyLoader, WaveLoader, read_rows
+from .microdata import MicrodataStore, microdata_root, publish, write_wave
+from .geometry import TOLERANCES, count_points, pick_level, repair_geometry, ring_area, simplify_ring
+from .profiling import QueryBudgetMixin
+from .models import (
+    Region, City, Geometry, FeatureLevel, ChoroplethCell, SurveyWave, Survey, Question, AnswerOption, Metric, DataPoint, SeriesPoint,
+    Job,
+)
+from .search import stem
+from core.settings import database
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        get_store().clear()
+        self.client = APIClient()
+
+
+def admin_request():
+    request = RequestFactory().get("/")
+    request.user = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    return request
+
+
+def make_survey(questions=3, cities=("rudny", "arkalyk"), options=("Да", "Нет"), wave_code="2025Q3"):
+    region = Region.objects.create(name="Костанайская область", slug="kostanayskaya-oblast")
+    city_objs = [City.objects.create(region=region, name=slug.title(), slug=slug, feature={}) for slug in cities]
+    wave = SurveyWave.objects.create(code=wave_code)
+    survey = Survey.objects.create(title="Опрос", wave=wave)
+    metric = Metric.objects.create(code="share", name="Доля", unit="percent")
+    for i in range(questions):
+        q = Question.objects.create(survey=survey, code=f"Q{i}", text=f"Вопрос {i}", sort_order=i)
+        for j, label in enumerate(options):
+            opt = AnswerOption.objects.create(question=q, label=label, sort_order=j)
+            for k, city in enumerate(city_objs):
+                DataPoint.objects.create(
+                    wave=wave, city=city, question=q, option=opt, metric=metric, value=10 * (j + 1) + k,
+                )
+    return survey
+
+
+class QuestionGroupedTests(APITestCase):
+    def test_shape(self):
+        survey = make_survey(questions=1)
+        res = self.client.get("/api/questions/grouped/", {"wave": "2025Q3", "survey_id": survey.id})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), [{
+            "id": survey.questions.get().id,
+            "question": "Вопрос 0",
+            "category": "",
+            "metric_name": "Доля",
+            "metric_unit": "percent",
+            "city_values": [
+                {"city": "Rudny", "Да": 10.0, "Нет": 20.0},
+                {"city": "Arkalyk", "Да": 11.0, "Нет": 21.0},
+            ],
+        }])
+
+    def test_city_filter(self):
+        make_survey(questions=2)
+        res = self.client.get("/api/questions/grouped/", {"wave": "2025Q3", "city": "arkalyk"})
+        self.assertEqual([q["city_values"] for q in res.json()], [[{"city": "Arkalyk", "Да": 11.0, "Нет": 21.0}]] * 2)
+
+    def test_query_count_is_constant(self):
+        for n in (2, 40):
+            with self.subTest(questions=n):
+                survey = make_survey(questions=n, wave_code=f"W{n}")
+                # data versions + questions + datapoints
+                with self.assertNumQueries(3):
+                    res = self.client.get("/api/questions/grouped/", {"wave": f"W{n}", "survey_id": survey.id})
+                self.assertEqual(len(res.json()), n)
+                Region.objects.all().delete()
+
+
+def square_feature(n=400):
+    # a square ring with n points per side, so DP has plenty to drop
+    side = [i / n for i in range(n)]
+    ring = [[x, 0] for x in side] + [[1, y] for y in side] + [[1 - x, 1] for x in side] + [[0, 1 - y] for y in side]
+    ring.append(ring[0])
+    return {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+class FeatureLevelTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        region = Region.objects.create(name="Костанайская область", slug="kostanayskaya-oblast")
+        self.city = City.objects.create(region=region, name="Rudny", slug="rudny", feature=json.dumps(square_feature()))
+
+    def test_simplify_ring_keeps_corners(self):
+        ring = square_feature()["geometry"]["coordinates"][0]
+        self.assertEqual(sorted(map(tuple, simplify_ring(ring, 0.01))), sorted([(0, 0), (0, 0), (1, 0), (1, 1), (0, 1)]))
+
+    def test_levels_built_on_save(self):
+        levels = list(self.city.feature_levels.all())
+        self.assertEqual([lv.tolerance for lv in levels], list(TOLERANCES))
+        self.assertTrue(all(lv.points == 5 for lv in levels))
+
+        # unchanged feature: nothing is rebuilt
+        ids = {lv.id for lv in levels}
+        self.city.save()
+        self.assertEqual({lv.id for lv in self.city.feature_levels.all()}, ids)
+
+    def test_zoom_serves_parsed_level(self):
+        res = self.client.get("/api/cities/", {"zoom": 8})
+        feature = res.json()[0]["feature"]
+        self.assertIsInstance(feature, dict)
+        self.assertEqual(count_points(feature), 5)
+        self.assertEqual(feature, FeatureLevel.objects.get(city=self.city, tolerance=pick_level(360 / 256 / 2 ** 8)).feature)
+
+    def test_without_zoom_returns_stored_feature(self):
+        res = self.client.get("/api/cities/")
+        self.assertEqual(res.json()[0]["feature"], self.city.feature)
+
+    def test_bad_zoom(self):
+        self.assertEqual(self.client.get("/api/cities/", {"zoom": "x"}).status_code, 400)
+
+
+class GeometryStorageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=1)
+        self.city = City.objects.get(slug="rudny")
+        self.city.feature = json.dumps(square_feature(20))
+        self.city.save()
+
+    def test_non_map_queries_skip_geometry(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/datapoints/")
+            str(DataPoint.objects.select_related("city").first())
+        self.assertFalse([q["sql"] for q in queries if '"analytics_geometry"."feature"' in q["sql"]])
+        row = next(r for r in self.client.get("/api/datapoints/").json() if r["city"]["slug"] == "rudny")
+        self.assertEqual(row["city"]["geometry"], f"/api/geometry/{self.city.geometry.hash}.geojson")
+        self.assertNotIn("feature", row["city"])
+
+    def test_hashed_url(self):
+        geometry = self.city.geometry
+        cities = self.client.get("/api/cities/").json()
+        rudny = next(c for c in cities if c["slug"] == "rudny")
+        self.assertEqual(rudny["geometry"], f"/api/geometry/{geometry.hash}.geojson")
+        self.assertEqual(rudny["feature"], square_feature(20))
+        self.assertIsNone(next(c for c in cities if c["slug"] == "arkalyk")["geometry"])
+
+        response = self.client.get(rudny["geometry"])
+        self.assertEqual((response.json(), response["Content-Type"]), (square_feature(20), "application/geo+json"))
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.client.get(rudny["geometry"], headers={"if-none-match": response["ETag"]}).status_code, 304)
+        coarse = self.client.get(rudny["geometry"], {"zoom": 8}).json()
+        self.assertEqual(coarse, FeatureLevel.objects.get(city=self.city, tolerance=pick_level(360 / 256 / 2 ** 8)).feature)
+        self.assertEqual(self.client.get("/api/geometry/0123.geojson").status_code, 404)
+
+    def test_edits_store_new_rows_and_prune(self):
+        first = self.city.geometry_id
+        City.objects.create(region=self.city.region, name="Copy", slug="copy", feature=square_feature(20))
+        self.assertEqual(City.objects.get(slug="copy").geometry_id, first)  # same content, one row
+
+        self.city.feature["geometry"]["coordinates"][0][1] = [0.5, -0.1]
+        self.city.save()
+        self.assertNotEqual(self.city.geometry_id, first)
+        self.assertTrue(Geometry.objects.filter(pk=first).exists())  # still used by "copy"
+        City.objects.get(slug="copy").delete()
+        self.assertFalse(Geometry.objects.filter(pk=first).exists())
+
+        form = modelform_factory(City, form=site._registry[City].form, exclude=("geometry",))(
+            instance=self.city, data={"region": self.city.region_id, "name": "Rudny", "slug": "rudny",
+                                      "sort_order": 0, "feature": json.dumps(square_feature(5))},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(City.objects.get(slug="rudny").feature, square_feature(5))
+        self.assertEqual(Geometry.objects.count(), 1)
+
+
+class GeoJSONImportTests(TestCase):
+    BOWTIE = {"type": "Polygon", "coordinates": [[[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]]}
+
+    def test_repair(self):
+        # clockwise, unclosed, with a repeated point, a spike and 8-digit coordinates
+        ring = [[0, 0], [0, 1.00000004], [0, 1], [1, 1], [1, 2], [1, 1], [1, 0]]
+        repaired, fixes, errors = repair_geometry({"type": "Polygon", "coordinates": [ring]})
+        outer = repaired["coordinates"][0]
+        self.assertEqual(errors, [])
+        self.assertEqual(outer[0], outer[-1])
+        self.assertEqual(len(outer), 5)
+        self.assertGreater(ring_area(outer), 0)
+        self.assertEqual(dict(fixes), {"unclosed ring": 1, "repeated point": 1, "spike": 1, "winding order": 1})
+
+        repaired, fixes, errors = repair_geometry(self.BOWTIE)
+        self.assertEqual((repaired["type"], len(repaired["coordinates"]), fixes["self-intersection"]), ("MultiPolygon", 2, 1))
+        with mock.patch.object(geometry, "shapely", None):
+            repaired, fixes, errors = repair_geometry(self.BOWTIE)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("self-intersection", errors[0])
+
+        self.assertEqual(repair_geometry('{"type": "Polygon", "coordinates": [[[0, 0], [0, 0], [0, 0]]]}')[0], None)
+        self.assertIn("out of range", repair_geometry({"type": "Point", "coordinates": [200, 0]})[2][0])
+
+    def test_import_folder_and_collection(self):
+        folder = tempfile.mkdtemp()
+        for slug, feature in (("rudny", square_feature(5)), ("broken", "{not json"), ("kostanayskaya-oblast", square_feature(5))):
+            with open(os.path.join(folder, f"{slug}.geojson"), "w", encoding="utf-8") as f:
+                f.write(feature if isinstance(feature, str) else json.dumps(feature))
+        out = io.StringIO()
+        call_command("import_geojson", folder, region="kostanayskaya-oblast", workers=2, stdout=out)
+        self.assertIn("created=2, updated=0, outlines changed=2, skipped=1", out.getvalue())
+        rudny = City.objects.get(slug="rudny")
+        self.assertEqual((rudny.name, rudny.is_oblast, rudny.feature_levels.count()), ("Rudny", False, len(TOLERANCES)))
+        self.assertTrue(City.objects.get(slug="kostanayskaya-oblast").is_oblast)
+
+        collection = os.path.join(folder, "cities.json")
+        with open(collection, "w", encoding="utf-8") as f:
+            json.dump([{"slug": "rudny", "name": "Рудный г.а.", "sort_order": 3, "feature": json.dumps(square_feature(5))},
+                       {"slug": "arkalyk", "name": "Аркалык", "feature": {"type": "Polygon", "coordinates": [[[2, 2], [3, 2], [3, 3], [2, 2]]]}}], f)
+        out = io.StringIO()
+        call_command("import_geojson", collection, region="kostanayskaya-oblast", workers=1, stdout=out)
+        self.assertIn("created=1, updated=1, outlines changed=1, skipped=0", out.getvalue())
+        self.assertEqual((City.objects.get(slug="rudny").name, City.objects.get(slug="rudny").sort_order), ("Рудный г.а.", 3))
+        with self.assertRaises(CommandError):
+            call_command("import_geojson", folder, region="kostanayskaya-oblast", strict=True, stdout=io.StringIO())
+
+
+@override_settings(TILE_CACHE_DIR=tempfile.mkdtemp())
+class TileTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        region = Region.objects.create(name="Костанайская область", slug="kostanayskaya-oblast")
+        # ~1°×1° square around Kostanay
+        feature = square_feature()
+        feature["geometry"]["coordinates"][0] = [[63 + x, 53 + y] for x, y in feature["geometry"]["coordinates"][0]]
+        self.city = City.objects.create(region=region, name="Rudny", slug="rudny", feature=feature)
+        self.z, self.x, self.y = 6, 43, 20
+
+    def test_tile(self):
+        res = self.client.get(f"/api/tiles/{self.z}/{self.x}/{self.y}.mvt")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], tiles.CONTENT_TYPE)
+        self.assertIn(b"cities", res.content)
+        self.assertIn(b"rudny", res.content)
+        self.assertTrue(os.path.exists(tiles.cache_path(self.z, self.x, self.y)))
+
+    def test_empty_and_out_of_range(self):
+        self.assertEqual(self.client.get("/api/tiles/6/0/0.mvt").content, b"")
+        self.assertEqual(self.client.get("/api/tiles/2/4/0.mvt").status_code, 404)
+
+    def test_unknown_codes_write_nothing(self):
+        Metric.objects.create(code="share", name="Доля")
+        SurveyWave.objects.create(code="2025Q3")
+        url = f"/api/tiles/{self.z}/{self.x}/{self.y}.mvt"
+        for params in ({"metric": "../../escaped", "wave": "2025Q3"}, {"metric": "share", "wave": "../w"}, {"metric": "nope"}):
+            self.assertEqual(self.client.get(url, params).status_code, 404, params)
+        self.assertFalse(os.path.exists(os.path.normpath(os.path.join(tiles.cache_root(), "../../escaped"))))
+        self.assertLessEqual(set(os.listdir(tiles.cache_root())) if os.path.isdir(tiles.cache_root()) else set(), {"_"})
+        self.assertEqual(self.client.get(url, {"metric": "share", "wave": "2025Q3"}).status_code, 200)
+        path = tiles.cache_path(self.z, self.x, self.y, "a/../b", "../c")
+        self.assertEqual(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(path)))), os.path.join(tiles.cache_root(), "a%2F..%2Fb"))
+
+    def test_cache_invalidated_on_feature_change(self):
+        tiles.get_tile(self.z, self.x, self.y)
+        path = tiles.cache_path(self.z, self.x, self.y)
+        self.assertTrue(os.path.exists(path))
+        self.city.feature["geometry"]["coordinates"][0][1] = [63.5, 52.9]
+        self.city.save()
+        self.assertFalse(os.path.exists(path))
+
+    def test_value_tiles_invalidated_per_wave(self):
+        wave, other = SurveyWave.objects.create(code="2025Q3"), SurveyWave.objects.create(code="2025Q4")
+        dp = DataPoint.objects.create(wave=wave, city=self.city, metric=Metric.objects.create(code="share", name="Доля"), value=1)
+        paths = [tiles.cache_path(self.z, self.x, self.y, "share", code) for code in ("2025Q3", "2025Q4")]
+
+        def cached(*flags):
+            for path, flag in zip(paths, flags):
+                if flag:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    open(path, "wb").close()
+            return [os.path.exists(path) for path in paths]
+
+        cached(True, True)
+        dp.value = 99
+        dp.save()
+        self.assertEqual(cached(), [False, True])
+
+        cached(True)
+        dp.wave = other
+        dp.save()
+        self.assertEqual(cached(), [False, False])
+
+        cached(True, True)
+        WaveLoader().load([{"wave": "2025Q4", "survey": "Опрос", "metric": "Индекс", "value": 1}])
+        self.assertEqual(cached(), [True, False])
+
+
+class ChoroplethCubeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.survey = make_survey(questions=2)
+        self.metric = Metric.objects.get()
+
+    def get(self, **params):
+        return self.client.get("/api/choropleth", {"wave": "2025Q3", **params}).json()
+
+    def test_incremental_refresh(self):
+        # rudny: 10, 20 per question; arkalyk: 11, 21
+        self.assertEqual(self.get(metric="share"), [{"slug": "arkalyk", "value": 16.0}, {"slug": "rudny", "value": 15.0}])
+
+        dp = DataPoint.objects.filter(city__slug="rudny").first()
+        dp.value = 30
+        dp.save()
+        self.assertEqual(self.get(metric="share")[1], {"slug": "rudny", "value": 20.0})
+
+        DataPoint.objects.filter(city__slug="arkalyk").delete()
+        self.assertEqual([row["slug"] for row in self.get(metric="share")], ["rudny"])
+
+    def test_rebuild_matches_incremental(self):
+        before = sorted(ChoroplethCell.objects.values_list("level", "slug", "count", "average"))
+        ChoroplethCell.objects.all().delete()
+        refresh_cube()
+        self.assertEqual(sorted(ChoroplethCell.objects.values_list("level", "slug", "count", "average")), before)
+
+    def test_several_metrics_and_stats(self):
+        other = Metric.objects.create(code="other", name="Другое")
+        DataPoint.objects.create(wave=self.survey.wave, city=City.objects.get(slug="rudny"), metric=other, value=5)
+        with self.assertNumQueries(2):
+            data = self.get(metric="share,other", stats="1")
+        self.assertEqual(data["other"], [{"slug": "rudny", "value": 5.0, "count": 1, "sum": 5.0, "min": 5.0, "max": 5.0}])
+        self.assertEqual(len(data["share"]), 2)
+
+
+class WeightedRollupTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=1)  # Да: rudny 10, arkalyk 11
+        DataPoint.objects.filter(city__slug="rudny").update(extra={"base": 100})
+        DataPoint.objects.filter(city__slug="arkalyk").update(extra={"base": 300})
+
+    def get(self, url="/api/choropleth", **params):
+        return self.client.get(url, {"metric": "share", "wave": "2025Q3", "weighted": "1", "option": "Да", **params})
+
+    def test_city_interval(self):
+        rudny = self.get().json()[1]
+        moe = NormalDist().inv_cdf(0.975) * math.sqrt(0.1 * 0.9 / 100) * 100
+        self.assertEqual(rudny["slug"], "rudny")
+        self.assertEqual(rudny["n"], 100.0)
+        self.assertAlmostEqual(rudny["moe"], moe, places=3)
+        self.assertAlmostEqual(rudny["low"], 10 - moe, places=3)
+        narrow = self.get(confidence="0.8").json()[1]
+        self.assertLess(narrow["moe"], rudny["moe"])
+
+    def test_region_is_size_weighted(self):
+        region = self.get(level="region").json()
+        variance = (100 * 0.1 * 0.9 + 300 * 0.11 * 0.89) / 400 ** 2
+        self.assertEqual([row["slug"] for row in region], ["kostanayskaya-oblast"])
+        self.assertAlmostEqual(region[0]["value"], 10.75)  # the plain mean of the cities is 10.5
+        self.assertEqual(region[0]["n"], 400.0)
+        self.assertAlmostEqual(region[0]["moe"], NormalDist().inv_cdf(0.975) * math.sqrt(variance) * 100, places=3)
+
+    def test_unknown_sizes_and_errors(self):
+        DataPoint.objects.update(extra=None)
+        region = self.get(level="region").json()[0]
+        self.assertEqual((region["value"], region["n"], region["moe"]), (10.5, None, None))
+        self.assertEqual(self.get(confidence="1.5").status_code, 400)
+        self.assertEqual(self.get(url="/api/async/choropleth").content, self.get().content)
+
+    def test_columns(self):
+        table = self.get(level="region", format="columns").json()
+        self.assertEqual(list(table["columns"]), ["metric", "slug", "value", "n", "moe", "low", "high"])
+        self.assertEqual(table["columns"]["n"], [400.0])
+
+
+class ResponseCacheTests(APITestCase):
+    url = "/api/questions/grouped/"
+
+    def setUp(self):
+        super().setUp()
+        self.survey = make_survey(questions=2)
+        self.params = {"wave": "2025Q3", "survey_id": self.survey.id}
+
+    def test_conditional_get(self):
+        first = self.client.get(self.url, self.params)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(first["Cache-Control"], "no-cache")
+
+        with self.assertNumQueries(1):
+            again = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        with self.assertNumQueries(1):
+            hit = self.client.get(self.url, self.params)
+        self.assertEqual(hit["X-Cache"], "HIT")
+        self.assertEqual(hit.content, first.content)
+
+    def test_write_changes_etag(self):
+        first = self.client.get(self.url, self.params)
+        dp = DataPoint.objects.first()
+        dp.value = 99
+        dp.save()
+        res = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res["ETag"], first["ETag"])
+
+    def test_other_wave_keeps_etag(self):
+        first = self.client.get(self.url, self.params)
+        other = SurveyWave.objects.create(code="2025Q4")
+        etag = self.client.get(self.url, self.params)["ETag"]
+        self.assertNotEqual(etag, first["ETag"])  # the SurveyWave table changed
+        DataPoint.objects.create(wave=other, city=City.objects.first(), metric=Metric.objects.get(), value=1)
+        self.assertEqual(self.client.get(self.url, self.params)["ETag"], etag)
+
+    def test_locked_wave_is_immutable(self):
+        site._registry[SurveyWave].lock_waves(admin_request(), SurveyWave.objects.filter(code="2025Q3"))
+        res = self.client.get(self.url, self.params)
+        self.assertIn("immutable", res["Cache-Control"])
+
+
+class LoadWaveTests(TestCase):
+    def write(self, name, content):
+        path = os.path.join(tempfile.mkdtemp(), name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_json_matches_t1_shape_and_reloads_in_place(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data.json")
+        stats = WaveLoader(batch_size=1).load(read_rows(path))
+        self.assertEqual((stats["created"], stats["updated"]), (2, 0))
+        dp = DataPoint.objects.get(city__name="Аулиекольский")
+        self.assertEqual((dp.wave.code, dp.metric.unit, dp.question.category, float(dp.value)), ("2025Q3", "percent", "ops", 82.4))
+
+        stats = WaveLoader().load(read_rows(path))
+        self.assertEqual((stats["created"], stats["updated"]), (0, 2))
+        self.assertEqual(DataPoint.objects.count(), 2)
+        self.assertEqual(ChoroplethCell.objects.filter(level="city").count(), 2)
+        self.assertEqual(list(Region.objects.values_list("slug", flat=True)), ["kostanayskaya-oblast"])
+
+    def test_rows_without_region_slug_join_the_oblast(self):
+        region = Region.objects.create(name="Kostanayskaya Oblast", slug="kostanayskaya-oblast")  # as import_geojson names it
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data.json")
+        WaveLoader().load(read_rows(path))
+        self.assertEqual(list(Region.objects.all()), [region])
+        self.assertEqual(set(City.objects.values_list("region_id", flat=True)), {region.id})
+
+    def test_other_regions_get_their_own_slug(self):
+        path = self.write("wave.jsonl", "\n".join(json.dumps(row, ensure_ascii=False) for row in [
+            {"region": region, "city": city, "wave": "2025Q3", "survey": "Опрос", "metric": "Индекс", "value": 1}
+            for region, city in (("Костанайская область", "Рудный"), ("Акмолинская область", "Кокшетау"))
+        ]))
+        WaveLoader().load(read_rows(path))
+        self.assertEqual(sorted(City.objects.values_list("name", "region__slug")),
+                         [("Кокшетау", "akmolinskaya-oblast"), ("Рудный", "kostanayskaya-oblast")])
+
+    def test_csv_with_options(self):
+        path = self.write("wave.csv", (
+            "region,region_slug,city,city_slug,wave,survey,question_code,question,option,metric_code,metric,value\n"
+            "Костанайская область,kostanayskaya-oblast,Рудный,rudny,2025Q4,Опрос,Q1,Вопрос,Да,share,Доля,\"55,5\"\n"
+            "Костанайская область,kostanayskaya-oblast,Рудный,rudny,2025Q4,Опрос,Q1,Вопрос,Нет,share,Доля,44.5\n"
+            "Костанайская область,kostanayskaya-oblast,Рудный,rudny,2025Q4,Опрос,Q1,Вопрос,Нет,share,Доля,\n"
+        ))
+        stats = WaveLoader().load(read_rows(path))
+        self.assertEqual((stats["rows"], stats["created"], stats["skipped"]), (3, 2, 1))
+        self.assertEqual(
+            sorted(DataPoint.objects.values_list("option__label", "value")),
+            [("Да", Decimal("55.50")), ("Нет", Decimal("44.50"))],
+        )
+
+    def test_copy_loader_merges_like_orm_loader(self):
+        path = self.write("wave.jsonl", "\n".join(json.dumps(row, ensure_ascii=False) for row in [
+            {"region": "Костанайская область", "city": "Рудный", "wave": "2025Q3", "survey": "Опрос",
+             "question": "Вопрос", "option": option, "metric": "Доля", "value": value}
+            for option, value in (("Да", 60), ("Нет", 40), ("Да", 65))
+        ]))
+        stats = CopyLoader().load(read_rows(path))
+        self.assertEqual((stats["rows"], stats["created"]), (3, 2))
+        self.assertEqual(sorted(DataPoint.objects.values_list("option__label", "value")),
+                         [("Да", Decimal("65.00")), ("Нет", Decimal("40.00"))])
+
+        stats = CopyLoader().load(read_rows(path))
+        self.assertEqual((stats["created"], stats["updated"]), (0, 2))
+        self.assertEqual(DataPoint.objects.count(), 2)
+        self.assertEqual(ChoroplethCell.objects.get(level="city").average, 52.5)
+
+    def test_copy_loader_matches_rows_with_null_keys(self):
+        rows = [
+            {"region": "Костанайская область", "wave": "2025Q3", "survey": "Опрос", "metric": "Индекс", "value": 7},
+            {"region": "Костанайская область", "city": "Рудный", "wave": "2025Q3", "survey": "Опрос",
+             "metric": "Индекс", "value": 8},
+        ]
+        path = self.write("wave.jsonl", "\n".join(json.dumps(row, ensure_ascii=False) for row in rows))
+        self.assertEqual(CopyLoader().load(read_rows(path))["created"], 2)
+        stats = CopyLoader().load(read_rows(path))
+        self.assertEqual((stats["created"], stats["updated"]), (0, 2))
+        self.assertEqual(list(DataPoint.objects.order_by("value").values_list("city__name", "value")),
+                         [(None, Decimal("7.00")), ("Рудный", Decimal("8.00"))])
+
+
+class DataPointExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=3)  # 12 datapoints
+
+    def test_cursor_pages(self):
+        self.assertIsInstance(self.client.get("/api/datapoints/").json(), list)
+
+        seen, url, params = [], "/api/datapoints/", {"page_size": 5, "wave_code": "2025Q3"}
+        while url:
+            page = self.client.get(url, params).json()
+            seen += [row["id"] for row in page["results"]]
+            url, params = page["next"], None
+        self.assertEqual(seen, sorted(DataPoint.objects.values_list("id", flat=True)))
+        self.assertEqual(set(page["results"][0]), {
+            "id", "wave_code", "region_slug", "city_slug", "question_id", "option_id", "metric_code", "value", "extra",
+        })
+
+    def test_ndjson_export(self):
+        res = self.client.get("/api/datapoints/export/", {"wave_code": "2025Q3"})
+        self.assertTrue(res.streaming)
+        rows = [json.loads(line) for line in b"".join(res.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertEqual((rows[0]["wave_code"], rows[0]["city_slug"], rows[0]["value"]), ("2025Q3", "rudny", "10.00"))
+
+    def test_csv_export(self):
+        res = self.client.get("/api/datapoints/export/", {"format": "csv"})
+        self.assertEqual(res["Content-Type"], "text/csv; charset=utf-8")
+        lines = b"".join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,wave_code,region_slug,city_slug,question_id,option_id,metric_code,value,extra")
+        self.assertEqual(len(lines), 13)
+
+
+class ColumnarFormatTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=2)
+
+    def test_datapoint_columns(self):
+        res = self.client.get("/api/datapoints/", {"wave_code": "2025Q3"}, HTTP_ACCEPT="application/vnd.kostanay.columns+json")
+        self.assertEqual(res["Content-Type"], "application/vnd.kostanay.columns+json")
+        table = json.loads(res.content)
+        self.assertEqual(table["length"], 8)
+        self.assertEqual(table["dictionaries"]["city_slug"], ["rudny", "arkalyk"])
+        self.assertEqual(table["dictionaries"]["option_label"], ["Да", "Нет"])
+        self.assertEqual(table["columns"]["city_slug"][:2], [0, 1])
+        self.assertEqual(table["columns"]["region_slug"], [None] * 8)
+        self.assertEqual(table["columns"]["value"][:4], [10.0, 11.0, 20.0, 21.0])
+        self.assertEqual(table["columns"]["id"], sorted(DataPoint.objects.values_list("id", flat=True)))
+
+    def test_choropleth_columns(self):
+        table = self.client.get("/api/choropleth", {"metric": "share", "wave": "2025Q3", "format": "columns"}).json()
+        self.assertEqual(table["dictionaries"], {"metric": ["share"], "slug": ["arkalyk", "rudny"]})
+        self.assertEqual(table["columns"]["value"], [16.0, 15.0])
+        self.assertEqual(table["columns"]["count"], [4, 4])
+
+    def test_float32_values(self):
+        self.assertEqual(float32([Decimal("55.20"), None, 0.1]), [55.2, None, 0.1])
+
+
+class FastListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=2)
+        rudny = City.objects.get(slug="rudny")
+        rudny.feature = json.dumps(square_feature(20))
+        rudny.save()
+        wave = SurveyWave.objects.get()
+        wave.starts_at = date(2025, 7, 1)
+        wave.save()
+        DataPoint.objects.filter(pk=DataPoint.objects.first().pk).update(
+            region=rudny.region, value=Decimal("3.5"), extra={"note": "строка\u2028перенос", "n": 1.25},
+        )
+
+    def assertSameJSON(self, serializer_class, qs, context=None):
+        expected = JSONRenderer().render(serializer_class(qs, many=True, context=context or {}).data)
+        self.assertEqual(dumps(FastList(serializer_class, context).data(qs)), expected)
+        return expected
+
+    def test_datapoints_match_serializer(self):
+        expected = self.assertSameJSON(DataPointSerializer, DataPoint.objects.order_by("id"))
+        self.assertIn(b'"value":"3.50"', expected)
+        self.assertIn(b"\\u2028", expected)
+        self.assertEqual(self.client.get("/api/datapoints/").content, expected)
+
+    def test_cities_match_serializer_at_every_level(self):
+        City.objects.create(region=Region.objects.get(), name="Lisakovsk", slug="lisakovsk", feature=square_feature(5))
+        FeatureLevel.objects.filter(city__slug="lisakovsk", tolerance=TOLERANCES[1]).delete()
+        qs = City.objects.select_related("region").prefetch_related("feature_levels", "region__feature_levels")
+        for level in (None, 0, TOLERANCES[1]):
+            self.assertSameJSON(CitySerializer, qs.order_by("id"), {"feature_level": level})
+
+    def test_stdlib_fallback(self):
+        data = FastList(DataPointSerializer).data(DataPoint.objects.order_by("id"))
+        with mock.patch("analytics.api.fast.orjson", None):
+            fallback = dumps(data)
+        self.assertEqual(fallback, dumps(data))
+
+    def test_ints_beyond_64_bits(self):
+        DataPoint.objects.filter(pk=DataPoint.objects.first().pk).update(extra={"id": 2**70})
+        res = self.client.get("/api/datapoints/")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[0]["extra"], {"id": 2**70})
+
+
+class QuestionSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        survey = make_survey(questions=0)
+        for i, text in enumerate((
+            "Откуда вы узнаёте новости? Интернет, телевидение, радио",
+            "Как часто вы пользуетесь интернетом?",
+            "Доверяете ли вы городским властям?",
+        )):
+            Question.objects.create(survey=survey, code=f"M{i}", text=text, category="media", sort_order=i)
+
+    def search(self, **params):
+        return self.client.get("/api/questions/search/", params).json()
+
+    def test_stemmer(self):
+        self.assertEqual([stem(w) for w in ("интернетом", "новостей", "городским", "важнейший", "прочитав")],
+                         ["интернет", "новост", "городск", "важн", "прочита"])
+
+    def test_morphology_ranking_and_highlight(self):
+        data = self.search(q="интернет")
+        self.assertEqual(data["mode"], "fulltext")
+        self.assertEqual(data["count"], 2)
+        self.assertEqual({hit["code"] for hit in data["results"]}, {"M0", "M1"})
+        self.assertIn("<mark>интернетом</mark>", data["results"][1]["highlight"] + data["results"][0]["highlight"])
+
+        # stop words are ignored, every other word must match
+        self.assertEqual([hit["code"] for hit in self.search(q="новостей из интернета")["results"]], ["M0"])
+
+    def test_trigram_fallback_and_limit(self):
+        data = self.search(q="интирнет", limit=1)
+        self.assertEqual((data["mode"], data["count"], len(data["results"])), ("trigram", 2, 1))
+        second = self.search(q="интирнет", limit=1, offset=1)["results"]
+        self.assertEqual({data["results"][0]["code"], second[0]["code"]}, {"M0", "M1"})
+
+    def test_index_follows_edits(self):
+        self.assertEqual(self.search(q="погода")["count"], 0)
+        Question.objects.create(survey=Survey.objects.get(), code="W", text="Какая погода в городе?", sort_order=9)
+        self.assertEqual([hit["code"] for hit in self.search(q="погоду")["results"]], ["W"])
+
+    def test_list_q_filter(self):
+        codes = [q["code"] for q in self.client.get("/api/questions/", {"q": "властей"}).json()]
+        self.assertEqual(codes, ["M2"])
+
+    def test_list_q_returns_every_match_in_rank_order(self):
+        survey = Survey.objects.get()
+        Question.objects.bulk_create(
+            Question(survey=survey, code=f"P{i}", text=f"Погода {i}", sort_order=100 + i) for i in range(search.MAX_LIMIT + 5)
+        )
+        Question.objects.create(survey=survey, code="PP", text="Погода, погода и погода", sort_order=999)
+        bump_models(Question)
+        codes = [q["code"] for q in self.client.get("/api/questions/", {"q": "погода"}).json()]
+        self.assertEqual(len(codes), search.MAX_LIMIT + 6)
+        self.assertEqual(codes[0], "PP")
+        self.assertEqual(codes, [hit["code"] for hit in self.search(q="погода", limit=search.MAX_LIMIT)["results"]] + codes[search.MAX_LIMIT:])
+
+    def test_highlight_escapes_question_text(self):
+        Question.objects.create(survey=Survey.objects.get(), code="X", text="<b>Интернет</b> & <script>", sort_order=9)
+        hit = next(hit for hit in self.search(q="интернет")["results"] if hit["code"] == "X")
+        self.assertEqual(hit["highlight"], "&lt;b&gt;<mark>Интернет</mark>&lt;/b&gt; &amp; &lt;script&gt;")
+
+
+class TimeSeriesTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=1)  # 2025Q3: rudny Да=10 Нет=20, arkalyk Да=11 Нет=21
+        metric, rudny = Metric.objects.get(), City.objects.get(slug="rudny")
+        for code, value in (("2025Q4", 30), ("2026Q1", 50), ("2025M07", 5)):
+            wave = SurveyWave.objects.create(code=code)
+            q = Question.objects.create(survey=Survey.objects.create(title="Опрос", wave=wave), code="Q0", text="Вопрос")
+            DataPoint.objects.create(
+                wave=wave, city=rudny, question=q, option=AnswerOption.objects.create(question=q, label="Да"),
+                metric=metric, value=value,
+            )
+
+    def lock(self, *codes, locked=True):
+        for wave in SurveyWave.objects.filter(code__in=codes):
+            wave.is_locked = locked
+            wave.save()
+
+    def get(self, **params):
+        return self.client.get("/api/timeseries", params).json()
+
+    def test_only_locked_waves_with_deltas(self):
+        self.assertEqual(self.get(metric="share")["series"], [])
+        self.lock("2025Q3", "2025Q4", "2025M07")
+
+        data = self.get(metric="share", city="rudny", cadence="quarter")
+        self.assertEqual(data["waves"], ["2025Q3", "2025Q4"])
+        points = data["series"][0]["points"]
+        self.assertEqual([(p["wave"], p["value"], p["delta"]) for p in points], [("2025Q3", 15.0, None), ("2025Q4", 30.0, 15.0)])
+        self.assertEqual(points[1]["rolling"], 22.5)
+
+        # the monthly wave is its own series, not a delta against the quarters
+        monthly = self.get(metric="share", city="rudny", cadence="month")["series"][0]["points"]
+        self.assertEqual([(p["wave"], p["delta"]) for p in monthly], [("2025M07", None)])
+
+    def test_question_option_series_and_out_of_order_lock(self):
+        self.lock("2025Q3", "2026Q1")
+        self.lock("2025Q4")  # lands between the two: 2026Q1's delta must follow
+        with self.assertNumQueries(2):  # versions + points
+            data = self.get(question="Q0", option="Да", city="rudny")
+        points = data["series"][0]["points"]
+        self.assertEqual([(p["wave"], p["value"], p["delta"]) for p in points],
+                         [("2025Q3", 10.0, None), ("2025Q4", 30.0, 20.0), ("2026Q1", 50.0, 20.0)])
+        self.assertEqual(points[2]["rolling"], 30.0)
+
+        self.lock("2025Q4", locked=False)
+        points = self.get(question="Q0", option="Да", city="rudny")["series"][0]["points"]
+        self.assertEqual([(p["wave"], p["delta"]) for p in points], [("2025Q3", None), ("2026Q1", 40.0)])
+
+    def test_metrics_without_code_are_separate_series(self):
+        # load_wave creates metrics from a name alone; codes are optional and not unique
+        wave, rudny = SurveyWave.objects.get(code="2025Q4"), City.objects.get(slug="rudny")
+        question = Question.objects.get(survey__wave=wave)
+        for name, value in (("Первый", 40), ("Второй", 60)):
+            DataPoint.objects.create(
+                wave=wave, city=rudny, question=question, option=question.options.get(), value=value,
+                metric=Metric.objects.create(name=name),
+            )
+        refresh_cube([wave])
+        self.lock("2025Q4")
+        self.assertEqual(
+            sorted(SeriesPoint.objects.filter(metric_code="", question_code="", level="city").values_list("value", flat=True)),
+            [40.0, 60.0],
+        )
+        self.assertEqual(len(self.get(question="Q0", option="Да", city="rudny")["series"]), 3)
+
+    def test_admin_lock_action(self):
+        admin = site._registry[SurveyWave]
+        admin.lock_waves(admin_request(), SurveyWave.objects.filter(code__in=["2025Q3", "2025Q4"]))
+        self.assertEqual(SeriesPoint.objects.filter(question_code="", level="city", slug="rudny").count(), 2)
+        self.assertEqual(self.client.get("/api/timeseries").status_code, 400)
+
+
+class LocateTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        region = Region.objects.create(name="Костанайская область", slug="kostanayskaya-oblast")
+
+        def square(x0, y0, size, hole=None):
+            rings = [[[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]]
+            if hole:
+                hx, hy, hs = hole
+                rings.append([[hx, hy], [hx, hy + hs], [hx + hs, hy + hs], [hx + hs, hy], [hx, hy]])
+            return {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": rings}}
+
+        City.objects.create(region=region, name="Oblast", slug="oblast", is_oblast=True, feature=square(0, 0, 10))
+        City.objects.create(region=region, name="Ring", slug="ring", feature=square(1, 1, 3, hole=(2, 2, 1)))
+        # a grid of small districts, so the tree has more than one level
+        for i in range(40):
+            City.objects.create(region=region, name=f"D{i}", slug=f"d{i}", feature=json.dumps(square(5 + i % 8 * 0.5, 5 + i // 8 * 0.5, 0.5)))
+
+    def test_python_api(self):
+        results = spatial.locate([(1.5, 1.5), (2.5, 2.5), (5.1, 5.1), (8.9, 7.4), (20, 20)])
+        self.assertEqual([r["city"] for r in results], ["ring", "oblast", "d0", "d39", None])
+        self.assertEqual(results[0]["region"], "kostanayskaya-oblast")
+        self.assertIsNone(results[4]["region"])
+
+    def test_batch_endpoint_and_rebuild(self):
+        rnd = random.Random(1)
+        points = [[rnd.uniform(5, 9), rnd.uniform(5, 7.5)] for _ in range(3000)]
+        res = self.client.post("/api/locate", {"points": points}, format="json")
+        expected = [f"d{int((y - 5) // 0.5) * 8 + int((x - 5) // 0.5)}" for x, y in points]
+        self.assertEqual([r["city"] for r in res.json()["results"]], expected)
+
+        City.objects.filter(slug="d0").delete()
+        Region.objects.get().save()  # any feature table write moves the version
+        self.assertEqual(self.client.get("/api/locate", {"lon": 5.1, "lat": 5.1}).json()["results"][0]["city"], "oblast")
+
+    def test_bad_points(self):
+        self.assertEqual(self.client.post("/api/locate", {"points": [[1]]}, format="json").status_code, 400)
+        self.assertEqual(self.client.post("/api/locate", {"points": "x"}, format="json").status_code, 400)
+
+
+class DataPointAdminTests(TestCase):
+    url = "/admin/analytics/datapoint/"
+
+    def setUp(self):
+        self.survey = make_survey(questions=3)  # 12 datapoints
+        self.client.force_login(User.objects.create(username="admin", is_staff=True, is_superuser=True))
+
+    def test_keyset_pages_and_flat_queries(self):
+        with mock.patch("analytics.admin.DataPointAdmin.list_per_page", 5):
+            with CaptureQueriesContext(connection) as first:
+                page = self.client.get(self.url)
+            self.assertEqual(page.context["cl"].result_count_label, "12")
+            ids = [dp.pk for dp in page.context["cl"].result_list]
+            self.assertEqual(ids, sorted(ids, reverse=True))
+            self.assertNotIn("OFFSET", " ".join(q["sql"] for q in first.captured_queries))
+            self.assertContains(page, f"?before={ids[-1]}")
+
+            last = self.client.get(self.url, {"before": ids[-1]})
+            self.assertEqual([dp.pk for dp in last.context["cl"].result_list][0], ids[-1] - 1)
+            other = Metric.objects.create(code="other", name="Другое")
+            DataPoint.objects.bulk_create([
+                DataPoint(wave=dp.wave, city=dp.city, question=dp.question, option=dp.option, metric=other, value=1)
+                for dp in DataPoint.objects.all()
+            ])
+            with CaptureQueriesContext(connection) as more:
+                self.client.get(self.url, {"before": ids[-1]})
+            self.assertEqual(len(more), len(first))
+
+    def test_autocomplete_filter(self):
+        question = self.survey.questions.first()
+        page = self.client.get(self.url, {"question__id__exact": question.id})
+        self.assertEqual({dp.question_id for dp in page.context["cl"].result_list}, {question.id})
+        self.assertContains(page, 'data-lookup="question__id__exact"')
+        self.assertContains(page, "admin-autocomplete")
+        regions = self.client.get("/admin/autocomplete/", {
+            "app_label": "analytics", "model_name": "city", "field_name": "region", "term": "Кост",
+        })
+        self.assertEqual([r["text"] for r in regions.json()["results"]], ["Костанайская область"])
+
+    def test_bulk_edit_values(self):
+        ids = list(DataPoint.objects.filter(city__slug="rudny").values_list("pk", flat=True))
+        response = self.client.post(self.url, {
+            "action": "edit_values", "_selected_action": ids, "operation": "add", "amount": "5",
+        }, follow=True)
+        self.assertContains(response, "Updated 6 values in 2025Q3/share")
+        self.assertEqual(
+            sorted(DataPoint.objects.filter(pk__in=ids).values_list("value", flat=True)),
+            [Decimal(v) for v in (15, 15, 15, 25, 25, 25)],
+        )
+        self.assertEqual(ChoroplethCell.objects.get(level="city", slug="rudny").average, 20.0)
+
+
+class JobTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+
+    def test_load_wave_job_reports_progress(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data.json")
+        job = jobs.enqueue("load_wave", {"path": path, "batch_size": 1})
+        call_command("run_workers", workers=1, once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.total, job.fraction), (Job.DONE, 2, 2, 1.0))
+        self.assertEqual(job.result["created"], 2)
+        self.assertEqual(job.attempts, 1)
+
+    def test_failure_retries_then_fails(self):
+        def broken(progress):
+            progress(1, 4, "first step", force=True)
+            raise RuntimeError("disk full")
+
+        with mock.patch.dict(jobs.TASKS, {"broken": broken}):
+            job = jobs.enqueue("broken", max_attempts=2)
+            jobs.work(once=True)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.fraction), (Job.QUEUED, 1, 0.25))
+            self.assertIn("disk full", job.error)
+            self.assertGreater(job.run_after, timezone.now())
+
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            jobs.work(once=True)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+            self.client.force_login(self.staff)
+            data = self.client.post(f"/api/jobs/{job.pk}/retry/").json()
+            self.assertEqual((data["status"], data["attempts"], data["error"]), (Job.QUEUED, 0, ""))
+            self.assertEqual(self.client.post(f"/api/jobs/{job.pk}/retry/").status_code, 409)
+
+    def test_cancel(self):
+        queued = jobs.enqueue("rebuild_search")
+        self.assertTrue(jobs.cancel(queued))
+        self.assertIsNone(jobs.claim("test"))
+
+        def slow(progress):
+            Job.objects.filter(kind="slow").update(cancel_requested=True)  # as if cancelled from the API meanwhile
+            progress(1, 10, force=True)
+            return "not reached"
+
+        with mock.patch.dict(jobs.TASKS, {"slow": slow}):
+            job = jobs.enqueue("slow")
+            jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.CANCELLED, None))
+
+    def test_stale_jobs_are_requeued(self):
+        job = jobs.enqueue("rebuild_cube")
+        self.assertEqual(jobs.claim("gone:1").pk, job.pk)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim("alive:2").attempts, 2)
+
+    def test_api(self):
+        make_survey(questions=1)
+        self.assertEqual(self.client.get("/api/jobs/").status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.post("/api/jobs/", {"kind": "rm -rf"}, format="json").status_code, 400)
+        created = self.client.post("/api/jobs/", {"kind": "rebuild_cube", "params": {"waves": ["2025Q3"]}}, format="json")
+        self.assertEqual(created.status_code, 201)
+        jobs.work(once=True)
+        job = self.client.get(f"/api/jobs/{created.json()['id']}/").json()
+        self.assertEqual((job["status"], job["done"], job["total"], job["fraction"]), ("done", 1, 1, 1.0))
+        self.assertEqual(job["result"], {"waves": 1, "cells": 2})
+        listed = self.client.get("/api/jobs/", {"status": "done"}).json()
+        self.assertEqual([j["id"] for j in listed["results"]], [job["id"]])
+
+
+@override_settings(MICRODATA_DIR=tempfile.mkdtemp())
+class MicrodataTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=1)  # Q0 with options Да/Нет in 2025Q3
+        Survey.objects.create(title="Фронтир", wave=SurveyWave.objects.get(), is_frontier=True)
+        respondents = [
+            # city, survey, gender, weight, Q0
+            ("rudny", "Опрос", "М", 1.0, "Да"),
+            ("rudny", "Опрос", "Ж", 3.0, "Нет"),
+            ("Arkalyk", "Фронтир", "Ж", 2.0, "Да"),
+            ("arkalyk", "Фронтир", "М", 2.0, ""),
+        ]
+        write_wave("2025Q3", (
+            {"respondent_id": i, "city": city, "survey": survey, "gender": gender, "weight": weight, "Q0": answer}
+            for i, (city, survey, gender, weight, answer) in enumerate(respondents)
+        ))
+        self.store = MicrodataStore("2025Q3")
+
+    def test_columns(self):
+        self.assertEqual(self.store.questions(), ["Q0"])
+        self.assertEqual(self.store.labels("city"), ["rudny", "arkalyk"])
+        self.assertEqual(list(self.store.codes("Q0")), [0, 1, 0, -1])
+
+    def test_weighted_crosstab_and_filters(self):
+        table = self.store.crosstab("Q0")
+        rudny, arkalyk = table["rows"]
+        self.assertEqual((rudny["key"], rudny["base"], rudny["values"]), ("rudny", 2, {"Да": 25.0, "Нет": 75.0}))
+        self.assertEqual(arkalyk["values"], {"Да": 100.0, "Нет": 0.0})
+        self.assertEqual(self.store.crosstab("Q0", weighted=False)["rows"][0]["values"], {"Да": 50.0, "Нет": 50.0})
+        self.assertEqual(self.store.crosstab("Q0", by=None, filters={"gender": ["Ж"]})["total"]["values"], {"Да": 40.0, "Нет": 60.0})
+        self.assertEqual([r["key"] for r in self.store.crosstab("Q0", filters={"is_frontier": "1"})["rows"]], ["arkalyk"])
+
+    def test_endpoint(self):
+        data = self.client.get("/api/crosstab", {"wave": "2025Q3", "question": "Q0", "gender": "М,Ж", "by": "gender"}).json()
+        self.assertEqual([r["key"] for r in data["rows"]], ["М", "Ж"])
+        self.assertEqual(self.client.get("/api/crosstab", {"wave": "2025Q3", "question": "Q9"}).status_code, 404)
+        escaped = f"../{os.path.basename(microdata_root())}/2025Q3"  # the real wave, reached through ..
+        for wave in (escaped, "..", "/etc"):
+            self.assertEqual(self.client.get("/api/crosstab", {"wave": wave, "question": "Q0"}).status_code, 404)
+
+    def test_publish_updates_datapoints(self):
+        stats = publish("2025Q3")
+        self.assertEqual((stats["created"], stats["updated"]), (0, 4))
+        dp = DataPoint.objects.get(city__slug="rudny", option__label="Нет")
+        self.assertEqual(dp.value, Decimal("75.00"))
+        self.assertEqual(dp.extra, {"source": "microdata", "base": 2, "weighted_base": 4.0})
+        self.assertEqual(ChoroplethCell.objects.get(level="city", slug="rudny").average, 50.0)
+
+
+class AsyncViewTests(APITestCase):
+    """The async endpoints answer with the sync endpoints' bytes and cache protocol."""
+
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=2)
+        refresh_cube()
+
+    def test_same_json_as_sync(self):
+        pairs = (
+            ("/api/choropleth", "/api/async/choropleth", {"metric": "share", "wave": "2025Q3", "stats": "1"}),
+            ("/api/questions/grouped/", "/api/async/questions/grouped/", {"wave": "2025Q3", "city": "rudny"}),
+            ("/api/cities/", "/api/async/cities/", {}),
+        )
+        for sync_url, async_url, params in pairs:
+            expected = self.client.get(sync_url, params).content
+            response = async_to_sync(self.async_client.get)(async_url, params)
+            self.assertEqual(response.content, expected, async_url)
+
+    async def test_dashboard_and_conditional_get(self):
+        response = await self.async_client.get("/api/dashboard", {"wave": "2025Q3"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        again = await self.async_client.get("/api/dashboard", {"wave": "2025Q3"})
+        self.assertEqual(again["X-Cache"], "HIT")
+        etag = response["ETag"]
+        not_modified = await self.async_client.get("/api/dashboard", {"wave": "2025Q3"}, headers={"if-none-match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+
+
+@override_settings(SNAPSHOT_DIR=tempfile.mkdtemp())
+class SnapshotTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=2)
+        refresh_cube()
+        snapshots.remove(["2025Q3"])
+        site._registry[SurveyWave].lock_waves(admin_request(), SurveyWave.objects.all())
+
+    def test_lock_queues_build_and_snapshots_answer_without_queries(self):
+        job = Job.objects.get(kind="build_snapshots")
+        self.assertEqual(job.params, {"waves": ["2025Q3"]})
+        survey_id = Survey.objects.get().pk
+        requests = (
+            ("/api/choropleth", {"metric": "share", "wave": "2025Q3"}),
+            ("/api/surveys/", {"wave_code": "2025Q3"}),
+            ("/api/questions/grouped/", {"wave": "2025Q3", "survey_id": survey_id, "city": "rudny"}),
+        )
+        expected = [self.client.get(url, params).content for url, params in requests]
+        self.assertEqual(jobs.run(job.pk), Job.DONE)
+
+        for (url, params), body in zip(requests, expected):
+            with self.assertNumQueries(0):
+                response = self.client.get(url, params)
+            self.assertEqual(response["X-Cache"], "SNAPSHOT")
+            self.assertEqual(response.content, body, url)
+            self.assertIn("immutable", response["Cache-Control"])
+
+            packed = self.client.get(url, params, headers={"accept-encoding": "gzip, br;q=0"})
+            self.assertEqual(packed["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(packed.content), body)
+            again = self.client.get(url, params, headers={"if-none-match": response["ETag"]})
+            self.assertEqual(again.status_code, 304)
+
+        # the async twin reads the same file; other parameters go to the view
+        response = async_to_sync(self.async_client.get)("/api/async/choropleth", {"metric": "share", "wave": "2025Q3"})
+        self.assertEqual((response["X-Cache"], response.content), ("SNAPSHOT", expected[0]))
+        self.assertNotEqual(self.client.get("/api/choropleth", {"metric": "share", "wave": "2025Q3", "stats": 1})["X-Cache"], "SNAPSHOT")
+
+    def test_incremental_build_and_invalidation(self):
+        first = snapshots.build(["2025Q3"], workers=1)[0]
+        self.assertGreater(first["written"], 0)
+        self.assertTrue(snapshots.build(["2025Q3"], workers=1)[0]["skipped"])
+
+        point = DataPoint.objects.filter(city__slug="rudny").first()
+        point.value = Decimal("99.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            point.save()
+        self.assertIsNone(snapshots.read_manifest("2025Q3"))
+        self.assertNotEqual(self.client.get("/api/choropleth", {"metric": "share", "wave": "2025Q3"})["X-Cache"], "SNAPSHOT")
+        self.assertEqual(Job.objects.filter(kind="build_snapshots").count(), 2)
+
+        rebuilt = snapshots.build(["2025Q3"], workers=1)[0]
+        self.assertLess(rebuilt["written"], rebuilt["files"])  # unchanged responses keep their files
+        self.assertEqual(self.client.get("/api/choropleth", {"metric": "share", "wave": "2025Q3"})["X-Cache"], "SNAPSHOT")
+
+        site._registry[SurveyWave].unlock_waves(None, SurveyWave.objects.all())
+        self.assertFalse(os.path.exists(snapshots.wave_dir("2025Q3")))
+
+
+class DashboardTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=2)
+        Survey.objects.create(title="Второй", wave=SurveyWave.objects.get())
+
+    def get(self, **params):
+        return self.client.get("/api/dashboard", {"wave": "2025Q3", **params})
+
+    def test_components(self):
+        response = self.get(city="rudny", zoom=3)
+        data = response.json()
+        self.assertEqual(set(data), {"wave", "survey_id", "city", "cities", "surveys", "metrics", "questions"})
+        first = Survey.objects.order_by("id").first()
+        self.assertEqual((data["survey_id"], data["city"]), (first.id, "rudny"))
+        self.assertEqual([s["title"] for s in data["surveys"]], ["Опрос", "Второй"])
+        self.assertEqual([m["code"] for m in data["metrics"]], ["share"])
+        grouped = self.client.get("/api/questions/grouped/", {"wave": "2025Q3", "survey_id": first.id, "city": "rudny"}).json()
+        self.assertEqual(data["questions"], grouped)
+        self.assertEqual(self.get(city="nowhere").json()["city"], None)
+        self.assertEqual(self.get(survey_id="x").status_code, 400)
+
+    def test_partial_cache(self):
+        self.assertEqual(self.get()["X-Dashboard-Cache"], "cities=MISS, surveys=MISS, metrics=MISS, questions=MISS")
+        DataPoint.objects.filter(pk=DataPoint.objects.first().pk).update(value=Decimal("99"))
+        bump_models(waves=["2025Q3"])
+        response = self.get()
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response["X-Dashboard-Cache"], "cities=HIT, surveys=HIT, metrics=HIT, questions=MISS")
+        self.assertIn(99.0, [v for q in response.json()["questions"] for c in q["city_values"] for v in c.values()])
+
+
+    async def test_missing_params(self):
+        response = await self.async_client.get("/api/async/choropleth", {"wave": "2025Q3"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"], REPLICA_MAX_LAG=5, REPLICA_CHECK_INTERVAL=60)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        routers._health.clear()
+        self.lags = {"replica1": 0.5, "replica2": 0.5}
+        patcher = mock.patch.object(routers, "replica_lag", side_effect=lambda alias: self.lags[alias])
+        self.replica_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers._health.clear)
+
+    def route(self, method="get", path="/api/choropleth", model=DataPoint, cookies=None, write=False):
+        """(read alias for `model` inside the request, response) through ReplicaMiddleware."""
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        seen = []
+
+        def view(request):
+            router = routers.ReplicaRouter()
+            if write:
+                router.db_for_write(model)
+            seen.append(router.db_for_read(model))
+            return HttpResponse()
+        response = routers.ReplicaMiddleware(view)(request)
+        return seen[0], response
+
+    def test_api_reads_go_to_a_replica(self):
+        alias, response = self.route()
+        self.assertIn(alias, ("replica1", "replica2"))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertIsNone(self.route(path="/admin/analytics/datapoint/")[0])
+        self.assertIsNone(self.route(model=User)[0])
+        self.assertIsNone(routers.ReplicaRouter().db_for_read(DataPoint))  # outside a request
+
+    def test_lagging_or_unreachable_replicas_are_skipped_and_checks_cached(self):
+        self.lags = {"replica1": 30.0, "replica2": None}
+        self.assertIsNone(self.route()[0])
+        self.lags = {"replica1": 0.0, "replica2": 0.0}
+        self.assertIsNone(self.route()[0])  # still within the check interval
+        self.assertEqual(self.replica_lag.call_count, 2)
+        with override_settings(REPLICA_CHECK_INTERVAL=0):
+            self.assertIsNotNone(self.route()[0])
+
+    def test_read_your_writes(self):
+        alias, response = self.route(method="post", path="/admin/analytics/datapoint/1/change/")
+        self.assertIsNone(alias)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]["max-age"], settings.REPLICA_PIN_SECONDS)
+        self.assertIsNone(self.route(cookies={routers.PIN_COOKIE: "1"})[0])
+        self.assertIsNone(self.route(write=True)[0])  # a write moves the rest of the request to the primary
+
+    def test_replicas_are_not_migrated(self):
+        router = routers.ReplicaRouter()
+        self.assertTrue(router.allow_migrate("default", "analytics"))
+        self.assertFalse(router.allow_migrate("replica1", "analytics"))
+
+
+class ConnectionSettingsTests(TestCase):
+    def test_pool_and_persistent_connections_exclude_each_other(self):
+        pooled = database(pool=True)
+        self.assertNotIn("CONN_MAX_AGE", pooled)
+        self.assertNotIn("check", pooled["OPTIONS"]["pool"])  # Django passes it from CONN_HEALTH_CHECKS
+        persistent = database(pool=False)
+        self.assertNotIn("OPTIONS", persistent)
+        self.assertTrue(persistent["CONN_HEALTH_CHECKS"])
+
+    @skipUnless(
+        importlib.util.find_spec("psycopg") and importlib.util.find_spec("psycopg_pool"), "needs psycopg 3 and psycopg_pool",
+    )
+    def test_pool_is_built_from_settings(self):
+        from psycopg_pool import ConnectionPool
+
+        handler = ConnectionHandler({"default": database(pool=True)})
+        wrapper = handler["default"]
+        try:
+            pool = wrapper.pool  # created closed: nothing connects
+            self.assertIsInstance(pool, ConnectionPool)
+            self.assertEqual((pool.min_size, pool.max_size), (2, 10))
+        finally:
+            wrapper.close_pool()
+
+
+class ProfilingTests(QueryBudgetMixin, APITestCase):
+    ENDPOINTS = (
+        ("/api/regions/", {"zoom": 9}),
+        ("/api/cities/", {"zoom": 9}),
+        ("/api/waves/", {}),
+        ("/api/surveys/", {"wave_code": "2025Q3"}),
+        ("/api/questions/", {}),
+        ("/api/questions/grouped/", {"wave": "2025Q3"}),
+        ("/api/metrics/", {}),
+        ("/api/datapoints/", {"wave_code": "2025Q3"}),
+        ("/api/choropleth", {"metric": "share", "wave": "2025Q3"}),
+        ("/api/timeseries", {"metric": "share"}),
+        ("/api/dashboard", {"wave": "2025Q3"}),
+        ("/api/async/choropleth", {"metric": "share", "wave": "2025Q3"}),
+        ("/api/async/cities/", {}),
+        ("/api/async/questions/grouped/", {"wave": "2025Q3"}),
+    )
+
+    def setUp(self):
+        super().setUp()
+        make_survey(questions=6, cities=("rudny", "arkalyk", "lisakovsk"))
+        refresh_cube()
+        profiling.registry.reset()
+
+    def test_query_budgets(self):
+        for url, params in self.ENDPOINTS:
+            with self.subTest(url=url):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinBudget(response)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get("/api/questions/grouped/", {"wave": "2025Q3"})
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="3 queries", serialize;dur=[\d.]+, app;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertEqual(response.profile.bytes, len(response.content))
+        async_to_sync(self.async_client.get)("/api/async/cities/")
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn('kostanay_http_requests_total{view="question-grouped-list",method="GET",status="200"} 1', text)
+        self.assertIn('kostanay_db_queries_total{view="question-grouped-list"} 3', text)
+        self.assertIn('kostanay_db_queries_total{view="async-cities"} 2', text)
+        self.assertIn('kostanay_http_request_duration_seconds_count{view="async-cities"} 1', text)
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            self.assertEqual(self.client.get("/metrics", headers={"authorization": "Bearer secret"}).status_code, 200)
+
+    def test_slow_and_over_budget_log(self):
+        with override_settings(SLOW_REQUEST_MS=0), self.assertLogs("analytics.profiling", "WARNING") as logs:
+            self.client.get("/api/metrics/")
+        self.assertIn("(metric-list)", logs.output[0])
+        self.assertIn('FROM "analytics_metric"', logs.output[0])
+        get_store().clear()
+        with override_settings(QUERY_BUDGETS={"metric-list": 1}), self.assertLogs("analytics.profiling", "WARNING") as logs:
+            response = self.client.get("/api/metrics/")
+        self.assertIn("over budget 1", logs.output[0])
+        with self.assertRaises(AssertionError):
+            self.assertWithinBudget(response, 1)
+
+
+class SyntheticDataTests(APITestCase):
+    def test_generate_and_clear(self):
+        make_survey(questions=1)
+        stats = synthetic.generate(cities=3, waves=2, surveys=2, questions=2, options=3, levels=False, lock=True)
+        self.assertEqual(stats["rows"], 2 * 2 * 2 * 3 * 3)
+        self.assertEqual(City.objects.filter(slug__startswith="synthetic-", is_oblast=False).count(), 3)
+        self.assertEqual(list(SurveyWave.objects.filter(label="synthetic").values_list("code", "is_locked").order_by("code")),
+                         [("2024Q1", True), ("2024Q2", False)])
+        shares = DataPoint.objects.filter(wave__code="2024Q2", city__slug="synthetic-1-" + synthetic.city_templates()[0][0],
+                                          question__code="S1Q1")
+        self.assertAlmostEqual(float(sum(p.value for p in shares)), 100, delta=0.05)
+        with self.assertRaises(ValueError):
+            synthetic.generate(first_wave="2025Q3", waves=1, cities=1, levels=False)
+
+        self.assertEqual(synthetic.clear(), stats["rows"])
+        self.assertFalse(City.objects.filter(slug__startswith="synthetic-").exists())
+        self.assertEqual(DataPoint.objects.count(), 4)
+
+    def test_benchmark_cases_and_regressions(self):
+        make_survey()
+        refresh_cube()
+        cases, skipped = benchmark.endpoint_cases()
+        names = {name.split()[0] for name, *_ in cases}
+        self.assertEqual(names | set(skipped), set(benchmark._routes(benchmark.api_urls.urlpatterns)))
+        self.assertIn("choropleth", names)
+        results, _ = benchmark.run_endpoints(repeat=2, modes=("warm",), only="choropleth")
+        self.assertEqual(set(results), {"choropleth [warm]", "choropleth weighted region [warm]", "async-choropleth [warm]"})
+        self.assertEqual(results["choropleth [warm]"]["queries"], 1)
+
+        baseline = {"a": {"p95_ms": 10.0, "queries": 2}, "b": {"p95_ms": 10.0, "queries": 2}}
+        rows = benchmark.compare({"a": {"p95_ms": 20.0, "queries": 2}, "b": {"p95_ms": 11.0, "queries": 3}}, baseline)
+        self.assertEqual([(r[0], r[1]) for r in benchmark.regressions(rows)], [("a", "p95_ms"), ("b", "queries")])
@@ -0,0 +1,318 @@
+"""
+Mapbox Vector Tiles (spec v2.1) for district boundaries, encoded in pure Python.
+
+Geometries come from the pre-simplified FeatureLevel rows that fit the tile zoom,
+are projected to Web Mercator tile space, clipped to the tile (plus a small buffer)
+and quantized to EXTENT. Finished tiles are kept in an on-disk cache under
+settings.TILE_CACHE_DIR and dropped when a feature covering them is saved.
+"""
+import math
+import os
+import shutil
+import struct
+from urllib.parse import quote
+
+from django.conf import settings
+
+from .aggregation import choropleth_values
+from .geometry import bounding_box, iter_polygons, parse_feature, pick_level, tolerance_for_zoom
+from .models import Region, City, FeatureLevel
+
+EXTENT = 4096
+BUFFER = 64
+CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+# --- protobuf ----------------------------------------------------------------
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 31)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _uint(field, n):
+    return _key(field, 0) + _varint(n)
+
+
+def _packed(field, values):
+    return _bytes(field, b"".join(_varint(v) for v in values))
+
+
+def _value(v):
+    """Layer.Value message."""
+    if isinstance(v, bool):
+        return _uint(7, int(v))
+    if isinstance(v, int):
+        return _key(6, 0) + _varint((v << 1) ^ (v >> 63))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _bytes(1, str(v).encode("utf-8"))
+
+
+# --- geometry ----------------------------------------------------------------
+
+def tile_bounds(z, x, y):
+    """(min_lon, min_lat, max_lon, max_lat) of a tile."""
+    n = 2 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def tile_range(bbox, z):
+    """(x0, y0, x1, y1) inclusive tile indexes covering a lon/lat bbox at zoom z."""
+    n = 2 ** z
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    def tx(lon):
+        return min(n - 1, max(0, int((lon + 180) / 360 * n)))
+
+    def ty(lat):
+        lat = max(-85.0511, min(85.0511, lat))
+        rad = math.radians(lat)
+        return min(n - 1, max(0, int((1 - math.asinh(math.tan(rad)) / math.pi) / 2 * n)))
+
+    return tx(min_lon), ty(max_lat), tx(max_lon), ty(min_lat)
+
+
+def _project(ring, z, x, y):
+    scale = 2 ** z * EXTENT
+    out = []
+    for lon, lat, *_ in ring:
+        lat = max(-85.0511, min(85.0511, lat))
+        px = (lon + 180) / 360 * scale - x * EXTENT
+        py = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * scale - y * EXTENT
+        out.append((px, py))
+    return out
+
+
+def _clip(ring, lo, hi):
+    """Sutherland–Hodgman against the square [lo, hi]²."""
+    def edge(points, inside, cross):
+        if not points:
+            return points
+        out = []
+        prev = points[-1]
+        for cur in points:
+            if inside(cur):
+                if not inside(prev):
+                    out.append(cross(prev, cur))
+                out.append(cur)
+            elif inside(prev):
+                out.append(cross(prev, cur))
+            prev = cur
+        return out
+
+    def at_x(xv):
+        return lambda a, b: (xv, a[1] + (b[1] - a[1]) * (xv - a[0]) / (b[0] - a[0]))
+
+    def at_y(yv):
+        return lambda a, b: (a[0] + (b[0] - a[0]) * (yv - a[1]) / (b[1] - a[1]), yv)
+
+    points = ring[:-1] if len(ring) > 1 and ring[0] == ring[-1] else ring
+    points = edge(points, lambda p: p[0] >= lo, at_x(lo))
+    points = edge(points, lambda p: p[0] <= hi, at_x(hi))
+    points = edge(points, lambda p: p[1] >= lo, at_y(lo))
+    points = edge(points, lambda p: p[1] <= hi, at_y(hi))
+    return points
+
+
+def _area(ring):
+    return sum(ax * by - bx * ay for (ax, ay), (bx, by) in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+def _quantize(points):
+    out = []
+    for px, py in points:
+        p = (int(round(px)), int(round(py)))
+        if not out or out[-1] != p:
+            out.append(p)
+    if len(out) > 1 and out[0] == out[-1]:
+        out.pop()
+    return out
+
+
+def encode_polygons(polygons, z, x, y):
+    """MVT command stream for lon/lat polygons, or [] if nothing is left inside the tile."""
+    commands = []
+    cx = cy = 0
+    for rings in polygons:
+        for i, ring in enumerate(rings):
+            points = _quantize(_clip(_project(ring, z, x, y), -BUFFER, EXTENT + BUFFER))
+            area = _area(points) if len(points) >= 3 else 0
+            if not area:
+                if i == 0:
+                    break  # exterior is gone, so are its holes
+                continue
+            # exterior rings are clockwise in tile space (positive area, y down), holes the opposite
+            if (area > 0) != (i == 0):
+                points.reverse()
+            commands.append(1 | (1 << 3))  # MoveTo
+            commands += [_zigzag(points[0][0] - cx), _zigzag(points[0][1] - cy)]
+            cx, cy = points[0]
+            commands.append(2 | ((len(points) - 1) << 3))  # LineTo
+            for px, py in points[1:]:
+                commands += [_zigzag(px - cx), _zigzag(py - cy)]
+                cx, cy = px, py
+            commands.append(7 | (1 << 3))  # ClosePath
+    return commands
+
+
+# --- tiles -------------------------------------------------------------------
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _sources(model, level, bbox):
+    """(owner, geojson) pairs whose geometry touches bbox, at the FeatureLevel for `level`."""
+    owner_field = "region" if model is Region else "city"
+    owners = model.objects.all()
+    if model is City:
+        owners = owners.order_by("sort_order", "name")
+    if level:
+        levels = {
+            getattr(lv, f"{owner_field}_id"): lv
+            for lv in FeatureLevel.objects.filter(**{f"{owner_field}__isnull": False, "tolerance": level})
+        }
+    else:
+        owners = owners.select_related("geometry")
+    for owner in owners:
+        lv = levels.get(owner.id) if level else None
+        geojson = lv.feature if lv else parse_feature(owner.feature)
+        box = (lv.bbox if lv else None) or bounding_box(geojson)
+        if box and _intersects(box, bbox):
+            yield owner, geojson
+
+
+def build_layer(name, features, z, x, y):
+    keys, values, key_index, value_index, encoded = [], [], {}, {}, []
+    for fid, properties, polygons in features:
+        geometry = encode_polygons(polygons, z, x, y)
+        if not geometry:
+            continue
+        tags = []
+        for k, v in properties.items():
+            if v is None:
+                continue
+            if k not in key_index:
+                key_index[k] = len(keys)
+                keys.append(k)
+            vkey = (type(v).__name__, v)
+            if vkey not in value_index:
+                value_index[vkey] = len(values)
+                values.append(v)
+            tags += [key_index[k], value_index[vkey]]
+        encoded.append(_uint(1, fid) + _packed(2, tags) + _uint(3, 3) + _packed(4, geometry))
+    if not encoded:
+        return b""
+    body = _uint(15, 2) + _bytes(1, name.encode("utf-8"))
+    body += b"".join(_bytes(2, f) for f in encoded)
+    body += b"".join(_bytes(3, k.encode("utf-8")) for k in keys)
+    body += b"".join(_bytes(4, _value(v)) for v in values)
+    body += _uint(5, EXTENT)
+    return _bytes(3, body)
+
+
+def render_tile(z, x, y, metric=None, wave=None):
+    """
+    Tile with a `cities` and a `regions` layer; each feature carries slug, name and,
+    when metric and wave are given, the choropleth value.
+    """
+    level = pick_level(tolerance_for_zoom(z))
+    bbox = tile_bounds(z, x, y)
+    tile = b""
+    for layer, model, owner_level in (("cities", City, "city"), ("regions", Region, "region")):
+        values = dict(choropleth_values(metric, wave, owner_level)) if metric and wave else {}
+        features = []
+        for owner, geojson in _sources(model, level, bbox):
+            properties = {"slug": owner.slug, "name": owner.name, "value": values.get(owner.slug)}
+            if model is City:
+                properties["is_oblast"] = owner.is_oblast
+            features.append((owner.id, properties, list(iter_polygons(geojson))))
+        tile += build_layer(layer, features, z, x, y)
+    return tile
+
+
+# --- cache -------------------------------------------------------------------
+
+def cache_root():
+    return getattr(settings, "TILE_CACHE_DIR", os.path.join(settings.MEDIA_ROOT, "tiles"))
+
+
+def _segment(code):
+    # codes are free text: keep them to one path segment inside the cache
+    return quote(code, safe="") if code else "_"
+
+
+def cache_path(z, x, y, metric=None, wave=None):
+    return os.path.join(cache_root(), _segment(metric), _segment(wave), str(z), str(x), f"{y}.mvt")
+
+
+def get_tile(z, x, y, metric=None, wave=None):
+    path = cache_path(z, x, y, metric, wave)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    tile = render_tile(z, x, y, metric, wave)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(tile)
+    os.replace(tmp, path)
+    return tile
+
+
+def invalidate_bbox(bbox):
+    """Drop every cached tile (any metric/wave/zoom) that overlaps a lon/lat bbox."""
+    root = cache_root()
+    if not bbox or not os.path.isdir(root):
+        return
+    for metric in os.listdir(root):
+        for wave in os.listdir(os.path.join(root, metric)):
+            wave_dir = os.path.join(root, metric, wave)
+            for zoom in os.listdir(wave_dir):
+                if not zoom.isdigit():
+                    continue
+                x0, y0, x1, y1 = tile_range(bbox, int(zoom))
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        try:
+                            os.remove(os.path.join(wave_dir, zoom, str(x), f"{y}.mvt"))
+                        except FileNotFoundError:
+                            pass
+
+
+def invalidate_values(wave=None):
+    """Drop cached tiles that carry metric values, for one wave or all of them."""
+    root = cache_root()
+    if not os.path.isdir(root):
+        return
+    for metric in os.listdir(root):
+        if metric == "_":
+            continue
+        target = os.path.join(root, metric, _segment(wave)) if wave else os.path.join(root, metric)
+        shutil.rmtree(target, ignore_errors=True)
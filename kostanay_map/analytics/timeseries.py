@@ -0,0 +1,156 @@
+"""
+Cross-wave series, precomputed when a wave is locked.
+
+Locking a wave stores its SeriesPoint rows: per city/region the metric average
+(read from the choropleth cube) and the average of every question/option,
+keyed by question code and option label so the same question matches across
+waves. Deltas and rolling averages are then recomputed for the wave's cadence
+from the stored points only, so neither locking nor reading ever rescans the
+DataPoints of other waves. Unlocking a wave removes its points.
+
+Quarterly (2025Q3) and monthly (2025M07) waves form separate cadences; a delta
+always compares with the previous locked wave of the same cadence.
+"""
+import re
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from .cache import bump_models
+from .cube import LEVELS
+from .models import SurveyWave, DataPoint, ChoroplethCell, SeriesPoint
+
+ROLLING_WINDOW = 3
+CADENCES = ((re.compile(r"^\d{4}Q[1-4]$"), "quarter"), (re.compile(r"^\d{4}M\d{2}$"), "month"))
+KEY_FIELDS = ("metric_id", "question_code", "option_label", "level", "slug")
+
+
+def cadence_of(code):
+    for pattern, name in CADENCES:
+        if pattern.match(code):
+            return name
+    return "other"
+
+
+def _wave_key(wave):
+    # quarter and month codes sort chronologically; anything else goes by start date
+    if cadence_of(wave.code) == "other":
+        return wave.starts_at or date.min, wave.code
+    return date.min, wave.code
+
+
+def _wave_rows(wave):
+    """(metric_id, question_code, option_label, level, slug, metric_code, value, count) for one wave."""
+    rows = [
+        (metric_id, "", "", level, slug, metric_code or "", average, count)
+        for metric_id, metric_code, level, slug, average, count in ChoroplethCell.objects.filter(wave=wave)
+        .values_list("metric_id", "metric_code", "level", "slug", "average", "count")
+    ]
+    for level in LEVELS:
+        grouped = (
+            DataPoint.objects.filter(wave=wave, question__code__isnull=False, option__isnull=False)
+            .exclude(**{f"{level}__isnull": True})
+            .values("metric_id", "metric__code", "question__code", "option__label", f"{level}__slug")
+            .annotate(average=Avg("value"), count=Count("id"))
+            .order_by()
+        )
+        rows += [
+            (r["metric_id"], r["question__code"], r["option__label"], level, r[f"{level}__slug"],
+             r["metric__code"] or "", float(r["average"]), r["count"])
+            for r in grouped
+        ]
+    return rows
+
+
+def refresh_cadence(cadence):
+    """Recompute position, delta and rolling for every stored point of one cadence. Returns points changed."""
+    waves = sorted(
+        (w for w in SurveyWave.objects.filter(is_locked=True) if cadence_of(w.code) == cadence), key=_wave_key,
+    )
+    positions = {w.id: i for i, w in enumerate(waves)}
+    series = defaultdict(dict)
+    points = list(SeriesPoint.objects.filter(cadence=cadence))
+    stored = {point.pk: (point.position, point.delta, point.rolling) for point in points}
+    for point in points:
+        point.position = positions.get(point.wave_id, -1)
+        series[tuple(getattr(point, f) for f in KEY_FIELDS)][point.position] = point
+
+    for by_position in series.values():
+        for position, point in by_position.items():
+            previous = by_position.get(position - 1)
+            point.delta = None if previous is None else point.value - previous.value
+            window = [by_position[p].value for p in range(position - ROLLING_WINDOW + 1, position + 1) if p in by_position]
+            point.rolling = sum(window) / len(window)
+    # locking the newest wave only changes its own points; the rest are written back only when they moved
+    changed = [p for p in points if stored[p.pk] != (p.position, p.delta, p.rolling)]
+    SeriesPoint.objects.bulk_update(changed, ["position", "delta", "rolling"], batch_size=2000)
+    return len(changed)
+
+
+def refresh_waves(waves):
+    """
+    Store the points of locked waves and drop those of unlocked ones, then refresh
+    the affected cadences. `waves`: SurveyWave objects or a queryset. Returns points stored.
+    """
+    waves = list(waves)
+    stored = 0
+    with transaction.atomic():
+        for wave in waves:
+            SeriesPoint.objects.filter(wave=wave).delete()
+            if not wave.is_locked:
+                continue
+            cadence = cadence_of(wave.code)
+            points = [
+                SeriesPoint(
+                    wave=wave, wave_code=wave.code, cadence=cadence, metric_code=metric_code, value=value, count=count,
+                    **dict(zip(KEY_FIELDS, key)),
+                )
+                for *key, metric_code, value, count in _wave_rows(wave)
+            ]
+            SeriesPoint.objects.bulk_create(points, batch_size=2000)
+            stored += len(points)
+        for cadence in {cadence_of(w.code) for w in waves}:
+            refresh_cadence(cadence)
+        bump_models(SeriesPoint)
+    return stored
+
+
+def series(metric=None, question=None, option=None, level="city", slugs=None, waves=None, cadence=None):
+    """
+    {"waves": [code, ...], "series": [{"metric", "question", "option", "slug", "points": [...]}]}
+    with points {"wave", "value", "delta", "rolling", "count"} in wave order. One query.
+    Without `question` only whole-metric series are returned.
+    """
+    qs = SeriesPoint.objects.filter(level=level)
+    if metric:
+        qs = qs.filter(metric_code=metric)
+    if question:
+        qs = qs.filter(question_code=question)
+        if option:
+            qs = qs.filter(option_label=option)
+    else:
+        qs = qs.filter(question_code="")
+    if slugs:
+        qs = qs.filter(slug__in=slugs)
+    if waves:
+        qs = qs.filter(wave_code__in=waves)
+    if cadence:
+        qs = qs.filter(cadence=cadence)
+    rows = qs.order_by("cadence", "position", "slug").values_list(
+        "wave_code", *KEY_FIELDS, "metric_code", "value", "delta", "rolling", "count",
+    )
+
+    wave_codes, by_key = [], {}
+    for wave_code, metric_id, question_code, option_label, _, slug, metric_code, value, delta, rolling, count in rows:
+        if wave_code not in wave_codes:
+            wave_codes.append(wave_code)
+        key = (metric_id, question_code, option_label, slug)
+        if key not in by_key:
+            by_key[key] = {
+                "metric": metric_code, "question": question_code or None, "option": option_label or None,
+                "slug": slug, "points": [],
+            }
+        by_key[key]["points"].append({"wave": wave_code, "value": value, "delta": delta, "rolling": rolling, "count": count})
+    return {"waves": wave_codes, "series": sorted(by_key.values(), key=lambda s: (s["slug"], s["metric"], s["question"] or "", s["option"] or ""))}
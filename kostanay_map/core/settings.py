@@ -1,3 +1,4 @@
+import importlib.util
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -24,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'analytics.profiling.ProfilingMiddleware',
+    'analytics.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -32,6 +35,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'analytics.snapshots.SnapshotMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -54,16 +58,56 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'core.wsgi.application'
 
-DATABASES = {
-    'default': {
+# One primary and optional read replicas (analytics.routers): DB_REPLICAS is a
+# comma-separated list of host[:port][/name], e.g. "db2,db3:5433" or, for two local
+# databases, "localhost/kostanay_replica"; user and password are the primary's.
+# Connections come from a psycopg 3 pool per database (shared by the WSGI threads
+# and the ASGI async views' database thread); Django checks a pooled connection
+# before handing it out when CONN_HEALTH_CHECKS is on. Without psycopg 3 and
+# psycopg_pool or with DB_POOL=False they are kept open for DB_CONN_MAX_AGE
+# seconds and checked before reuse instead.
+DB_POOL = (
+    os.getenv('DB_POOL', 'True') == 'True'
+    and importlib.util.find_spec('psycopg') is not None
+    and importlib.util.find_spec('psycopg_pool') is not None
+)
+
+
+def database(host=None, port=None, name=None, pool=DB_POOL):
+    config = {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv('DB_NAME'),
+        'NAME': name or os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
-        'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT'),
+        'HOST': host or os.getenv('DB_HOST'),
+        'PORT': port or os.getenv('DB_PORT'),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
     }
-}
+    if pool:
+        config['OPTIONS'] = {'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX', 10)),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 600)),
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+        }}
+    else:
+        config['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    return config
+
+
+DATABASES = {'default': database()}
+DATABASE_REPLICAS = []
+for n, address in enumerate(filter(None, (a.strip() for a in os.getenv('DB_REPLICAS', '').split(','))), 1):
+    address, _, name = address.partition('/')
+    host, _, port = address.partition(':')
+    DATABASES[f'replica{n}'] = {**database(host, port, name), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{n}')
+DATABASE_ROUTERS = ['analytics.routers.ReplicaRouter']
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))  # seconds behind the primary before a replica is skipped
+REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 10))  # reads stay on the primary after a write
+REPLICA_PATHS = ('/api/',)
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -81,9 +125,33 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+TILE_CACHE_DIR = os.getenv('TILE_CACHE_DIR', MEDIA_ROOT / 'tiles')
+MICRODATA_DIR = os.getenv('MICRODATA_DIR', MEDIA_ROOT / 'microdata')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', MEDIA_ROOT / 'snapshots')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# API response cache (analytics.cache): locmem | file | redis.
+# Without the redis client installed, "redis" falls back to the local-memory stand-in.
+API_CACHE_BACKEND = os.getenv('API_CACHE_BACKEND', 'locmem')
+if API_CACHE_BACKEND == 'redis' and importlib.util.find_spec('redis') is None:
+    API_CACHE_BACKEND = 'locmem'
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 24 * 3600))
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'api': {
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api'},
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('API_CACHE_DIR', MEDIA_ROOT / 'api-cache'),
+        },
+        'redis': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        },
+    }[API_CACHE_BACKEND],
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -91,8 +159,17 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'analytics.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Request profiling (analytics.profiling): Server-Timing, /metrics and the slow-request log.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+
 CORS_ALLOW_ALL_ORIGINS = False
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
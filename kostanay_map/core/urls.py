@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from analytics.profiling import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('analytics.api.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]